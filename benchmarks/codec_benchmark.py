@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the CBOR codec in cbor_utils. Measures _numpy_encoder, write_cbor,
+decode_tags, loads_cbor, load_cbor, _decode_tag_40 and _decode_homogenous_arary for
+every dtype of _dtype_map, 1-D and N-D shapes, contiguous and strided arrays, and small
+and large arrays.
+
+Reported per case:
+    ns_per_call, ns_per_element: best of the repeats
+    peak_alloc_bytes: peak memory allocated during one call, from tracemalloc
+    copies: peak_alloc_bytes divided by the size of the array, i.e. how many
+            array-sized buffers one call allocates
+
+Example:
+    python3 benchmarks/codec_benchmark.py --output codec.json
+    python3 benchmarks/codec_benchmark.py --quick --baseline codec.json
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import cbor2
+import numpy as np
+
+import tmpfs_framework
+from tmpfs_framework.cbor_utils import (_dtype_map, _numpy_encoder, write_cbor, decode_tags,
+                                        loads_cbor, load_cbor, _decode_tag_40,
+                                        _decode_homogenous_arary)
+
+from common import write_results, compare
+
+SIZES = {"small": 64, "large": 4 * 2**20}
+LAYOUTS = ("1d", "nd", "1d_strided", "nd_strided")
+
+
+def make_array(dtype, nbytes, layout):
+    """
+    Create test array of about nbytes bytes.
+
+    Parameters:
+    dtype (numpy.dtype): Data type.
+    nbytes (int): Size of the array in bytes.
+    layout (str): One of LAYOUTS. Strided arrays are views of every other element.
+
+    Returns:
+    numpy.ndarray: Test array.
+    """
+    n = max(nbytes // dtype.itemsize, 8)
+    strided = layout.endswith("strided")
+    base = np.arange(2 * n if strided else n).astype(dtype)
+    if layout.startswith("nd"):
+        rows = max(int(n ** 0.5) // 4 * 4, 4)
+        base = base[:(base.size // rows) * rows].reshape(rows, -1)
+        return base[:, ::2] if strided else base
+    return base[::2] if strided else base
+
+
+def measure(func, min_time=0.1, repeat=3):
+    """
+    Time func and measure its peak allocation.
+
+    Returns:
+    tuple: Best time per call in nanoseconds and peak allocated bytes of one call.
+    """
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9 / repeat or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter_ns() - start)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return best / number, peak
+
+
+def cases(array, tag, path):
+    """
+    Functions to benchmark for one array.
+
+    Returns:
+    dict: Function name -> callable.
+    """
+    encoded = cbor2.dumps(array, default=_numpy_encoder)
+    flat = np.ascontiguousarray(array).reshape(-1)
+    typed = cbor2.CBORTag(tag, flat.tobytes())
+    nested = cbor2.CBORTag(40, [list(array.shape), flat])
+    encoded_path = path + ".encoded"
+    with open(encoded_path, 'wb') as fd:
+        fd.write(encoded)
+
+    def load():
+        with open(encoded_path, 'rb') as fd:
+            return load_cbor(fd)
+
+    return {
+        "_numpy_encoder": lambda: cbor2.dumps(array, default=_numpy_encoder),
+        "write_cbor": lambda: write_cbor(path, array),
+        "decode_tags": lambda: cbor2.loads(encoded, tag_hook=decode_tags),
+        "loads_cbor": lambda: loads_cbor(encoded),
+        "load_cbor": load,
+        "_decode_tag_40": lambda: _decode_tag_40(None, nested),
+        "_decode_homogenous_arary": lambda: _decode_homogenous_arary(None, typed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", help="Directory for write_cbor. Defaults to a temp dir in /dev/shm.")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=SIZES)
+    parser.add_argument("--layouts", nargs="+", default=list(LAYOUTS), choices=LAYOUTS)
+    parser.add_argument("--min-time", type=float, default=0.1, help="Seconds spent per case.")
+    parser.add_argument("--quick", action="store_true", help="Small sweep for smoke testing.")
+    parser.add_argument("--output", help="JSON output file. Defaults to stdout.")
+    parser.add_argument("--baseline", help="Earlier JSON output to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative change reported as regression.")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.min_time = 0.01
+
+    cleanup = args.path is None
+    path = args.path or tempfile.mkdtemp(prefix="tmpfs_benchmark_",
+                                         dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    os.makedirs(path, exist_ok=True)
+    tmpfs_framework.TMPFS_PATH = path
+    results = []
+    try:
+        for tag, dtype in _dtype_map.items():
+            for size in args.sizes:
+                for layout in args.layouts:
+                    array = make_array(dtype, SIZES[size], layout)
+                    for name, func in cases(array, tag, os.path.join(path, "value")).items():
+                        if name == "_decode_homogenous_arary" and array.ndim > 1:
+                            #typed arrays are always flat, shape is in the surrounding tag 40
+                            continue
+                        if name in ("_decode_tag_40", "_decode_homogenous_arary") and layout.endswith("strided"):
+                            #decoded input is always contiguous
+                            continue
+                        ns, peak = measure(func, args.min_time)
+                        result = {"case": f"{name}/{tag}/{size}/{layout}", "function": name, "tag": tag,
+                                  "dtype": dtype.str, "shape": list(array.shape), "layout": layout,
+                                  "nbytes": array.nbytes, "ns_per_call": ns,
+                                  "ns_per_element": ns / array.size, "peak_alloc_bytes": peak,
+                                  "copies": peak / array.nbytes}
+                        print(f"{result['case']} {dtype}: {ns / 1e3:.1f} us/call "
+                              f"{result['ns_per_element']:.2f} ns/element {result['copies']:.2f} copies",
+                              file=sys.stderr)
+                        results.append(result)
+    finally:
+        if cleanup:
+            shutil.rmtree(path, ignore_errors=True)
+
+    write_results("codec", results, args.output, path)
+    if args.baseline:
+        regressions = compare(args.baseline, results, {"ns_per_element": False}, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
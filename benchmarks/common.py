@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the benchmark scripts: environment description, percentiles,
+JSON output and comparison against a baseline result file.
+"""
+import os
+import sys
+import json
+import time
+import platform
+
+import numpy as np
+
+
+def environment(path=None):
+    """
+    Describe the machine and filesystem the benchmark ran on.
+
+    Parameters:
+    path (str, optional): Directory used for the benchmark files.
+
+    Returns:
+    dict: Environment description.
+    """
+    import cbor2
+    info = {"python": sys.version.split()[0], "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__,
+            "cbor2": getattr(cbor2, "__version__", None),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+    if path is not None:
+        info["path"] = path
+        info["filesystem"] = filesystem_type(path)
+    return info
+
+
+def filesystem_type(path):
+    """
+    Find the filesystem type of the mount holding path from /proc/mounts.
+
+    Parameters:
+    path (str): Any path.
+
+    Returns:
+    str: Filesystem type, e.g. "tmpfs", or None if it could not be determined.
+    """
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as fd:
+            for line in fd:
+                _, mountpoint, mount_type = line.split()[:3]
+                if (path == mountpoint or path.startswith(mountpoint.rstrip("/") + "/")) \
+                        and len(mountpoint) > len(best):
+                    best, fstype = mountpoint, mount_type
+    except OSError:
+        pass
+    return fstype
+
+
+def percentiles(values, scale=1.0):
+    """
+    Summarize latency samples.
+
+    Parameters:
+    values (list): Samples.
+    scale (float, optional): Samples are divided by scale. Defaults to 1.0.
+
+    Returns:
+    dict: Count, mean, p50, p90, p99, p99.9 and max, or only count if there are no samples.
+    """
+    if len(values) == 0:
+        return {"count": 0}
+    a = np.asarray(values, dtype=np.float64) / scale
+    p50, p90, p99, p999 = np.percentile(a, [50, 90, 99, 99.9])
+    return {"count": int(a.size), "mean": float(a.mean()), "p50": float(p50), "p90": float(p90),
+            "p99": float(p99), "p99.9": float(p999), "max": float(a.max())}
+
+
+def write_results(benchmark, results, output=None, path=None):
+    """
+    Write results as JSON.
+
+    Parameters:
+    benchmark (str): Name of the benchmark.
+    results (list): Result of each case. Every result has unique "case" key.
+    output (str, optional): Output file. Defaults to stdout.
+    path (str, optional): Directory used for the benchmark files.
+    """
+    document = {"benchmark": benchmark, "environment": environment(path), "results": results}
+    if output is None:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output, "w") as fd:
+            json.dump(document, fd, indent=2)
+
+
+def compare(baseline_file, results, metrics, threshold=0.2):
+    """
+    Compare results against a baseline result file and report regressions.
+
+    Parameters:
+    baseline_file (str): JSON file written earlier by the same benchmark.
+    results (list): Current results.
+    metrics (dict): Metric path separated by "/" -> True if higher is better,
+                    e.g. {"latency_us/p99": False}.
+    threshold (float, optional): Relative change counted as regression. Defaults to 0.2.
+
+    Returns:
+    list: Description of each regression.
+    """
+    with open(baseline_file) as fd:
+        baseline = {r["case"]: r for r in json.load(fd)["results"]}
+    regressions = []
+    for result in results:
+        old = baseline.get(result["case"])
+        if old is None:
+            continue
+        for metric, higher_is_better in metrics.items():
+            a, b = _lookup(old, metric), _lookup(result, metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            if (change < -threshold) if higher_is_better else (change > threshold):
+                regressions.append(f"{result['case']}: {metric} {a:.4g} -> {b:.4g} ({change:+.0%})")
+    return regressions
+
+
+def _lookup(result, metric):
+    for key in metric.split("/"):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end IPC benchmark. A writer process publishes payloads through SensorWriter
+while reader processes receive them with attach_watchdog, polling or snapshot
+recording. Publish-to-callback latency is measured with CLOCK_MONOTONIC, which is
+shared by all processes of the machine.
+
+Example:
+    python3 benchmarks/ipc_benchmark.py --path /dev/shm/bench --duration 2 --output ipc.json
+    python3 benchmarks/ipc_benchmark.py --quick --baseline ipc.json
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import tmpfs_framework
+from tmpfs_framework import SensorWriter, SensorReader
+
+from common import percentiles, write_results, compare
+
+PAYLOADS = ("scalar", "dict", "array1d", "arraynd", "zip")
+MODES = ("watchdog", "poll", "record")
+DIR = "ipc_benchmark"
+SENSOR = "sensor"
+
+
+def make_payload(kind, size):
+    """
+    Create payload of given kind. Size is the number of array bytes, ignored for scalars.
+
+    Parameters:
+    kind (str): One of PAYLOADS.
+    size (int): Approximate payload size in bytes.
+
+    Returns:
+    Any: Payload without the timestamp.
+    """
+    if kind == "scalar":
+        return None
+    if kind == "dict":
+        n = max(size // 16, 1)
+        return {f"key{i}": float(i) for i in range(n)}
+    if kind == "array1d":
+        return np.random.random(max(size // 4, 1)).astype(np.float32)
+    side = max(int((size / 3) ** 0.5), 1)
+    return np.random.randint(0, 255, (side, side, 3), dtype=np.uint8)
+
+
+def channel_name(kind):
+    """
+    Name of the file readers watch. Other payloads are written as directory where
+    timestamp file is written after the data.
+    """
+    if kind == "scalar":
+        return "payload"
+    if kind == "zip":
+        return "payload.zip"
+    return "payload/t"
+
+
+def publish(writer, kind, payload):
+    t = time.monotonic_ns()
+    if kind == "scalar":
+        writer.write("payload", t)
+    elif kind == "zip":
+        writer.write_zip("payload", {"data": payload, "t": t})
+    else:
+        writer.write("payload", {"data": payload, "t": t})
+
+
+def receive(reader, kind, value):
+    """
+    Read the whole payload after watched file has changed.
+
+    Returns:
+    int: Publish time of the payload.
+    """
+    if kind == "scalar":
+        return value
+    if kind == "zip":
+        return value["t"]
+    reader.get_value("payload/data")
+    return value
+
+
+def payload_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def writer_process(path, kind, size, rate, duration, barrier, done, result_queue):
+    writer = SensorWriter(DIR, SENSOR, tmpfs_path=path)
+    payload = make_payload(kind, size)
+    publish(writer, kind, payload)
+    barrier.wait()
+    interval = 1 / rate if rate else 0
+    start = time.monotonic()
+    deadline = start
+    published = 0
+    while time.monotonic() - start < duration:
+        publish(writer, kind, payload)
+        published += 1
+        if interval:
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.monotonic() - start
+    #let readers receive the last messages
+    time.sleep(0.2)
+    done.set()
+    result_queue.put(("writer", published, elapsed))
+
+
+def reader_process(path, kind, mode, poll_interval, barrier, done, result_queue):
+    reader = SensorReader(DIR, SENSOR, tmpfs_path=path)
+    name = channel_name(kind)
+    latencies = []
+
+    def on_update(value):
+        t = receive(reader, kind, value)
+        latencies.append(time.monotonic_ns() - t)
+
+    if mode == "watchdog":
+        reader.attach_watchdog(name, on_update)
+        barrier.wait()
+        done.wait()
+        result_queue.put(("reader", latencies, None))
+    elif mode == "poll":
+        reader.has_changed(name)
+        barrier.wait()
+        while not done.is_set():
+            try:
+                if reader.has_changed(name):
+                    on_update(reader.get_value(name))
+                elif poll_interval:
+                    time.sleep(poll_interval)
+            except (FileNotFoundError, EOFError, ValueError):
+                #writer replaced the directory of a zip between stat and read
+                pass
+        result_queue.put(("reader", latencies, None))
+    else:
+        data_dir = tempfile.mkdtemp(prefix="ipc_benchmark_record_")
+        try:
+            reader.to_watch = name
+            reader.start_write(data_dir, compresslevel=0, format="segments")
+            barrier.wait()
+            done.wait()
+            reader.stop_watchdog()
+            stats = reader.recording_stats()
+            stats["bytes"] = sum(os.path.getsize(os.path.join(data_dir, f)) for f in os.listdir(data_dir))
+            result_queue.put(("reader", [], stats))
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def run_case(path, kind, size, rate, readers, mode, duration, poll_interval):
+    """
+    Run one benchmark case with a writer and the given number of reader processes.
+
+    Returns:
+    dict: Results of the case.
+    """
+    shutil.rmtree(os.path.join(path, DIR), ignore_errors=True)
+    ctx = multiprocessing.get_context("fork")
+    result_queue = ctx.Queue()
+    #writer starts publishing when all readers are ready
+    barrier = ctx.Barrier(readers + 1)
+    done = ctx.Event()
+    writer = ctx.Process(target=writer_process,
+                         args=(path, kind, size, rate, duration, barrier, done, result_queue))
+    writer.start()
+    #readers need the sensor directory created by the first write
+    while not os.path.exists(os.path.join(path, DIR, SENSOR, channel_name(kind))):
+        if not writer.is_alive():
+            raise RuntimeError("Writer process failed")
+        time.sleep(0.01)
+    procs = [ctx.Process(target=reader_process,
+                         args=(path, kind, mode, poll_interval, barrier, done, result_queue))
+             for _ in range(readers)]
+    for p in procs:
+        p.start()
+    latencies, received, recording = [], 0, []
+    published = elapsed = None
+    for _ in range(readers + 1):
+        role, a, b = result_queue.get()
+        if role == "writer":
+            published, elapsed = a, b
+        else:
+            latencies.extend(a)
+            received += len(a)
+            if b is not None:
+                recording.append(b)
+    for p in [writer] + procs:
+        p.join()
+
+    size_bytes = payload_bytes(os.path.join(path, DIR, SENSOR, channel_name(kind).split("/")[0]))
+    result = {"case": f"{mode}/{kind}/{size}/{rate or 'max'}/{readers}",
+              "mode": mode, "payload": kind, "size": size, "rate": rate, "readers": readers,
+              "payload_bytes": size_bytes, "published": published,
+              "publish_rate": published / elapsed}
+    if mode == "record":
+        written = sum(r["written"] for r in recording)
+        result["recording"] = recording
+        result["throughput_msgs"] = written / elapsed
+        result["throughput_MBps"] = sum(r["bytes"] for r in recording) / elapsed / 1e6
+    else:
+        result["received"] = received
+        result["delivery_ratio"] = received / (published * readers) if published else 0
+        result["throughput_msgs"] = received / elapsed
+        result["throughput_MBps"] = received * size_bytes / elapsed / 1e6
+        result["latency_us"] = percentiles(latencies, scale=1e3)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", help="Directory on tmpfs for the benchmark. Defaults to a temp dir in /dev/shm.")
+    parser.add_argument("--payloads", nargs="+", default=list(PAYLOADS), choices=PAYLOADS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1024, 1 << 20])
+    parser.add_argument("--rates", nargs="+", type=float, default=[100, 0],
+                        help="Publish rates in Hz, 0 for as fast as possible.")
+    parser.add_argument("--readers", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per case.")
+    parser.add_argument("--poll-interval", type=float, default=0.0001)
+    parser.add_argument("--quick", action="store_true", help="Small sweep for smoke testing.")
+    parser.add_argument("--output", help="JSON output file. Defaults to stdout.")
+    parser.add_argument("--baseline", help="Earlier JSON output to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative change reported as regression.")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes, args.rates, args.readers, args.duration = [1024], [200], [1], 0.5
+
+    cleanup = args.path is None
+    path = args.path or tempfile.mkdtemp(prefix="tmpfs_benchmark_",
+                                         dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    os.makedirs(path, exist_ok=True)
+    #temp files must be on the same filesystem as the published files
+    tmpfs_framework.TMPFS_PATH = path
+    results = []
+    try:
+        for mode, kind, size, rate, readers in itertools.product(args.modes, args.payloads, args.sizes,
+                                                                  args.rates, args.readers):
+            if kind == "scalar" and size != args.sizes[0]:
+                continue
+            if mode == "record" and readers != args.readers[0]:
+                continue
+            result = run_case(path, kind, size, rate, readers, mode, args.duration, args.poll_interval)
+            line = f"{result['case']}: {result['throughput_msgs']:.0f} msg/s"
+            if result.get("latency_us", {}).get("count"):
+                line += f" p50={result['latency_us']['p50']:.1f} us p99={result['latency_us']['p99']:.1f} us"
+            print(line, file=sys.stderr)
+            results.append(result)
+    finally:
+        if cleanup:
+            shutil.rmtree(path, ignore_errors=True)
+
+    write_results("ipc", results, args.output, path)
+    if args.baseline:
+        regressions = compare(args.baseline, results, {"latency_us/p50": False, "latency_us/p99": False,
+                                                       "throughput_msgs": True}, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -45,7 +45,8 @@ class NetworkStatLogger(SensorWriter):
                 for key in netdev:
                     if key in wireless:
                         netdev[key].update(wireless[key])
-                self.write(".",netdev)
+                    #all fields of an interface in one packed file instead of a file per field
+                    self.write(os.path.join(key, "netdev"), netdev[key], packed=True)
                 sleep(0.05)
 
 def parse_file(filename,fieldnames, wireless=False):
@@ -1,19 +1,12 @@
-import os
 from time import sleep
 
-import tmpfs_framework
 from tmpfs_framework import SensorReader
 
 class NetworkStatsReader(SensorReader):
   def __init__ (self, directory='network_stats', name=None, *args,**kwargs):
-    if(name is None or type(name) is int ):
-      if(name is None):
-        name=-1
-      files =os.listdir(f'{tmpfs_framework.TMPFS_PATH}/{directory}')
-      name = files[name]
-
+    #SensorReader picks interface by index from the channel registry if name is not given
     super().__init__(directory=directory,filename=name,*args,**kwargs)
-    self.to_watch = "wireless_status"
+    self.to_watch = "netdev.rec"
 
 if __name__=="__main__":
     import matplotlib.pyplot as plt
@@ -4,3 +4,7 @@ TMPFS_PATH = os.environ.get("TMPFS_PATH", default='/home/robot/tmp/')
 
 from .sensor_reader import SensorReader
 from .sensor_writer import SensorWriter
+from .async_reader import AsyncSensorReader
+from .shared_array import SharedArrayWriter, SharedArrayReader
+from .replay import Replayer
+from .metrics import MetricsPublisher
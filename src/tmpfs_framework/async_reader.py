@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio counterpart of SensorReader. Updates are delivered by an inotify file
+descriptor registered directly with the event loop, so no extra threads are used.
+"""
+import os
+import asyncio
+import functools
+
+from .sensor_reader import SensorReader
+from .inotify import Inotify, IN_Q_OVERFLOW, IN_IGNORED
+
+
+class _Subscription:
+    def __init__(self, key):
+        self.key = key
+        self.event = asyncio.Event()
+        self.error = None
+
+
+class AsyncSensorReader(SensorReader):
+    """
+    SensorReader with asyncio update streams.
+
+    Example:
+        async for image in reader.updates("image"):
+            ...
+        count = await reader.next("count", timeout=1.0)
+
+    Updates are coalesced: if several writes land before the consumer is ready,
+    only the latest value is decoded and delivered.
+    """
+    def __init__(self, directory, filename=None, decode_in_executor=False, executor=None, **kwargs):
+        """
+        Initialize the AsyncSensorReader object. Accepts same arguments as SensorReader.
+
+        Parameters:
+        decode_in_executor (bool, optional): Decode values in executor instead of the event
+                                             loop thread. Defaults to False.
+        executor (concurrent.futures.Executor, optional): Executor used for decoding.
+                                                          Defaults to loop's default executor.
+                                                          Must not be the executor of parallel,
+                                                          whose workers it would wait for.
+        """
+        super().__init__(directory, filename, **kwargs)
+        if executor is not None and executor is self._parallel_executor:
+            raise ValueError("executor and parallel must be different executors")
+        self.decode_in_executor = decode_in_executor
+        self.executor = executor
+        self._loop = None
+        self._inotify = None
+        self._wds = {}            # directory -> watch descriptor
+        self._dirs = {}           # watch descriptor -> directory
+        self._subscriptions = {}  # (watch descriptor, name) -> set of _Subscription
+
+    def _subscribe(self, name):
+        loop = asyncio.get_running_loop()
+        if self._inotify is None:
+            self._inotify = Inotify(nonblocking=True)
+            self._loop = loop
+            loop.add_reader(self._inotify.fd, self._on_readable)
+        elif loop is not self._loop:
+            raise RuntimeError("AsyncSensorReader can only be used from one event loop")
+
+        dirpath, basename = os.path.split(os.path.abspath(self.get_value_path(name)))
+        wd = self._wds.get(dirpath)
+        if wd is None:
+            wd = self._inotify.add_watch(dirpath)
+            self._wds[dirpath] = wd
+            self._dirs[wd] = dirpath
+        subscription = _Subscription((wd, basename))
+        self._subscriptions.setdefault(subscription.key, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.key)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if subscriptions:
+            return
+        del self._subscriptions[subscription.key]
+        wd = subscription.key[0]
+        if not any(key[0] == wd for key in self._subscriptions) and wd in self._dirs:
+            self._wds.pop(self._dirs.pop(wd))
+            self._inotify.rm_watch(wd)
+
+    def _on_readable(self):
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                #events were lost, wake everyone to re-read their values
+                for subscriptions in self._subscriptions.values():
+                    for subscription in subscriptions:
+                        subscription.event.set()
+                continue
+            if mask & IN_IGNORED:
+                self._rearm(wd)
+                continue
+            for subscription in self._subscriptions.get((wd, name), ()):
+                subscription.event.set()
+
+    def _rearm(self, wd):
+        """
+        Add watch of a directory again after kernel has dropped it, e.g. because the
+        directory was replaced. Subscribers are woken up to re-read values that exist,
+        or to raise the error if the directory can not be watched anymore.
+        """
+        dirpath = self._dirs.pop(wd, None)
+        if dirpath is None:
+            return
+        self._wds.pop(dirpath, None)
+        keys = [key for key in self._subscriptions if key[0] == wd]
+        if not keys:
+            return
+        try:
+            new_wd = self._inotify.add_watch(dirpath)
+            self._wds[dirpath] = new_wd
+            self._dirs[new_wd] = dirpath
+            error = None
+        except OSError as e:
+            error = e
+        for key in keys:
+            subscriptions = self._subscriptions.pop(key)
+            if error is None:
+                new_key = (new_wd, key[1])
+                self._subscriptions.setdefault(new_key, set()).update(subscriptions)
+            for subscription in subscriptions:
+                if error is not None:
+                    subscription.error = error
+                    subscription.event.set()
+                    continue
+                subscription.key = new_key
+                #updates may have been missed while the directory was not watched
+                if os.path.exists(os.path.join(dirpath, key[1])):
+                    subscription.event.set()
+
+    async def _read(self, name):
+        if self.decode_in_executor:
+            return await self._loop.run_in_executor(self.executor,
+                                                    functools.partial(self.get_value, name))
+        return self.get_value(name)
+
+    async def updates(self, name):
+        """
+        Asynchronous iterator yielding new values of the attribute as they are written.
+
+        Parameters:
+        name (str): Attribute name.
+
+        Yields:
+        Any: Latest value of the attribute after each update.
+
+        Raises:
+        OSError: If the directory of the attribute is removed and can not be watched.
+        """
+        subscription = self._subscribe(name)
+        try:
+            while True:
+                await subscription.event.wait()
+                subscription.event.clear()
+                if subscription.error is not None:
+                    raise subscription.error
+                yield await self._read(name)
+        finally:
+            self._unsubscribe(subscription)
+
+    async def next(self, name, timeout=None):
+        """
+        Wait for the next update of the attribute.
+
+        Parameters:
+        name (str): Attribute name.
+        timeout (float, optional): Maximum time to wait in seconds. Defaults to None (forever).
+
+        Returns:
+        Any: New value of the attribute.
+
+        Raises:
+        asyncio.TimeoutError: If attribute is not updated within timeout.
+        OSError: If the directory of the attribute is removed and can not be watched.
+        """
+        subscription = self._subscribe(name)
+        try:
+            await asyncio.wait_for(subscription.event.wait(), timeout)
+        finally:
+            self._unsubscribe(subscription)
+        if subscription.error is not None:
+            raise subscription.error
+        return await self._read(name)
+
+    def close(self):
+        """
+        Remove inotify file descriptor from the event loop and close it.
+        """
+        if self._inotify is None:
+            return
+        if not self._loop.is_closed():
+            self._loop.remove_reader(self._inotify.fd)
+        self._inotify.close()
+        self._inotify = None
+        self._loop = None
+        self._wds.clear()
+        self._dirs.clear()
+        self._subscriptions.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
@@ -3,6 +3,8 @@ import string
 import logging
 import time
 import os
+import mmap
+import math
 from pathlib import Path
 
 import cbor2
@@ -12,38 +14,56 @@ import numpy as np
 #from tmpfs_framework import tmpfs_path
 import tmpfs_framework
 
-#Custom CBOR tags used
-_tags = [r for r in range(64,87)] #typed arrays
-_tags.append(40) #array of arrays
-
-#Mapping between numpy types and cbor types
-_dtype_map= {64:np.dtype(np.uint8,  ),#,'|'),
-            65:np.dtype(np.uint16,  ),#,'>'),
-            66:np.dtype(np.uint32,  ),#,'>'),
-            67:np.dtype(np.uint64,  ),#,'>'),
-            68:np.dtype(np.uint8,   ),#,'|'),
-            69:np.dtype(np.uint16,  ),#,'<'),
-            70:np.dtype(np.uint32,  ),#,'<'),
-            71:np.dtype(np.uint64,  ),#,'<'),
-            72:np.dtype(np.int8,    ),#,'|'),
-            73:np.dtype(np.int16,   ),#,'>'),
-            74:np.dtype(np.int32,   ),#,'>'),
-            75:np.dtype(np.int64,   ),#'>'),
+#Hidden file SensorWriter.commit uses to record consistent set of files
+COMMIT_FILE = ".commit"
+
+#Private tag of values compressed with compression.compress
+COMPRESSED_TAG = 29798
+#Private tag of dictionaries packed with records.pack_record
+RECORD_TAG = 29799
+
+#Mapping between RFC 8746 typed array tags and numpy types. Byte order is explicit,
+#arrays of either byte order are decoded correctly on hosts of either byte order.
+_dtype_map= {64:np.dtype('|u1'),
+            65:np.dtype('>u2'),
+            66:np.dtype('>u4'),
+            67:np.dtype('>u8'),
+            68:np.dtype('|u1'), #clamped
+            69:np.dtype('<u2'),
+            70:np.dtype('<u4'),
+            71:np.dtype('<u8'),
+            72:np.dtype('|i1'),
+            73:np.dtype('>i2'),
+            74:np.dtype('>i4'),
+            75:np.dtype('>i8'),
             #76 ##RESERVED##
-            77:np.dtype(np.int16,   ),#,'<'),
-            78:np.dtype(np.int32,   ),#,'<'),
-            79:np.dtype(np.int64,   ),#,'<'),
-            80:np.dtype(np.float16, ),#,'>'),
-            81:np.dtype(np.float32, ),#,'>'),
-            82:np.dtype(np.float64, ),#,'>'),
-            83:np.dtype(np.float128,),#,'>'),
-            84:np.dtype(np.float16, ),#,'|'),
-            85:np.dtype(np.float32, ),#,'<'),
-            86:np.dtype(np.float64, ),#,'<'),
-            87:np.dtype(np.float128,),#,'<'),
+            77:np.dtype('<i2'),
+            78:np.dtype('<i4'),
+            79:np.dtype('<i8'),
+            80:np.dtype('>f2'),
+            81:np.dtype('>f4'),
+            82:np.dtype('>f8'),
+            84:np.dtype('<f2'),
+            85:np.dtype('<f4'),
+            86:np.dtype('<f8'),
           }
+if np.finfo(np.longdouble).nmant == 112:
+    #83 and 87 are IEEE binary128, x86 extended precision long double is not
+    _dtype_map[83] = np.dtype(np.longdouble).newbyteorder('>')
+    _dtype_map[87] = np.dtype(np.longdouble).newbyteorder('<')
+
+#Every dtype is encoded with the tag of its own byte order, clamped 68 is only decoded
+_tag_map = {dtype: tag for tag, dtype in _dtype_map.items() if tag != 68}
 
-_tag_map = dict((reversed(item) for item in _dtype_map.items()))
+#Multi-dimensional arrays [shape, array] in row-major and column-major order
+ROW_MAJOR_TAG = 40
+COLUMN_MAJOR_TAG = 1040
+
+#Custom CBOR tags used
+_tags = set(_dtype_map) | {ROW_MAJOR_TAG, COLUMN_MAJOR_TAG}
+
+#Bytes read by load_cbor to recognize array header, enough for tag 40 with several dimensions
+_HEADER_SIZE = 64
 
 
 def decode_tags(decoder,tag,shareable_index=None ):
@@ -58,11 +78,19 @@ def decode_tags(decoder,tag,shareable_index=None ):
     Returns:
     Decoded object based on the tag.
     """
+    if tag.tag == COMPRESSED_TAG:
+      from .compression import decompress
+      return decompress(tag.value)
+    if tag.tag == RECORD_TAG:
+      from .records import unpack_record
+      return unpack_record(tag.value)
     if tag.tag not in _tags:
       #Standard cbor tag
       return tag
     if tag.tag ==40:
       return _decode_tag_40(decoder,tag)
+    if tag.tag == COLUMN_MAJOR_TAG:
+      return _decode_tag_1040(decoder,tag)
     else:
       return _decode_homogenous_arary(decoder,tag)
 
@@ -84,6 +112,21 @@ def _decode_tag_40(decoder,tag,shareable_index=None):
     values = np.asanyarray(tag.value[1])
     return values.reshape(shape)
 
+def _decode_tag_1040(decoder,tag,shareable_index=None):
+    """
+    Decodes CBOR tag 1040 representing a column-major array of arrays.
+
+    Parameters:
+    decoder: The CBOR decoder instance.
+    tag: The CBOR tag to decode.
+    shareable_index: Optional index for shared references.
+    Returns:
+    Fortran ordered NumPy array with shape of the saved array, a view of the decoded data
+    """
+    shape = tag.value[0]
+    values = np.asanyarray(tag.value[1])
+    return values.reshape(shape, order='F')
+
 
 def _decode_homogenous_arary(decoder,tag,shareable_index=None):
     """
@@ -95,16 +138,24 @@ def _decode_homogenous_arary(decoder,tag,shareable_index=None):
     shareable_index: Optional index for shared references.
 
     Returns:
-    NumPy array decoded from the tag.
+    NumPy array decoded from the tag. Array is a view of the tag value if its byte order
+    is the host's, otherwise it is byteswapped once into host byte order.
     """
     dtype = _dtype_map[tag.tag]
 
     array =np.frombuffer(tag.value,dtype=dtype)
+    if not dtype.isnative:
+        array = array.byteswap().view(dtype.newbyteorder('='))
     return array
 
 def _numpy_encoder(encoder, value):
     """
     Encodes NumPy arrays into CBOR format using semantic tags.
+    Headers are encoded by the encoder and array buffer is written directly to the
+    output without intermediate copies. Column-major arrays are written as they are with
+    tag 1040, other non-contiguous arrays are copied once. Arrays of dtypes without
+    typed array tag, e.g. bool and complex, are written as tag 40 over a plain list.
+    Extended precision floats without binary128 tag are written as float64.
 
     Parameters:
     encoder: The CBOR encoder instance.
@@ -113,29 +164,224 @@ def _numpy_encoder(encoder, value):
     Returns:
     None
     """
-    value = np.asanyarray(value)
-    if len(value.shape)<2:
-        encoder.encode_semantic(cbor2.CBORTag(_tag_map[value.dtype],value.data.tobytes()) )
+    value = np.asanyarray(value) if np.ndim(value) else np.asanyarray(value).reshape(1)
+    if value.dtype.kind == 'O':
+        raise TypeError("Can not encode NumPy array of dtype object")
+    #tolist would return extended precision NumPy scalars that are passed back to this encoder
+    if value.dtype.kind == 'f' and value.dtype.itemsize > 8 and value.dtype not in _tag_map:
+        value = value.astype(np.float64)
+    elif value.dtype.kind == 'c' and value.dtype.itemsize > 16:
+        value = value.astype(np.complex128)
+    order_tag = ROW_MAJOR_TAG
+    if value.ndim >= 2 and value.flags.f_contiguous and not value.flags.c_contiguous:
+        order_tag = COLUMN_MAJOR_TAG
+        flat = value.T.reshape(-1)
     else:
-        encoder.encode_semantic(cbor2.CBORTag(40,[value.shape, value.flatten()]))
+        value = np.ascontiguousarray(value)
+        flat = value.reshape(-1)
+    tag = _tag_map.get(value.dtype)
+    if tag is None:
+        #tag 40: [shape, list]
+        encoder.encode_length(6, ROW_MAJOR_TAG)
+        encoder.encode_length(4, 2)
+        encoder.encode(list(value.shape))
+        encoder.encode(value.reshape(-1).tolist())
+        return
+    if value.ndim >= 2:
+        #tag 40 or 1040: [shape, typed array]
+        encoder.encode_length(6, order_tag)
+        encoder.encode_length(4, 2)
+        encoder.encode(list(value.shape))
+    encoder.encode_length(6, tag)
+    encoder.encode_length(2, value.nbytes)
+    encoder.fp.write(memoryview(flat.view(np.uint8)))
+
+def _parse_head(buf, offset):
+    """
+    Parses the initial byte and argument of a CBOR data item.
+
+    Parameters:
+    buf: Buffer containing CBOR data.
+    offset: Offset of the initial byte in buf.
+
+    Returns:
+    tuple: Major type, argument value and offset of the following byte.
+    """
+    initial = buf[offset]
+    info = initial & 0x1f
+    if info < 24:
+        return initial >> 5, info, offset + 1
+    if info == 24:
+        return initial >> 5, buf[offset + 1], offset + 2
+    if info > 27:
+        #indefinite lengths and reserved values are not produced by the encoder
+        raise ValueError(f"Unsupported additional information {info}")
+    length = 1 << (info - 24)
+    value = int.from_bytes(buf[offset + 1:offset + 1 + length], 'big')
+    return initial >> 5, value, offset + 1 + length
+
+def _parse_array_header(buf, complete=True):
+    """
+    Parses header of a CBOR encoded typed array without decoding the payload.
+    Recognizes typed arrays written by _numpy_encoder, both bare and wrapped in tag 40 or 1040.
+
+    Parameters:
+    buf: Buffer containing the CBOR encoded data.
+    complete: If False, buf may hold only the beginning of the data and data
+              following the header is not checked.
 
-def write_cbor(filename,data):
+    Returns:
+    tuple: dtype, shape, offset and length of the array data in bytes and order of the
+           elements ('C' or 'F'), or None if buf does not contain a single typed array.
+    """
+    try:
+        major, value, offset = _parse_head(buf, 0)
+        shape = None
+        order = 'C'
+        if major == 6 and value in (ROW_MAJOR_TAG, COLUMN_MAJOR_TAG):
+            order = 'F' if value == COLUMN_MAJOR_TAG else 'C'
+            major, value, offset = _parse_head(buf, offset)
+            if major != 4 or value != 2:
+                return None
+            major, ndim, offset = _parse_head(buf, offset)
+            if major != 4:
+                return None
+            shape = []
+            for _ in range(ndim):
+                major, dim, offset = _parse_head(buf, offset)
+                if major != 0:
+                    return None
+                shape.append(dim)
+            major, value, offset = _parse_head(buf, offset)
+        if major != 6 or value not in _dtype_map:
+            return None
+        major, nbytes, offset = _parse_head(buf, offset)
+        if major != 2:
+            return None
+    except (IndexError, ValueError, TypeError):
+        return None
+
+    dtype = _dtype_map[value]
+    if nbytes % dtype.itemsize or (complete and offset + nbytes != len(buf)):
+        return None
+    if shape is None:
+        shape = [nbytes // dtype.itemsize]
+    elif math.prod(shape) * dtype.itemsize != nbytes:
+        return None
+    return dtype, tuple(shape), offset, nbytes, order
+
+def mmap_array(file):
+    """
+    Memory maps a CBOR file containing a single typed array and returns a read-only
+    NumPy view over the mapping. Only the CBOR header is parsed, array data is not copied.
+    Arrays in non-native byte order are returned as views of that byte order.
+    Mapping refers to the file's inode, so the view stays valid after the writer
+    replaces the file with os.rename.
+
+    Parameters:
+    file: Path to the CBOR file or file opened in binary mode.
+
+    Returns:
+    numpy.ndarray: Read-only view of the array, or None if file does not contain a typed array.
+    """
+    if not hasattr(file, 'fileno'):
+        with open(file, 'rb') as fd:
+            return mmap_array(fd)
+    try:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        #empty file can not be mapped
+        return None
+    header = _parse_array_header(mapping)
+    if header is None:
+        mapping.close()
+        return None
+    dtype, shape, offset, nbytes, order = header
+    array = np.frombuffer(mapping, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset)
+    return array.reshape(shape, order=order)
+
+def loads_cbor(content):
+    """
+    Decodes CBOR data. Data holding a single typed array, bare or wrapped in tag 40 or
+    1040, is decoded from its header alone into a view of content. Anything else is
+    decoded with cbor2.
+
+    Parameters:
+    content: bytes containing the CBOR encoded data.
+
+    Returns:
+    Decoded object.
+    """
+    header = _parse_array_header(content)
+    if header is None:
+        return cbor2.loads(content, tag_hook=decode_tags)
+    dtype, shape, offset, nbytes, order = header
+    array = np.frombuffer(content, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset)
+    if not dtype.isnative:
+        array = array.byteswap().view(dtype.newbyteorder('='))
+    return array.reshape(shape, order=order)
+
+def load_cbor(fd):
+    """
+    Decodes the CBOR data item at the start of an open file. If the header read from
+    the first bytes is a single typed array, bare or wrapped in tag 40 or 1040, the
+    array data is read directly into a new array. Anything else is decoded with cbor2
+    from the start of the file.
+
+    Parameters:
+    fd: Seekable file opened in binary mode.
+
+    Returns:
+    Decoded object.
+    """
+    head = fd.read(_HEADER_SIZE)
+    header = _parse_array_header(head, complete=False)
+    if header is not None:
+        dtype, shape, offset, nbytes, order = header
+        array = np.empty(nbytes // dtype.itemsize, dtype=dtype)
+        buf = memoryview(array).cast('B')
+        n = min(len(head) - offset, nbytes)
+        buf[:n] = head[offset:offset + n]
+        if n == nbytes or fd.readinto(buf[n:]) == nbytes - n:
+            if not dtype.isnative:
+                array = array.byteswap(inplace=True).view(dtype.newbyteorder('='))
+            return array.reshape(shape, order=order)
+    fd.seek(0)
+    return cbor2.CBORDecoder(fd, tag_hook=decode_tags).decode()
+
+def write_cbor(filename,data,tmpfs_path=None):
     """
     Writes data to a CBOR file using a temporary file for atomic write.
 
     Parameters:
     filename: Path to the output CBOR file.
     data: Data to encode and write.
+    tmpfs_path: Optional path to tmpfs directory for the temporary file.
 
     Returns:
-    None
+    int: Size of the written file in bytes.
     """
-    tmpf = get_temp_file()
+    tmpf = get_temp_file(tmpfs_path=tmpfs_path)
     Path(filename).parent.mkdir(parents=True,exist_ok=True)
     with open(tmpf,'wb') as fd:
-        encoder = cbor2.CBOREncoder(fd, default=_numpy_encoder)
-        encoder.encode(data)
+        dump_cbor(data, fd)
+        nbytes = fd.tell()
     os.rename(tmpf, filename)
+    return nbytes
+
+def dump_cbor(data, fd):
+    """
+    Encodes data to an open file. NumPy arrays are encoded as typed arrays.
+
+    Parameters:
+    data: Data to encode.
+    fd: File opened in binary write mode.
+
+    Returns:
+    None
+    """
+    encoder = cbor2.CBOREncoder(fd, default=_numpy_encoder)
+    encoder.encode(data)
 
 def get_temp_file(N=5,tmpfs_path=None):
     """
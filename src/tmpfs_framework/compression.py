@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Array-aware compression of channel values.
+
+Codecs are given as strings of filters and a compressor joined with "+", optionally
+followed by compression level, e.g. "zlib", "shuffle+zlib:6" or "delta+shuffle+lzma".
+
+Filters are applied to NumPy arrays before compression, left to right:
+    delta:   differences of consecutive elements. Computed on the unsigned integer
+             view of the data, so it is exact for floats too.
+    shuffle: byte-shuffle, groups the n-th bytes of all elements together.
+Slowly changing signals such as depth images and counters compress much better
+after the filters. Other values are encoded to CBOR and compressed as they are.
+
+Compressed value is encoded as CBOR tag COMPRESSED_TAG holding
+[compressor, filters, dtype, shape, payload], so read() decodes it transparently.
+"""
+import io
+import bz2
+import lzma
+import zlib
+
+import cbor2
+import numpy as np
+
+from .cbor_utils import _numpy_encoder, decode_tags, COMPRESSED_TAG
+
+_compressors = {
+    "zlib": (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress),
+}
+FILTERS = ("delta", "shuffle")
+
+
+class Codec:
+    """
+    Compression codec of a channel.
+
+    Attributes:
+    compressor (str): "zlib", "lzma" or "bz2".
+    filters (tuple): Filters applied to arrays before compression.
+    level (int): Compression level, None for compressor's default.
+    """
+    def __init__(self, compressor="zlib", filters=(), level=None):
+        if compressor not in _compressors:
+            raise ValueError(f"Unknown compressor {compressor}, expected one of {list(_compressors)}")
+        for f in filters:
+            if f not in FILTERS:
+                raise ValueError(f"Unknown filter {f}, expected one of {FILTERS}")
+        self.compressor = compressor
+        self.filters = tuple(filters)
+        self.level = level
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Create codec from a string such as "delta+shuffle+zlib:6".
+
+        Parameters:
+        spec (str or Codec): Codec specification.
+
+        Returns:
+        Codec: Parsed codec.
+        """
+        if isinstance(spec, Codec):
+            return spec
+        spec, _, level = spec.partition(":")
+        *filters, compressor = spec.split("+")
+        return cls(compressor, filters, int(level) if level else None)
+
+    def __repr__(self):
+        spec = "+".join(self.filters + (self.compressor,))
+        return f"Codec('{spec}:{self.level}')" if self.level is not None else f"Codec('{spec}')"
+
+
+def _apply_filters(array, filters):
+    data = np.ascontiguousarray(array).reshape(-1)
+    itemsize = data.dtype.itemsize
+    for f in filters:
+        if f == "delta":
+            data = data.view(f"u{itemsize}")
+            data = np.diff(data, prepend=data.dtype.type(0))
+        elif f == "shuffle":
+            data = data.view(np.uint8).reshape(-1, itemsize).T.reshape(-1)
+            data = np.ascontiguousarray(data)
+    return memoryview(np.ascontiguousarray(data)).cast('B')
+
+
+def _reverse_filters(buf, filters, dtype):
+    itemsize = dtype.itemsize
+    data = np.frombuffer(buf, dtype=np.uint8)
+    for f in reversed(filters):
+        if f == "shuffle":
+            data = np.ascontiguousarray(data.reshape(itemsize, -1).T).reshape(-1)
+        elif f == "delta":
+            view = data.view(f"u{itemsize}")
+            data = np.cumsum(view, dtype=view.dtype).view(np.uint8)
+    return data.view(dtype)
+
+
+def compress(value, codec):
+    """
+    Compress value with the given codec.
+
+    Parameters:
+    value (any): Value to compress. Filters are applied only to numeric NumPy arrays.
+    codec (str or Codec): Codec to use.
+
+    Returns:
+    cbor2.CBORTag: Compressed value, encoded by write_cbor and SensorWriter like any other value.
+    """
+    codec = Codec.parse(codec)
+    compress_bytes = _compressors[codec.compressor][0]
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biuf" and value.dtype.itemsize <= 8:
+        payload = compress_bytes(_apply_filters(value, codec.filters), codec.level)
+        return cbor2.CBORTag(COMPRESSED_TAG, [codec.compressor, list(codec.filters), value.dtype.str,
+                                              list(value.shape), payload])
+    payload = compress_bytes(cbor2.dumps(value, default=_numpy_encoder), codec.level)
+    return cbor2.CBORTag(COMPRESSED_TAG, [codec.compressor, [], None, None, payload])
+
+
+def decompress(value):
+    """
+    Decode value of a COMPRESSED_TAG tag.
+
+    Parameters:
+    value (list): Tag value [compressor, filters, dtype, shape, payload].
+
+    Returns:
+    any: Original value.
+    """
+    compressor, filters, dtype, shape, payload = value
+    data = _compressors[compressor][1](payload)
+    if dtype is None:
+        return cbor2.loads(data, tag_hook=decode_tags)
+    return _reverse_filters(data, filters, np.dtype(dtype)).reshape(shape)
+
+
+def compress_encoded(content, codec):
+    """
+    Compress a CBOR encoded value, e.g. a captured file.
+
+    Parameters:
+    content (bytes): CBOR encoded value.
+    codec (str or Codec): Codec to use.
+
+    Returns:
+    bytes: CBOR encoded compressed value, or content unchanged if it is not a single CBOR value.
+    """
+    fp = io.BytesIO(content)
+    try:
+        value = cbor2.CBORDecoder(fp, tag_hook=decode_tags).decode()
+    except Exception:
+        #e.g. jpg images written as they are
+        return content
+    if fp.tell() != len(content):
+        return content
+    return cbor2.dumps(compress(value, codec), default=_numpy_encoder)
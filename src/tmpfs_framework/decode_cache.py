@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache for decoded tmpfs files. Entries are validated with stat() so unchanged
+channels are not decoded again.
+
+Cached values are shared by every caller. Arrays, also those inside dictionaries
+and lists, are made read-only when cached, and dictionaries and lists are copied
+on every hit, so callers can not change values other callers get. Values of other
+types, e.g. LazyZipMapping, are not cached.
+"""
+import os
+import stat
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+#Values shared as they are
+_IMMUTABLE = (int, float, complex, str, bytes, type(None), np.generic)
+
+
+def value_size(value):
+    """
+    Estimates memory used by a decoded value.
+
+    Parameters:
+    value (Any): Decoded value.
+
+    Returns:
+    int: Size in bytes, or None if value can not be cached.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes if value.dtype.kind != 'O' else None
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, _IMMUTABLE):
+        return 8
+    if type(value) in (dict, list, tuple):
+        items = value.items() if type(value) is dict else enumerate(value)
+        size = 0
+        for key, item in items:
+            item_size = value_size(item)
+            if item_size is None:
+                return None
+            size += item_size + (len(key) if isinstance(key, str) else 8)
+        return size
+    return None
+
+
+def _freeze(value):
+    #arrays are shared by all callers
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif type(value) in (dict, list, tuple):
+        for item in (value.values() if type(value) is dict else value):
+            _freeze(item)
+
+
+def _copy(value):
+    #containers are copied so that callers do not share them, arrays are read-only
+    if type(value) is dict:
+        return {key: _copy(item) for key, item in value.items()}
+    if type(value) is list:
+        return [_copy(item) for item in value]
+    return value
+
+
+def stat_key(st):
+    """
+    Builds the key identifying a version of a file.
+    Writers replace files with os.rename so every write produces a new inode.
+
+    Parameters:
+    st (os.stat_result): Result of os.stat.
+
+    Returns:
+    tuple: (st_ino, st_mtime_ns, st_size)
+    """
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class DecodeCache:
+    """
+    LRU cache of decoded values keyed by file path and validated by stat_key.
+
+    Attributes:
+    max_bytes (int): Memory bound for cached entries. Size of an entry is estimated
+                     from the decoded value with value_size.
+    hits (int): Number of lookups served from the cache.
+    misses (int): Number of lookups that required decoding.
+    evictions (int): Number of entries evicted to keep the cache within max_bytes.
+    """
+    def __init__(self, max_bytes):
+        """
+        Initializes an empty cache.
+
+        Args:
+        max_bytes (int): Maximum total size of cached entries in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, loader):
+        """
+        Returns the decoded value of path. Calls loader only if the file has
+        changed since it was cached. See module documentation for how cached
+        values are shared.
+
+        Args:
+        path (str): Path of the file.
+        loader (callable): Function without arguments that reads and decodes the file.
+
+        Returns:
+        Any: Decoded value.
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return loader()
+        if stat.S_ISDIR(st.st_mode):
+            #content of directory can change without changing its stat
+            return loader()
+        key = stat_key(st)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return _copy(entry[1])
+            self.misses += 1
+
+        value = loader()
+        try:
+            #file may have been replaced while it was decoded
+            if stat_key(os.stat(path)) == key and self._store(path, key, value):
+                return _copy(value)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def _store(self, path, key, value):
+        """
+        Stores value and evicts least recently used entries if needed.
+        Returns False if value can not be cached.
+        """
+        size = value_size(value)
+        if size is None or size > self.max_bytes:
+            return False
+        _freeze(value)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= old[2]
+            while self._entries and self.size + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[2]
+                self.evictions += 1
+            self._entries[path] = (key, value, size)
+            self.size += size
+        return True
+
+    def clear(self):
+        """
+        Removes all entries from the cache. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def info(self):
+        """
+        Returns cache statistics.
+
+        Returns:
+        dict: Hits, misses, evictions, number of entries, current size and memory bound.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "size": self.size,
+                    "max_bytes": self.max_bytes}
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Minimal inotify bindings and a process-wide dispatcher that routes file
+updates to callbacks with a single inotify instance and a single thread.
+"""
+import os
+import errno
+import ctypes
+import ctypes.util
+import selectors
+import struct
+import logging
+import threading
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_MASK_ADD = 0x20000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+#Writers publish files with rename, IN_CLOSE_WRITE catches files written in place
+UPDATE_MASK = IN_MOVED_TO | IN_CLOSE_WRITE
+
+_event_header = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    """
+    Loads libc and checks that inotify functions are available.
+
+    Returns:
+    ctypes.CDLL: libc
+
+    Raises:
+    OSError: If inotify is not available on this platform.
+    """
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, f"inotify not available: {e}")
+        _libc = libc
+    return _libc
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Inotify:
+    """
+    Thin wrapper around an inotify file descriptor.
+    """
+    def __init__(self, nonblocking=False):
+        """
+        Creates a new inotify instance.
+
+        Args:
+        nonblocking (bool): Open the file descriptor in non-blocking mode.
+        """
+        self._libc = _get_libc()
+        flags = IN_CLOEXEC | (IN_NONBLOCK if nonblocking else 0)
+        self.fd = _check(self._libc.inotify_init1(flags))
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: str, mask: int = UPDATE_MASK) -> int:
+        """
+        Adds or replaces a watch on path.
+
+        Args:
+        path (str): Path to watch, usually a directory.
+        mask (int): Events to report.
+
+        Returns:
+        int: Watch descriptor.
+        """
+        return _check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd: int) -> None:
+        """
+        Removes a watch. Errors from already removed watches are ignored.
+
+        Args:
+        wd (int): Watch descriptor.
+        """
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Reads pending events. Blocks if the descriptor is blocking and there are no events.
+
+        Returns:
+        list: Tuples of (watch descriptor, mask, name).
+        """
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        return parse_events(buf)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def parse_events(buf):
+    """
+    Parses raw inotify events.
+
+    Args:
+    buf (bytes): Data read from inotify file descriptor.
+
+    Returns:
+    list: Tuples of (watch descriptor, mask, name).
+    """
+    events = []
+    offset = 0
+    while offset + _event_header.size <= len(buf):
+        wd, mask, _, length = _event_header.unpack_from(buf, offset)
+        offset += _event_header.size
+        name = buf[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append((wd, mask, os.fsdecode(name)))
+    return events
+
+
+class Watch:
+    """
+    Handle of a registered callback. Returned by InotifyDispatcher.register.
+    """
+    def __init__(self, dispatcher, path, mask=UPDATE_MASK, on_error=None):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.mask = mask
+        self.on_error = on_error
+        self._key = None
+
+    def stop(self) -> None:
+        """
+        Unregisters the callback.
+        """
+        self.dispatcher.unregister(self)
+
+
+class InotifyDispatcher:
+    """
+    Routes inotify events of exact file paths to callbacks.
+
+    Every watched directory gets one watch descriptor with the union of the masks of
+    its callbacks, and events are matched to callbacks by watch descriptor, file name
+    and mask. All callbacks are run on a single dispatcher thread, so they should
+    return quickly.
+
+    If the kernel drops the watch of a directory, e.g. because the directory was removed
+    or replaced, the watch is added again on the same path and callbacks of files that
+    exist are called, since updates may have been missed. If that fails, on_error of
+    the callbacks is called instead.
+    """
+    def __init__(self):
+        self._inotify = Inotify()
+        self._lock = threading.Lock()
+        self._wds = {}        # directory -> watch descriptor
+        self._callbacks = {}  # watch descriptor -> {name: {Watch: callback}}
+        self._dirs = {}       # watch descriptor -> directory
+        self._masks = {}      # watch descriptor -> mask of the watch
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = None
+        self._running = False
+
+    def register(self, path: str, callback, mask: int = UPDATE_MASK, on_error=None) -> Watch:
+        """
+        Calls callback(path) every time path is replaced or written.
+
+        Args:
+        path (str): Path of the file to watch. Parent directory must exist.
+        callback (callable): Function called with the path of the updated file.
+        mask (int): Events of the parent directory to report.
+        on_error (callable, optional): Function called with the path and the OSError if
+                                       the directory can no longer be watched, e.g. it
+                                       was removed. The callback is unregistered.
+                                       Defaults to logging a warning.
+
+        Returns:
+        Watch: Handle that can be used to unregister the callback.
+        """
+        dirpath, name = os.path.split(os.path.abspath(path))
+        watch = Watch(self, path, mask, on_error)
+        with self._lock:
+            wd = self._wds.get(dirpath)
+            if wd is None:
+                wd = self._inotify.add_watch(dirpath, mask)
+                self._wds[dirpath] = wd
+                self._dirs[wd] = dirpath
+                self._masks[wd] = mask
+            elif mask & ~self._masks[wd]:
+                #one watch per directory, extend it with events of the new callback
+                self._inotify.add_watch(dirpath, mask | IN_MASK_ADD)
+                self._masks[wd] |= mask
+            self._callbacks.setdefault(wd, {}).setdefault(name, {})[watch] = callback
+            watch._key = (wd, name)
+            if not self._running:
+                self._start()
+        return watch
+
+    def unregister(self, watch: Watch) -> None:
+        """
+        Removes a callback registered with register. Watch of the directory is removed
+        when there are no callbacks left for it.
+
+        Args:
+        watch (Watch): Handle returned by register.
+        """
+        with self._lock:
+            #key changes when the watch of the directory is added again
+            wd, name = watch._key
+            names = self._callbacks.get(wd)
+            if names is None or watch not in names.get(name, {}):
+                return
+            del names[name][watch]
+            if not names[name]:
+                del names[name]
+            if not names:
+                del self._callbacks[wd]
+                self._masks.pop(wd, None)
+                self._wds.pop(self._dirs.pop(wd), None)
+                self._inotify.rm_watch(wd)
+                return
+            mask = 0
+            for watches in names.values():
+                for w in watches:
+                    mask |= w.mask
+            if mask != self._masks[wd]:
+                #replace mask of the watch with the events still needed
+                try:
+                    self._inotify.add_watch(self._dirs[wd], mask)
+                    self._masks[wd] = mask
+                except OSError as e:
+                    logging.debug(f"Could not narrow watch of {self._dirs[wd]}: {e}")
+
+    def _start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="tmpfs-inotify", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the dispatcher thread.
+        """
+        self._running = False
+        os.write(self._wake_w, b'\0')
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        #selectors instead of select.select, which fails on descriptors above FD_SETSIZE
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._inotify.fd, selectors.EVENT_READ)
+            selector.register(self._wake_r, selectors.EVENT_READ)
+            while self._running:
+                try:
+                    ready = [key.fd for key, _ in selector.select()]
+                    if self._wake_r in ready:
+                        os.read(self._wake_r, 64)
+                        continue
+                    self.dispatch(self._inotify.read_events())
+                except Exception as e:
+                    #single thread serves every callback of the process, keep it alive
+                    logging.exception(e)
+
+    def dispatch(self, events):
+        """
+        Runs callbacks of the given events.
+
+        Args:
+        events (list): Tuples of (watch descriptor, mask, name).
+        """
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify event queue overflowed, updates were lost")
+                continue
+            if mask & IN_IGNORED:
+                self._rearm(wd)
+                continue
+            with self._lock:
+                callbacks = [callback for watch, callback in self._callbacks.get(wd, {}).get(name, {}).items()
+                             if mask & watch.mask]
+                dirpath = self._dirs.get(wd)
+            for callback in callbacks:
+                try:
+                    callback(os.path.join(dirpath, name))
+                except Exception as e:
+                    logging.exception(e)
+
+
+    def _rearm(self, wd):
+        """
+        Adds the watch of a directory again after kernel has dropped it.
+        """
+        with self._lock:
+            dirpath = self._dirs.pop(wd, None)
+            names = self._callbacks.pop(wd, None)
+            mask = self._masks.pop(wd, None)
+            if dirpath is None:
+                #removed by unregister
+                return
+            self._wds.pop(dirpath, None)
+            if not names:
+                return
+            try:
+                new_wd = self._inotify.add_watch(dirpath, mask | IN_MASK_ADD)
+                error = None
+            except OSError as e:
+                error = e
+            if error is None:
+                self._wds[dirpath] = new_wd
+                self._dirs[new_wd] = dirpath
+                self._masks[new_wd] = self._masks.get(new_wd, 0) | mask
+                callbacks = self._callbacks.setdefault(new_wd, {})
+                for name, watches in names.items():
+                    callbacks.setdefault(name, {}).update(watches)
+                    for watch in watches:
+                        watch._key = (new_wd, name)
+        for name, watches in names.items():
+            path = os.path.join(dirpath, name)
+            for watch, callback in watches.items():
+                try:
+                    if error is not None:
+                        if watch.on_error is not None:
+                            watch.on_error(path, error)
+                        else:
+                            logging.warning(f"Stopped watching {path}: {error}")
+                    elif os.path.exists(path):
+                        #updates may have been missed while the directory was not watched
+                        callback(path)
+                except Exception as e:
+                    logging.exception(e)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> InotifyDispatcher:
+    """
+    Returns the process-wide dispatcher, creating it on first use.
+
+    Raises:
+    OSError: If inotify is not available.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = InotifyDispatcher()
+        return _dispatcher
+
+
+def _reset_after_fork():
+    #dispatcher thread does not exist in the child process
+    global _dispatcher, _dispatcher_lock
+    _dispatcher = None
+    _dispatcher_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
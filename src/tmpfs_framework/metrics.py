@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-channel runtime metrics. SensorWriter and SensorReader record write and read
+counts, payload sizes, encode and decode times and data staleness here. Recording
+costs a few hundred nanoseconds and is enabled by default, set environment variable
+TMPFS_METRICS=0 to disable it. Every channel has a lock of its own, so threads using
+different channels do not contend.
+
+MetricsPublisher writes the metrics of the process periodically as a regular tmpfs
+channel, by default _metrics/<process name>_<pid>/metrics, that any SensorReader can read.
+"""
+import os
+import sys
+import time
+import threading
+
+from .cbor_utils import write_cbor
+import tmpfs_framework
+
+#Histogram bucket i counts values below 2**i microseconds
+_BUCKETS = 28
+
+
+class Histogram:
+    """
+    Latency histogram with power of two buckets in microseconds.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        """
+        Add a sample.
+
+        Parameters:
+        ns (int): Sample in nanoseconds.
+        """
+        us = ns // 1000
+        self.counts[min(us.bit_length(), _BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, q):
+        """
+        Estimate percentile as the upper bound of the bucket it falls in.
+
+        Parameters:
+        q (float): Percentile between 0 and 100.
+
+        Returns:
+        int: Upper bound in microseconds, None if there are no samples.
+        """
+        if self.count == 0:
+            return None
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(1 << i, self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Returns:
+        dict: Count, mean, p50, p99, max and non-empty buckets keyed by their upper bound.
+        """
+        return {"count": self.count,
+                "mean_us": self.total / self.count if self.count else None,
+                "p50_us": self.percentile(50), "p99_us": self.percentile(99), "max_us": self.max,
+                "buckets": {1 << i: n for i, n in enumerate(self.counts) if n}}
+
+
+class ChannelMetrics:
+    """
+    Counters and histograms of a single channel. Updated under its lock.
+    """
+    __slots__ = ("writes", "write_bytes", "last_write", "encode", "reads", "read_bytes", "decode",
+                 "staleness", "lock", "_rate_writes", "_rate_reads", "_rate_time")
+
+    def __init__(self):
+        self.writes = 0
+        self.write_bytes = 0
+        self.last_write = None
+        self.encode = Histogram()
+        self.reads = 0
+        self.read_bytes = 0
+        self.decode = Histogram()
+        self.staleness = Histogram()
+        self.lock = threading.Lock()
+        self._rate_writes = 0
+        self._rate_reads = 0
+        self._rate_time = time.monotonic()
+
+    def to_dict(self, now):
+        elapsed = max(now - self._rate_time, 1e-9)
+        write_rate = (self.writes - self._rate_writes) / elapsed
+        read_rate = (self.reads - self._rate_reads) / elapsed
+        self._rate_writes, self._rate_reads, self._rate_time = self.writes, self.reads, now
+        return {"writes": self.writes, "write_bytes": self.write_bytes, "last_write": self.last_write,
+                "reads": self.reads, "read_bytes": self.read_bytes,
+                "write_rate_hz": write_rate, "read_rate_hz": read_rate,
+                "encode": self.encode.to_dict(), "decode": self.decode.to_dict(),
+                "staleness": self.staleness.to_dict()}
+
+
+class Metrics:
+    """
+    Metrics of all channels used by the process. Channels are named by their path
+    relative to tmpfs path.
+
+    Attributes:
+    enabled (bool): Whether metrics are recorded.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, name):
+        channel = self._channels.get(name)
+        if channel is None:
+            with self._lock:
+                channel = self._channels.setdefault(name, ChannelMetrics())
+        return channel
+
+    def record_write(self, name, nbytes, ns):
+        """
+        Record a published value.
+
+        Parameters:
+        name (str): Channel name.
+        nbytes (int): Size of the written file.
+        ns (int): Time spent encoding and writing in nanoseconds.
+        """
+        channel = self._channel(name)
+        with channel.lock:
+            channel.writes += 1
+            channel.write_bytes += nbytes
+            channel.last_write = time.time()
+            channel.encode.record(ns)
+
+    def record_read(self, name, ns, nbytes=0, staleness_ns=None):
+        """
+        Record a read value.
+
+        Parameters:
+        name (str): Channel name.
+        ns (int): Time spent reading and decoding in nanoseconds.
+        nbytes (int, optional): Size of the read file if known.
+        staleness_ns (int, optional): Age of the data when it was read, if known.
+        """
+        channel = self._channel(name)
+        with channel.lock:
+            channel.reads += 1
+            channel.read_bytes += nbytes
+            channel.decode.record(ns)
+            if staleness_ns is not None:
+                channel.staleness.record(max(staleness_ns, 0))
+
+    def snapshot(self):
+        """
+        Get current metrics. Write and read rates are computed since previous snapshot.
+
+        Returns:
+        dict: Channel name -> metrics of the channel.
+        """
+        now = time.monotonic()
+        with self._lock:
+            channels = list(self._channels.items())
+        ret = {}
+        for name, channel in channels:
+            with channel.lock:
+                ret[name] = channel.to_dict(now)
+        return ret
+
+    def reset(self):
+        """
+        Forget all recorded metrics.
+        """
+        with self._lock:
+            self._channels = {}
+
+
+metrics = Metrics(enabled=os.environ.get("TMPFS_METRICS", "1") != "0")
+
+
+class MetricsPublisher:
+    """
+    Publishes metrics of the process periodically as a tmpfs channel.
+
+    Attributes:
+    path (str): Path of the published metrics file.
+    """
+    def __init__(self, interval=1.0, dir_path="_metrics", name=None, tmpfs_path=None, registry=None):
+        """
+        Start publishing in a background thread.
+
+        Parameters:
+        interval (float, optional): Publish interval in seconds. Defaults to 1.0.
+        dir_path (str, optional): Directory of the metrics channels. Defaults to "_metrics".
+        name (str, optional): Sensor name of this process. Defaults to "<program>_<pid>".
+        tmpfs_path (str, optional): tmpfs path. Defaults to tmpfs_framework.TMPFS_PATH.
+        registry (Metrics, optional): Metrics to publish. Defaults to the process metrics.
+        """
+        tmpfs_path = tmpfs_path if tmpfs_path is not None else tmpfs_framework.TMPFS_PATH
+        if name is None:
+            program = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+            name = f"{program}_{os.getpid()}"
+        sensor_path = os.path.join(tmpfs_path, dir_path, name)
+        os.makedirs(sensor_path, exist_ok=True)
+        self.path = os.path.join(sensor_path, "metrics")
+        self.interval = interval
+        self.registry = registry if registry is not None else metrics
+        self.stop_event = threading.Event()
+        self.publish()
+        self._thread = threading.Thread(target=self._run, name="tmpfs-metrics", daemon=True)
+        self._thread.start()
+
+    def publish(self):
+        """
+        Publish current metrics immediately.
+        """
+        write_cbor(self.path, {"time": time.time(), "pid": os.getpid(),
+                               "channels": self.registry.snapshot()})
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.publish()
+            except OSError:
+                #tmpfs was unmounted or is full, try again later
+                pass
+
+    def stop(self):
+        """
+        Stop publishing. Metrics file is left in place.
+        """
+        self.stop_event.set()
+        self._thread.join()
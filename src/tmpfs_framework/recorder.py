@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recording of sensor snapshots to disk. Snapshots are captured into memory on the
+event thread and written by a pool of workers, so slow disks or compression do not
+delay event handling.
+"""
+import io
+import os
+import queue
+import logging
+import zipfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .compression import compress_encoded
+
+#Comment of snapshot zip files holding a copy of measurement.zip of the sensor
+ZIPPED_COMMENT = b"tmpfs_framework measurement.zip"
+
+class Snapshot:
+    """
+    In-memory copy of sensor data captured for recording.
+
+    Attributes:
+    name (str): File name of the snapshot without extension, "{timestamp}_{sensor_name}"
+                or "{sensor_name}_metadata".
+    timestamp (int): Modification time of the captured data in milliseconds.
+    sensor_name (str): Name of the sensor.
+    zip_bytes (bytes): Content of captured zip file, None if members were captured.
+    members (list): Tuples of (archive name, file content) of captured files.
+    zipped (bool): True if data was captured from a zip file the sensor published,
+                   e.g. measurement.zip, instead of separate files.
+    """
+    def __init__(self, name, timestamp, sensor_name, zip_bytes=None, members=None, zipped=None):
+        self.name = name
+        self.timestamp = timestamp
+        self.sensor_name = sensor_name
+        self.zip_bytes = zip_bytes
+        self.members = members if members is not None else []
+        self.zipped = zip_bytes is not None if zipped is None else zipped
+
+    def iter_members(self):
+        """
+        Iterate over captured files.
+
+        Yields:
+        tuple: Archive name and content of each captured file.
+        """
+        if self.zip_bytes is None:
+            yield from self.members
+            return
+        with zipfile.ZipFile(io.BytesIO(self.zip_bytes), 'r') as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, zf.read(info)
+
+
+def write_snapshot(snapshot, path, compresslevel=0, codec=None):
+    """
+    Writes snapshot as zip file {path}/{snapshot.name}.zip. Zipped snapshots are
+    marked with ZIPPED_COMMENT, so that replay publishes them as zip files again.
+
+    Parameters:
+    snapshot (Snapshot): Captured data.
+    path (str): Directory for the snapshot.
+    compresslevel (int, optional): Deflate level. Captured zip files are copied as they
+                                   are when 0 and codec is not given. Defaults to 0.
+    codec (str, optional): Compression codec applied to each captured value, see
+                           compression module. Defaults to None.
+
+    Returns:
+    str: Path of the written file.
+    """
+    filename = os.path.join(path, f'{snapshot.name}.zip')
+    if snapshot.zip_bytes is not None and compresslevel == 0 and not codec:
+        with open(filename, 'wb') as fd:
+            fd.write(snapshot.zip_bytes)
+        if snapshot.zipped:
+            #only the central directory is rewritten
+            with zipfile.ZipFile(filename, 'a') as zf:
+                zf.comment = ZIPPED_COMMENT
+        return filename
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        if snapshot.zipped:
+            zf.comment = ZIPPED_COMMENT
+        for arcname, content in snapshot.iter_members():
+            if codec:
+                content = compress_encoded(content, codec)
+            zf.writestr(arcname, content)
+    return filename
+
+
+class RecordingPipeline:
+    """
+    Bounded queue of snapshots and a pool of workers writing them.
+
+    Policies when queue is full:
+        "block": submit waits for free space, applying back-pressure to the caller.
+        "drop_newest": submitted snapshot is dropped.
+        "drop_oldest": oldest queued snapshot is dropped to make room.
+
+    Attributes:
+    queued (int): Number of snapshots accepted to the queue.
+    written (int): Number of snapshots written.
+    dropped (int): Number of snapshots dropped because queue was full.
+    failed (int): Number of snapshots that could not be written.
+    """
+    POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, sink, workers=1, queue_size=256, policy="block", use_processes=False):
+        """
+        Starts the worker threads.
+
+        Parameters:
+        sink (callable): Function writing a single Snapshot. Must be picklable if
+                         use_processes is True. If sink has close method it is called
+                         when pipeline is stopped.
+        workers (int, optional): Number of workers. Defaults to 1.
+        queue_size (int, optional): Maximum number of queued snapshots. Defaults to 256.
+        policy (str, optional): What to do when queue is full. Defaults to "block".
+        use_processes (bool, optional): Run sink in a process pool, useful when compression
+                                        is CPU bound. Defaults to False.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown policy {policy}, expected one of {self.POLICIES}")
+        self.sink = sink
+        self.policy = policy
+        self.queue = queue.Queue(queue_size)
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pool = ProcessPoolExecutor(max_workers=workers) if use_processes else None
+        self._threads = [threading.Thread(target=self._worker, name=f"tmpfs-recorder-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def submit(self, snapshot):
+        """
+        Queue snapshot for writing.
+
+        Parameters:
+        snapshot (Snapshot): Captured data.
+
+        Returns:
+        bool: True if snapshot was queued, False if it was dropped.
+        """
+        if self.policy == "block":
+            self.queue.put(snapshot)
+            self._count("queued")
+            return True
+        while True:
+            try:
+                self.queue.put_nowait(snapshot)
+                self._count("queued")
+                return True
+            except queue.Full:
+                if self.policy == "drop_newest":
+                    self._count("dropped")
+                    return False
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self._count("dropped")
+            except queue.Empty:
+                pass
+
+    def _worker(self):
+        while True:
+            snapshot = self.queue.get()
+            try:
+                if snapshot is None:
+                    return
+                if self._pool is not None:
+                    self._pool.submit(self.sink, snapshot).result()
+                else:
+                    self.sink(snapshot)
+                self._count("written")
+            except Exception as e:
+                self._count("failed")
+                logging.exception(e)
+            finally:
+                self.queue.task_done()
+
+    def stop(self, drain=True):
+        """
+        Stop the workers.
+
+        Parameters:
+        drain (bool, optional): Write queued snapshots before stopping. Defaults to True.
+        """
+        if not drain:
+            try:
+                while True:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self._count("dropped")
+            except queue.Empty:
+                pass
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+        if hasattr(self.sink, "close"):
+            self.sink.close()
+
+    def stats(self):
+        """
+        Get pipeline counters.
+
+        Returns:
+        dict: Number of queued, written, dropped and failed snapshots and current queue length.
+        """
+        with self._lock:
+            return {"queued": self.queued, "written": self.written, "dropped": self.dropped,
+                    "failed": self.failed, "pending": self.queue.qsize()}
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Packed records. A dictionary of scalars, e.g. a set of counters sampled together,
+is published as a single file instead of a directory with a file per value.
+
+Nested dictionaries are flattened to fields named by their path, "wlan0/receive_bytes".
+Numbers and booleans are packed into one NumPy structured record, other values such
+as strings are kept as they are. Record is encoded as CBOR tag RECORD_TAG holding
+[field names, field formats, record bytes, other values], where format of the other
+values is None. read() decodes it back to the nested dictionary.
+
+SensorWriter.write(name, data, packed=True) publishes records as name + SUFFIX and
+SensorReader exposes every top level field of a record as an attribute.
+"""
+import functools
+
+import cbor2
+import numpy as np
+
+from .cbor_utils import RECORD_TAG
+
+SUFFIX = ".rec"
+
+
+def _flatten(data, prefix=""):
+    for key, value in data.items():
+        if type(value) is dict:
+            yield from _flatten(value, f"{prefix}{key}/")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def _format(value):
+    if isinstance(value, (bool, np.bool_)):
+        return "|b1"
+    if isinstance(value, int):
+        #Python ints beyond 64 bits are kept as they are
+        return "<i8" if -2**63 <= value < 2**63 else None
+    if isinstance(value, float):
+        return "<f8"
+    if isinstance(value, np.generic) and value.dtype.kind in "iuf":
+        return value.dtype.newbyteorder("<").str
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _record_dtype(names, formats):
+    return np.dtype({"names": list(names), "formats": list(formats)})
+
+
+def pack_record(data):
+    """
+    Pack dictionary of scalars into a record.
+
+    Parameters:
+    data (dict): Flat or nested dictionary.
+
+    Returns:
+    cbor2.CBORTag: Record, encoded by write_cbor and SensorWriter like any other value.
+    """
+    names, formats, values, other = [], [], [], []
+    for name, value in _flatten(data):
+        fmt = _format(value)
+        names.append(name)
+        formats.append(fmt)
+        if fmt is None:
+            other.append(value)
+        else:
+            values.append(value)
+    packed = tuple((n, f) for n, f in zip(names, formats) if f is not None)
+    dtype = _record_dtype(tuple(n for n, _ in packed), tuple(f for _, f in packed))
+    record = np.array([tuple(values)], dtype=dtype)
+    return cbor2.CBORTag(RECORD_TAG, [names, formats, record.tobytes(), other])
+
+
+def unpack_record(value):
+    """
+    Decode value of a RECORD_TAG tag.
+
+    Parameters:
+    value (list): Tag value [field names, field formats, record bytes, other values].
+
+    Returns:
+    dict: Nested dictionary of Python scalars.
+    """
+    names, formats, payload, other = value
+    packed = [(n, f) for n, f in zip(names, formats) if f is not None]
+    dtype = _record_dtype(tuple(n for n, _ in packed), tuple(f for _, f in packed))
+    values = iter(np.frombuffer(payload, dtype=dtype)[0].tolist() if packed else ())
+    other = iter(other)
+    ret = {}
+    for name, fmt in zip(names, formats):
+        *parents, key = name.split("/")
+        node = ret
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = next(values) if fmt is not None else next(other)
+    return ret
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Channel registry of a tmpfs directory. Writers record every channel they publish
+in a single hidden file, <directory>/.registry, so that readers can find sensors
+and their channels with one read instead of listing and stat'ing the whole tree.
+
+Registry is a CBOR map:
+    {"generation": <number of updates>,
+     "sensors": {<sensor>: <CBOR encoded {<channel path>: [kind, dtype, shape, generation]}>}}
+Channel table of each sensor is kept encoded, so a reader decodes only the names of
+the sensors and the channels of its own sensor regardless of the size of the tree.
+Channel path is the path of the published file relative to the sensor directory,
+e.g. "depth", "pose/x" or "measurement.zip". Sensor that is a single file has one
+channel with empty path. Kind is "value", "array", "compressed", "record", "zip"
+or "shared_array". Dtype and shape are None if they vary between writes. Generation of
+a channel is the commit generation of its writer when the channel was added or its
+entry last changed.
+
+Writers update the registry only when a channel is added, removed or its kind changes,
+or when its dtype or shape first varies.
+Updates are read-modify-write under flock of <directory>/.registry.lock, and the
+new registry is published with an atomic rename like any other file.
+"""
+import os
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+import cbor2
+import numpy as np
+
+from .cbor_utils import write_cbor, decode_tags, _parse_array_header, COMPRESSED_TAG, RECORD_TAG
+from .inotify import get_dispatcher
+
+REGISTRY_FILE = ".registry"
+LOCK_FILE = ".registry.lock"
+_FIELDS = ("kind", "dtype", "shape", "generation")
+
+
+def split_channel(sensor_name, name):
+    """
+    Split path of a published file into sensor and channel path of the registry.
+
+    Parameters:
+    sensor_name (str): Sensor name given to the writer, may be "." or contain "/".
+    name (str): Name of the file relative to the sensor directory.
+
+    Returns:
+    tuple: Sensor and channel path.
+    """
+    sensor, _, channel = os.path.normpath(os.path.join(sensor_name, name)).partition("/")
+    return sensor, channel
+
+
+def channel_entry(data):
+    """
+    Describe a published value for the registry.
+
+    Parameters:
+    data (any): Value as it was encoded.
+
+    Returns:
+    tuple: Kind, dtype and shape of the value.
+    """
+    if isinstance(data, np.ndarray):
+        return "array", data.dtype.str, tuple(data.shape)
+    if isinstance(data, cbor2.CBORTag) and data.tag == COMPRESSED_TAG:
+        dtype, shape = data.value[2], data.value[3]
+        return "compressed", dtype, tuple(shape) if shape is not None else None
+    if isinstance(data, cbor2.CBORTag) and data.tag == RECORD_TAG:
+        return "record", None, None
+    return "value", type(data).__name__, None
+
+
+def encoded_entry(content):
+    """
+    Describe a value for the registry from its CBOR encoding. Typed arrays are described
+    from their header and compressed values and records are not unpacked.
+
+    Parameters:
+    content (bytes): CBOR encoded value.
+
+    Returns:
+    tuple: Kind, dtype and shape of the value.
+    """
+    header = _parse_array_header(content)
+    if header is not None:
+        return "array", header[0].str, header[1]
+    data = cbor2.loads(content)
+    if isinstance(data, cbor2.CBORTag) and data.tag not in (COMPRESSED_TAG, RECORD_TAG):
+        data = cbor2.loads(content, tag_hook=decode_tags)
+    return channel_entry(data)
+
+
+class Registry:
+    """
+    Registry of channels of a tmpfs directory.
+
+    Attributes:
+    path (str): Path of the registry file.
+    """
+    def __init__(self, directory):
+        """
+        Parameters:
+        directory (str): Directory containing the sensors, e.g. tmpfs path joined with dir_path.
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, REGISTRY_FILE)
+        self._key = None
+        self._registry = None
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the registry. Decoded registry is reused until the file is replaced.
+        Safe to call from several threads.
+
+        Returns:
+        dict: Registry, or None if the directory has no registry.
+        """
+        with self._lock:
+            return self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fd:
+                st = os.fstat(fd.fileno())
+                key = (st.st_ino, st.st_mtime_ns, st.st_size)
+                if key != self._key:
+                    registry = cbor2.load(fd)
+                    if not isinstance(registry, dict) or "sensors" not in registry:
+                        raise ValueError("not a registry")
+                    self._registry = registry
+                    self._channels = {}
+                    self._key = key
+        except (OSError, ValueError, TypeError) as e:
+            logging.debug(f"Could not read registry {self.path}: {e}")
+            return None
+        return self._registry
+
+    def sensors(self):
+        """
+        Returns:
+        list: Names of the registered sensors. Empty if there is no registry.
+        """
+        registry = self.load()
+        return list(registry["sensors"]) if registry is not None else []
+
+    def channels(self, sensor):
+        """
+        Look up channels of a sensor.
+
+        Parameters:
+        sensor (str): Sensor name.
+
+        Returns:
+        dict: Channel path -> entry, or None if sensor is not registered.
+        """
+        with self._lock:
+            #decoded tables are dropped when registry is reloaded, so decode under the same lock
+            registry = self._load()
+            if registry is None or sensor not in registry["sensors"]:
+                return None
+            channels = self._channels.get(sensor)
+            if channels is None:
+                channels = self._channels[sensor] = {
+                    channel: dict(zip(_FIELDS, entry))
+                    for channel, entry in cbor2.loads(registry["sensors"][sensor]).items()}
+            return channels
+
+    def lookup(self, sensor, channel):
+        """
+        Look up a single channel.
+
+        Parameters:
+        sensor (str): Sensor name.
+        channel (str): Channel path relative to the sensor directory.
+
+        Returns:
+        dict: Kind, dtype, shape and generation of the channel, or None if it is not registered.
+        """
+        return (self.channels(sensor) or {}).get(channel)
+
+    @contextmanager
+    def _locked(self):
+        fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def update(self, sensors, tmpfs_path=None):
+        """
+        Add, replace or remove channels. Safe to call from several processes.
+
+        Parameters:
+        sensors (dict): Sensor name -> {channel path: entry}. Channels with entry None are removed.
+        tmpfs_path (str, optional): tmpfs path for the temporary file.
+
+        Returns:
+        int: Generation of the registry after the update.
+        """
+        with self._locked():
+            #reread under the lock, other writers may have updated it
+            with self._lock:
+                self._key = None
+                registry = self._load() or {"generation": 0, "sensors": {}}
+            tables = dict(registry["sensors"])
+            for sensor, channels in sensors.items():
+                table = cbor2.loads(tables[sensor]) if sensor in tables else {}
+                for channel, entry in channels.items():
+                    if entry is None:
+                        table.pop(channel, None)
+                    else:
+                        table[channel] = [entry[field] for field in _FIELDS]
+                if table:
+                    tables[sensor] = cbor2.dumps(table)
+                else:
+                    tables.pop(sensor, None)
+            generation = registry["generation"] + 1
+            write_cbor(self.path, {"generation": generation, "sensors": tables}, tmpfs_path=tmpfs_path)
+        return generation
+
+    def subscribe(self, callback):
+        """
+        Call callback(registry) every time the registry is updated.
+
+        Parameters:
+        callback (callable): Function called with the new registry on the inotify thread.
+
+        Returns:
+        Watch: Handle whose stop method unsubscribes.
+        """
+        return get_dispatcher().register(self.path, lambda _: callback(self.load()))
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(directory):
+    """
+    Get registry of the directory shared by all readers of the process, so that
+    the registry is decoded once per update instead of once per reader.
+
+    Parameters:
+    directory (str): Directory containing the sensors.
+
+    Returns:
+    Registry: Shared registry.
+    """
+    directory = os.path.abspath(directory)
+    with _registries_lock:
+        registry = _registries.get(directory)
+        if registry is None:
+            registry = _registries[directory] = Registry(directory)
+        return registry
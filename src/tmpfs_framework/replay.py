@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay of recorded datasets. Snapshots written by SensorReader.take_snapshot and
+start_write are republished into tmpfs through SensorWriter, so that consumers can
+be run offline against recorded data or load tested faster than real time.
+"""
+import io
+import os
+import time
+import glob
+import heapq
+import queue
+import logging
+import zipfile
+import threading
+
+from .registry import encoded_entry
+from .recorder import Snapshot, ZIPPED_COMMENT
+from .segments import read_segments, list_segments
+from .sensor_writer import SensorWriter
+
+
+def scan_recording(path, start=None, end=None):
+    """
+    Find recorded snapshots of a directory holding snapshot zip files and/or segment files.
+
+    Parameters:
+    path (str): Recording directory.
+    start (int, optional): Skip snapshots older than this timestamp in milliseconds.
+    end (int, optional): Skip snapshots newer than this timestamp in milliseconds.
+
+    Returns:
+    tuple: List of metadata Snapshots of zip files and iterator of the other Snapshots ordered
+           by timestamp. Snapshot zip files are read only when iterator reaches them. Metadata
+           recorded in segment files is included in the iterator.
+    """
+    metadata = []
+    zips = []
+    for filename in glob.glob(os.path.join(path, "*.zip")):
+        stem = os.path.basename(filename)[:-len(".zip")]
+        timestamp, _, sensor_name = stem.partition("_")
+        if _is_metadata(stem):
+            sensor_name = stem[:-len("_metadata")]
+            metadata.append(_load_zip(filename, stem, 0, sensor_name))
+        elif timestamp.isdigit():
+            timestamp = int(timestamp)
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                zips.append((timestamp, sensor_name, filename))
+        else:
+            logging.debug(f"Skipping {filename}, not a snapshot")
+    zips.sort()
+    zip_snapshots = (_load_zip(f, f"{t}_{s}", t, s) for t, s, f in zips)
+
+    segments = [read_segments(path, start, end, sensor_name=sensor_name)
+                for sensor_name in sorted({sensor for _, sensor, _ in list_segments(path)})]
+    return metadata, heapq.merge(zip_snapshots, *segments, key=lambda s: s.timestamp)
+
+
+def _is_metadata(snapshot):
+    name = snapshot if isinstance(snapshot, str) else snapshot.name
+    return name.endswith("_metadata")
+
+
+def _load_zip(filename, name, timestamp, sensor_name):
+    with open(filename, 'rb') as fd:
+        zip_bytes = fd.read()
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        zipped = zf.comment == ZIPPED_COMMENT
+    return Snapshot(name, timestamp, sensor_name, zip_bytes=zip_bytes, zipped=zipped)
+
+
+def _is_zipped(snapshot, members):
+    #snapshots of write_zip("measurement", ...) recorded before zipped snapshots were marked
+    return snapshot.zipped or any(name.startswith("measurement/") for name, _ in members)
+
+
+class Replayer:
+    """
+    Republishes a recording into tmpfs at recorded rate, a multiple of it, or as fast
+    as possible. Snapshots are read and decoded ahead of the playback clock by a
+    prefetch thread.
+
+    Each sensor of the recording is published as SensorWriter(dir_path, sensor_name).
+    Metadata is published before the first snapshot. Snapshots recorded from
+    measurement.zip are published as measurement.zip, others as separate files. Every
+    snapshot of separate files is committed, so readers can use
+    SensorReader.read_snapshot to read it consistently.
+
+    Attributes:
+    published (int): Number of published snapshots.
+    late (int): Number of snapshots published behind schedule.
+    max_lag (float): Largest delay behind schedule in seconds.
+    """
+    def __init__(self, source, dir_path="replay", tmpfs_path=None, speed=1.0, prefetch=64,
+                 start=None, end=None, as_zip=False):
+        """
+        Initialize the Replayer.
+
+        Parameters:
+        source (str): Recording directory.
+        dir_path (str, optional): Directory in tmpfs for the sensors. Defaults to "replay".
+        tmpfs_path (str, optional): tmpfs path. Defaults to tmpfs_framework.TMPFS_PATH.
+        speed (float, optional): Playback rate relative to recorded rate, None for as fast
+                                 as possible. Defaults to 1.0.
+        prefetch (int, optional): Number of decoded snapshots kept ahead. Defaults to 64.
+        start (int, optional): First timestamp to replay in milliseconds.
+        end (int, optional): Last timestamp to replay in milliseconds.
+        as_zip (bool, optional): Publish each snapshot as measurement.zip instead of
+                                 separate files. Defaults to False.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive or None")
+        self.source = source
+        self.dir_path = dir_path
+        self.tmpfs_path = tmpfs_path
+        self.speed = speed
+        self.prefetch = prefetch
+        self.start_time = start
+        self.end_time = end
+        self.as_zip = as_zip
+        self.stop_event = threading.Event()
+        self.published = 0
+        self.late = 0
+        self.max_lag = 0.0
+        self._writers = {}
+        self._thread = None
+
+    def _writer(self, sensor_name):
+        writer = self._writers.get(sensor_name)
+        if writer is None:
+            writer = self._writers[sensor_name] = SensorWriter(self.dir_path, sensor_name,
+                                                               tmpfs_path=self.tmpfs_path)
+        return writer
+
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _prefetch(self, snapshots, q):
+        try:
+            for snapshot in snapshots:
+                members = list(snapshot.iter_members())
+                if self.as_zip or _is_metadata(snapshot) or _is_zipped(snapshot, members):
+                    item = (snapshot, members, True)
+                else:
+                    #registry entries are described here, publishing only copies the bytes
+                    item = (snapshot, [(name, content, encoded_entry(content))
+                                       for name, content in members], False)
+                if not self._put(q, item):
+                    return
+        except Exception as e:
+            logging.exception(e)
+        self._put(q, None)
+
+    def _publish_zip(self, writer, name, snapshot, members):
+        if snapshot.zip_bytes is not None:
+            #recorded zip file is published as it is
+            writer.write_encoded(f'{name}.zip', snapshot.zip_bytes, ("zip", None, None))
+            return
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for arcname, content in members:
+                zf.writestr(arcname, content)
+        writer.write_encoded(f'{name}.zip', buf.getvalue(), ("zip", None, None))
+
+    def run(self):
+        """
+        Replay the recording. Blocks until recording ends or stop is called.
+
+        Returns:
+        int: Number of published snapshots.
+        """
+        self.stop_event.clear()
+        metadata, snapshots = scan_recording(self.source, self.start_time, self.end_time)
+        for snapshot in metadata:
+            self._publish_zip(self._writer(snapshot.sensor_name), "metadata", snapshot, None)
+
+        q = queue.Queue(self.prefetch)
+        prefetcher = threading.Thread(target=self._prefetch, args=(snapshots, q), daemon=True)
+        prefetcher.start()
+        clock_start = None
+        while not self.stop_event.is_set():
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            snapshot, members, zipped = item
+            writer = self._writer(snapshot.sensor_name)
+            if _is_metadata(snapshot):
+                self._publish_zip(writer, "metadata", snapshot, members)
+                continue
+            if self.speed is not None:
+                if clock_start is None:
+                    clock_start = (time.monotonic(), snapshot.timestamp)
+                due = clock_start[0] + (snapshot.timestamp - clock_start[1]) / 1000 / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    if self.stop_event.wait(delay):
+                        break
+                elif delay < 0:
+                    self.late += 1
+                    self.max_lag = max(self.max_lag, -delay)
+            if zipped:
+                self._publish_zip(writer, "measurement", snapshot, members)
+            else:
+                for name, content, entry in members:
+                    writer.write_encoded(name, content, entry)
+                writer.commit()
+            self.published += 1
+        self.stop_event.set()
+        prefetcher.join()
+        return self.published
+
+    def start(self):
+        """
+        Replay the recording in a background thread.
+        """
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the replay.
+        """
+        self.stop_event.set()
+        self.wait()
+
+    def wait(self, timeout=None):
+        """
+        Wait for background replay to finish.
+
+        Parameters:
+        timeout (float, optional): Maximum time to wait in seconds.
+
+        Returns:
+        bool: True if replay has finished.
+        """
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed-size memory mapped ring file holding the latest samples of a channel.
+
+File layout:
+    header: magic, version, number of slots, slot capacity, sequence number of newest sample
+    slots:  sequence number, payload length, payload
+
+Sequence numbers start from 1. Writer clears the sequence number of a slot before
+overwriting it and sets it after the payload is complete, so readers can detect
+samples that were overwritten while they were copied.
+"""
+import os
+import mmap
+import struct
+
+
+_MAGIC = b"TMPFSRNG"
+_VERSION = 1
+_header = struct.Struct("<8sIIQQ")
+_HEADER_SIZE = 64
+_slot_header = struct.Struct("<QQ")
+_u64 = struct.Struct("<Q")
+_HEAD_OFFSET = 24
+
+
+def history_path(path: str) -> str:
+    """
+    Returns path of the hidden ring file holding history of the given file.
+
+    Args:
+    path (str): Path of the published file.
+
+    Returns:
+    str: Path of the ring file.
+    """
+    dirpath, basename = os.path.split(path)
+    return os.path.join(dirpath, f".{basename}.history")
+
+
+def slot_size_for(payload_size: int) -> int:
+    """
+    Returns slot capacity for payloads of the given size. Capacity is the next power
+    of two with room for twice the payload so that variation in payload size fits.
+
+    Args:
+    payload_size (int): Size of a payload in bytes.
+
+    Returns:
+    int: Slot capacity in bytes, at least 4096.
+    """
+    return max(4096, 1 << (2 * payload_size - 1).bit_length())
+
+
+class HistoryRing:
+    """
+    Ring buffer of CBOR encoded samples in a memory mapped tmpfs file.
+
+    Attributes:
+    path (str): Path of the ring file.
+    nslots (int): Number of samples kept.
+    slot_size (int): Maximum size of a sample in bytes.
+    """
+    def __init__(self, path: str, writable: bool = False) -> None:
+        """
+        Opens an existing ring file.
+
+        Args:
+        path (str): Path of the ring file.
+        writable (bool): Map the file for writing.
+        """
+        self.path = path
+        self.writable = writable
+        with open(path, 'r+b' if writable else 'rb') as fd:
+            self.inode = os.fstat(fd.fileno()).st_ino
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=access)
+        magic, version, self.nslots, self.slot_size, _ = _header.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a history ring file")
+        self._stride = _slot_header.size + self.slot_size
+
+    @classmethod
+    def create(cls, path: str, nslots: int, slot_size: int, start_seq: int = 0) -> "HistoryRing":
+        """
+        Creates a new empty ring file, atomically replacing existing one.
+
+        Args:
+        path (str): Path of the ring file.
+        nslots (int): Number of samples kept.
+        slot_size (int): Maximum size of a sample in bytes.
+        start_seq (int): Sequence number of the newest sample, used to continue numbering.
+
+        Returns:
+        HistoryRing: Writable ring.
+        """
+        tmpf = f"{path}.{os.getpid()}.tmp"
+        size = _HEADER_SIZE + nslots * (_slot_header.size + slot_size)
+        with open(tmpf, 'wb') as fd:
+            fd.truncate(size)
+            fd.write(_header.pack(_MAGIC, _VERSION, nslots, slot_size, start_seq))
+        os.rename(tmpf, path)
+        return cls(path, writable=True)
+
+    @property
+    def head(self) -> int:
+        """
+        Sequence number of the newest sample, 0 if ring is empty.
+        """
+        return _u64.unpack_from(self._mmap, _HEAD_OFFSET)[0]
+
+    def _offset(self, seq: int) -> int:
+        return _HEADER_SIZE + ((seq - 1) % self.nslots) * self._stride
+
+    def append(self, payload: bytes) -> int:
+        """
+        Adds a sample, overwriting the oldest one if ring is full.
+
+        Args:
+        payload (bytes): Encoded sample.
+
+        Returns:
+        int: Sequence number of the sample.
+
+        Raises:
+        ValueError: If payload does not fit in a slot.
+        """
+        if len(payload) > self.slot_size:
+            raise ValueError(f"Sample of {len(payload)} bytes does not fit in {self.slot_size} byte slot")
+        seq = self.head + 1
+        offset = self._offset(seq)
+        _slot_header.pack_into(self._mmap, offset, 0, len(payload))
+        start = offset + _slot_header.size
+        self._mmap[start:start + len(payload)] = payload
+        _u64.pack_into(self._mmap, offset, seq)
+        _u64.pack_into(self._mmap, _HEAD_OFFSET, seq)
+        return seq
+
+    def get(self, seq: int):
+        """
+        Copies a sample out of the ring.
+
+        Args:
+        seq (int): Sequence number of the sample.
+
+        Returns:
+        bytes: Sample payload, or None if sample has been overwritten.
+        """
+        offset = self._offset(seq)
+        slot_seq, length = _slot_header.unpack_from(self._mmap, offset)
+        if slot_seq != seq or length > self.slot_size:
+            return None
+        start = offset + _slot_header.size
+        payload = self._mmap[start:start + length]
+        if _u64.unpack_from(self._mmap, offset)[0] != seq:
+            return None
+        return payload
+
+    def read_since(self, seq: int):
+        """
+        Returns samples newer than seq that are still in the ring.
+
+        Args:
+        seq (int): Sequence number of the last sample the caller has seen.
+
+        Returns:
+        list: Tuples of (sequence number, payload) in increasing order.
+        """
+        head = self.head
+        if seq > head:
+            #ring was recreated by a restarted writer
+            seq = 0
+        first = max(seq + 1, head - self.nslots + 1, 1)
+        samples = []
+        for s in range(first, head + 1):
+            payload = self.get(s)
+            if payload is not None:
+                samples.append((s, payload))
+        return samples
+
+    def read_last(self, n: int):
+        """
+        Returns up to n newest samples.
+
+        Args:
+        n (int): Number of samples.
+
+        Returns:
+        list: Tuples of (sequence number, payload) in increasing order.
+        """
+        return self.read_since(max(self.head - n, 0))
+
+    def close(self) -> None:
+        self._mmap.close()
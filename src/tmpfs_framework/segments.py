@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only segmented recording format. Used by SensorReader.start_write when many
+small snapshots would otherwise become one zip file each.
+
+Snapshots are stored as length-prefixed CBOR records that are grouped into chunks.
+Each chunk may be compressed. Segment files are rotated when they grow past a size
+limit and get a trailing time index when closed, so readers can skip chunks outside
+the requested time range. A segment left without index by a crash is read by scanning
+its chunks, and a partially written last chunk is ignored.
+
+Records of a chunk are sorted by timestamp. Snapshots written by several workers may
+arrive late, so time ranges of chunks and segments can overlap. Readers merge
+overlapping chunks and segments to return snapshots in timestamp order.
+
+Segment files are named <first timestamp>_<sensor>.seg, or <first timestamp>.<n>_<sensor>.seg
+if several segments start at the same millisecond.
+
+File layout:
+    file header: magic, version
+    chunks:      chunk header (magic, codec, payload length, record count, first and
+                 last timestamp), payload of records (u32 length, CBOR record)
+    index:       chunk header with magic b"INDX" and CBOR list of
+                 [offset, first timestamp, last timestamp, record count] per chunk
+    trailer:     offset of index, magic
+"""
+import os
+import bz2
+import lzma
+import zlib
+import re
+import functools
+import glob
+import heapq
+import struct
+import threading
+
+import cbor2
+
+from .recorder import Snapshot
+from .compression import compress_encoded
+
+SUFFIX = ".seg"
+
+_MAGIC = b"TMPFSSEG"
+_VERSION = 1
+_file_header = struct.Struct("<8sI")
+_chunk_header = struct.Struct("<4sBIIqq")
+_trailer = struct.Struct("<Q8s")
+_record_length = struct.Struct("<I")
+_CHUNK = b"CHNK"
+_INDEX = b"INDX"
+_END = b"TMPFSEND"
+#counter is next to the timestamp, sensor names may end with .<digits>
+_segment_name = re.compile(rf"(?P<timestamp>\d+)(\.(?P<n>\d+))?_(?P<sensor>.+){re.escape(SUFFIX)}")
+
+_codecs = {
+    0: (lambda data, level: data, lambda data: data),
+    1: (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    2: (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    3: (lambda data, level: bz2.compress(data, level), bz2.decompress),
+}
+CODECS = {None: 0, "zlib": 1, "lzma": 2, "bz2": 3}
+
+
+class SegmentWriter:
+    """
+    Writes snapshots to rotating segment files. Can be used as sink of RecordingPipeline,
+    writes from several workers are serialized.
+
+    Attributes:
+    path (str): Directory of the segment files.
+    sensor_name (str): Name of the sensor, used in segment file names.
+    segment_size (int): Segment is closed and a new one started when it grows past this size.
+    chunk_size (int): Records are buffered until they take this many bytes.
+    flush_interval (float): Buffered records are written at latest this many seconds after
+                            the first of them, None to wait for chunk_size.
+    """
+    def __init__(self, path, sensor_name, segment_size=64 * 2**20, chunk_size=2**20,
+                 compression=None, compresslevel=3, codec=None, flush_interval=None):
+        """
+        Initialize the SegmentWriter. Segment files are created on first write.
+
+        Parameters:
+        path (str): Directory of the segment files.
+        sensor_name (str): Name of the sensor.
+        segment_size (int, optional): Size limit of a segment file. Defaults to 64 MiB.
+        chunk_size (int, optional): Size of uncompressed chunk. Defaults to 1 MiB.
+        compression (str, optional): "zlib", "lzma", "bz2" or None. Defaults to None.
+        compresslevel (int, optional): Compression level. Defaults to 3.
+        codec (str, optional): Compression codec applied to each value before chunk
+                               compression, see compression module. Defaults to None.
+        flush_interval (float, optional): Maximum time in seconds records are buffered
+                                          before they are written. Bounds data lost in
+                                          a crash of a slow recording. Defaults to None.
+        """
+        if compression not in CODECS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {list(CODECS)}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.sensor_name = sensor_name
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self.codec = CODECS[compression]
+        self.compresslevel = compresslevel
+        self.value_codec = codec
+        self._fd = None
+        self._index = []
+        self._records = []
+        self._buffered = 0
+        self.flush_interval = flush_interval
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __call__(self, snapshot):
+        self.write(snapshot)
+
+    def write(self, snapshot):
+        """
+        Add snapshot to the current chunk.
+
+        Parameters:
+        snapshot (Snapshot): Captured data.
+        """
+        files = dict(snapshot.iter_members())
+        if self.value_codec:
+            files = {name: compress_encoded(content, self.value_codec) for name, content in files.items()}
+        record = {"timestamp": snapshot.timestamp, "sensor": snapshot.sensor_name,
+                  "name": snapshot.name, "files": files}
+        if snapshot.zipped:
+            record["zipped"] = True
+        record = cbor2.dumps(record)
+        with self._lock:
+            self._records.append((snapshot.timestamp, record))
+            self._buffered += len(record)
+            if self._buffered >= self.chunk_size:
+                self._write_chunk()
+            elif self.flush_interval is not None and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write buffered records as a chunk.
+        """
+        with self._lock:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._records:
+            return
+        #workers may hand snapshots over out of order
+        self._records.sort(key=lambda r: r[0])
+        first, last = self._records[0][0], self._records[-1][0]
+        if self._fd is None:
+            filename = os.path.join(self.path, f"{first}_{self.sensor_name}{SUFFIX}")
+            n = 0
+            while self._fd is None:
+                try:
+                    self._fd = open(filename, 'xb')
+                except FileExistsError:
+                    n += 1
+                    filename = os.path.join(self.path, f"{first}.{n}_{self.sensor_name}{SUFFIX}")
+            self._fd.write(_file_header.pack(_MAGIC, _VERSION))
+        payload = b"".join(_record_length.pack(len(record)) + record for _, record in self._records)
+        payload = _codecs[self.codec][0](payload, self.compresslevel)
+        offset = self._fd.tell()
+        self._fd.write(_chunk_header.pack(_CHUNK, self.codec, len(payload), len(self._records), first, last))
+        self._fd.write(payload)
+        self._fd.flush()
+        self._index.append([offset, first, last, len(self._records)])
+        self._records = []
+        self._buffered = 0
+        if self._fd.tell() >= self.segment_size:
+            self._close_segment()
+
+    def _close_segment(self):
+        payload = cbor2.dumps(self._index)
+        offset = self._fd.tell()
+        first = min(i[1] for i in self._index)
+        last = max(i[2] for i in self._index)
+        self._fd.write(_chunk_header.pack(_INDEX, 0, len(payload), len(self._index), first, last))
+        self._fd.write(payload)
+        self._fd.write(_trailer.pack(offset, _END))
+        self._fd.close()
+        self._fd = None
+        self._index = []
+
+    def close(self):
+        """
+        Write buffered records and the index of the current segment.
+        """
+        with self._lock:
+            self._write_chunk()
+            if self._fd is not None:
+                self._close_segment()
+
+
+def _read_index(fd, size):
+    if size < _file_header.size + _trailer.size:
+        return None
+    fd.seek(size - _trailer.size)
+    offset, magic = _trailer.unpack(fd.read(_trailer.size))
+    if magic != _END:
+        return None
+    fd.seek(offset)
+    magic, _, length, _, _, _ = _chunk_header.unpack(fd.read(_chunk_header.size))
+    if magic != _INDEX:
+        return None
+    return cbor2.loads(fd.read(length))
+
+
+def _scan_chunks(fd, size):
+    index = []
+    offset = _file_header.size
+    while offset + _chunk_header.size <= size:
+        fd.seek(offset)
+        magic, _, length, count, first, last = _chunk_header.unpack(fd.read(_chunk_header.size))
+        if magic != _CHUNK or offset + _chunk_header.size + length > size:
+            break
+        index.append([offset, first, last, count])
+        offset += _chunk_header.size + length
+    return index
+
+
+def _read_chunks(fd, filename):
+    """
+    Check file header and read index of an open segment file, scanning chunks if the
+    segment has no index.
+    """
+    size = os.fstat(fd.fileno()).st_size
+    magic, version = _file_header.unpack(fd.read(_file_header.size))
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"{filename} is not a segment file")
+    index = _read_index(fd, size)
+    if index is None:
+        index = _scan_chunks(fd, size)
+    return index
+
+
+def _read_chunk(fd, offset, start, end):
+    fd.seek(offset)
+    _, codec, length, count, _, _ = _chunk_header.unpack(fd.read(_chunk_header.size))
+    payload = memoryview(_codecs[codec][1](fd.read(length)))
+    pos = 0
+    for _ in range(count):
+        (n,) = _record_length.unpack_from(payload, pos)
+        pos += _record_length.size
+        record = cbor2.loads(payload[pos:pos + n])
+        pos += n
+        timestamp = record["timestamp"]
+        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+            continue
+        yield Snapshot(record["name"], timestamp, record["sensor"],
+                       members=list(record["files"].items()),
+                       zipped=record.get("zipped", False))
+
+
+def _merge_runs(runs):
+    """
+    Merge runs of snapshots into timestamp order. Runs that do not overlap in time are
+    read one after another, so only overlapping runs are open at the same time.
+
+    Parameters:
+    runs (list): Tuples of (first timestamp, last timestamp, function returning iterator
+                 over snapshots of the run in timestamp order).
+
+    Yields:
+    Snapshot: Snapshots of all runs in timestamp order.
+    """
+    group = []
+    group_last = None
+    for first, last, run in sorted(runs, key=lambda r: r[0]):
+        if group and first >= group_last:
+            yield from heapq.merge(*(r() for r in group), key=lambda snapshot: snapshot.timestamp)
+            group = []
+        group_last = last if not group else max(group_last, last)
+        group.append(run)
+    yield from heapq.merge(*(r() for r in group), key=lambda snapshot: snapshot.timestamp)
+
+
+def read_segment(filename, start=None, end=None):
+    """
+    Read snapshots from a segment file.
+
+    Parameters:
+    filename (str): Path of the segment file.
+    start (int, optional): Skip snapshots older than this timestamp in milliseconds.
+    end (int, optional): Skip snapshots newer than this timestamp in milliseconds.
+
+    Yields:
+    Snapshot: Recorded snapshots in timestamp order.
+    """
+    with open(filename, 'rb') as fd:
+        runs = [(first, last, functools.partial(_read_chunk, fd, offset, start, end))
+                for offset, first, last, _ in _read_chunks(fd, filename)
+                if not ((start is not None and last < start) or (end is not None and first > end))]
+        yield from _merge_runs(runs)
+
+
+def _segment_range(filename):
+    """
+    Get first and last timestamp of a segment file, None if it has no chunks.
+    """
+    with open(filename, 'rb') as fd:
+        index = _read_chunks(fd, filename)
+    if not index:
+        return None
+    return min(i[1] for i in index), max(i[2] for i in index)
+
+
+def list_segments(path):
+    """
+    List segment files of a directory.
+
+    Parameters:
+    path (str): Directory of the segment files.
+
+    Returns:
+    list: Tuples of (first timestamp, sensor name, filename) in order of first timestamp.
+    """
+    segments = []
+    for filename in glob.glob(os.path.join(path, f"*{SUFFIX}")):
+        match = _segment_name.fullmatch(os.path.basename(filename))
+        if match is None:
+            continue
+        segments.append((int(match["timestamp"]), int(match["n"] or 0), match["sensor"], filename))
+    segments.sort()
+    return [(timestamp, sensor_name, filename) for timestamp, _, sensor_name, filename in segments]
+
+
+def read_segments(path, start=None, end=None, sensor_name=None):
+    """
+    Read snapshots from all segment files of a directory.
+
+    Parameters:
+    path (str): Directory of the segment files.
+    start (int, optional): Skip snapshots older than this timestamp in milliseconds.
+    end (int, optional): Skip snapshots newer than this timestamp in milliseconds.
+    sensor_name (str, optional): Read only segments of this sensor. Defaults to all sensors.
+
+    Yields:
+    Snapshot: Recorded snapshots in timestamp order.
+    """
+    runs = []
+    for _, sensor, filename in list_segments(path):
+        if sensor_name is not None and sensor != sensor_name:
+            continue
+        bounds = _segment_range(filename)
+        if bounds is None or (start is not None and bounds[1] < start) or (end is not None and bounds[0] > end):
+            continue
+        runs.append(bounds + (functools.partial(read_segment, filename, start, end),))
+    yield from _merge_runs(runs)
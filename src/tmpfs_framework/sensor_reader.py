@@ -7,17 +7,30 @@ Created on Tue Oct 27 10:11:37 2020
 
 import os
 import time
-import shutil
 import zipfile
 import multiprocessing
+import threading
+import functools
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
 import logging
 import cbor2
+import numpy as np
 
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from .cbor_utils import decode_tags
+from .cbor_utils import decode_tags, mmap_array, load_cbor, loads_cbor, COMMIT_FILE
+from .decode_cache import DecodeCache, stat_key
+from .inotify import get_dispatcher
+from .ring_buffer import HistoryRing, history_path
+from .shared_array import read_shared_array, SharedArrayReader, SUFFIX as SHARED_ARRAY_SUFFIX
+from .recorder import Snapshot, RecordingPipeline, write_snapshot
+from .segments import SegmentWriter
+from .metrics import metrics
+from .registry import get_registry
+from .records import SUFFIX as RECORD_SUFFIX
 import tmpfs_framework
 
 
@@ -28,9 +41,13 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 class SensorNotInitializedError(Exception):
     pass
 
+class SnapshotConsistencyError(Exception):
+    pass
+
 class SensorReader:
     def __init__(self, directory, filename=None, sensor_name=None, data_dir="collected_data/",
-                  to_watch="measurement.zip", tmpfs_path = None, **kwargs):
+                  to_watch="measurement.zip", tmpfs_path = None, use_mmap=False, cache_size=0, lazy_zip=False,
+                  parallel=None, use_registry=True, **kwargs):
         """
         Initialize the SensorReader object.
 
@@ -40,42 +57,65 @@ class SensorReader:
         sensor_name (str, optional): Name of the sensor. Defaults to None.
         data_dir (str, optional): Directory to store collected data. Defaults to "collected_data/".
         to_watch (str, optional): File to watch for changes. Defaults to "measurement.zip".
+        use_mmap (bool, optional): Return typed arrays as read-only views over memory mapped
+                                   files instead of copying them. Defaults to False.
+        cache_size (int, optional): Memory bound in bytes for cache of decoded values.
+                                    Unchanged files are not decoded again. Cached values are shared
+                                    between reads, so arrays are returned read-only, also when
+                                    nested inside dictionaries and lists, and dictionaries and
+                                    lists are copied on every read. Copy an array before modifying
+                                    it. Shared array channels are not cached. Defaults to 0 (disabled).
+        lazy_zip (bool, optional): Return zip files as LazyZipMapping that decodes members on
+                                   first access. Defaults to False.
+        parallel (str or Executor, optional): Decode files of directories and members of zip files
+                                              in parallel. "thread" or "process" to use shared
+                                              executor of that kind, or an Executor. Defaults to None.
+        use_registry (bool, optional): Order sensors and attributes by the registry kept by
+                                       writers. Registered sensors that still exist come first,
+                                       then sensors written without registration. Defaults to True.
         """
         self.tmpfs_path = tmpfs_path if tmpfs_path is not None else tmpfs_framework.TMPFS_PATH
         self.data_dir = data_dir
+        self.use_mmap = use_mmap
+        self.cache = DecodeCache(cache_size) if cache_size else None
+        self.lazy_zip = lazy_zip
+        self._parallel_executor = get_executor(parallel) if isinstance(parallel, str) else parallel
         d = os.path.join(self.tmpfs_path, directory)
+        self.registry = get_registry(d) if use_registry else None
+        sensors = self.registry.sensors() if use_registry else []
 
         if filename is None or isinstance(filename, int):
             if filename is None:
                 filename = -1
-            files = os.listdir(d)
+            files = [file for file in os.listdir(d) if not file.startswith(".")]
+            if sensors:
+                #registry may have stale sensors and miss sensors written without registration
+                registered = set(sensors)
+                files = sorted(registered.intersection(files)) + [file for file in files if file not in registered]
             filename = files[filename]
 
         self.sensor_path = os.path.join(d, filename)
+        self.metrics_name = os.path.relpath(self.sensor_path, self.tmpfs_path)
         self.filename = filename
         self.sensor_name = filename.replace(" ", "_") if sensor_name is None else sensor_name
         self.has_zip = False
         self.has_metaFile = False
+        channels = self.registry.channels(filename) if use_registry else None
 
-        if os.path.isdir(self.sensor_path):
-            self.attributes = os.listdir(self.sensor_path)
-            if os.path.isfile(os.path.join(self.sensor_path, 'measurement.zip')):
-                self.has_zip = True
-            if os.path.isfile(os.path.join(self.sensor_path, 'metadata.zip')):
-                self.has_metaFile = True
+        if channels is not None and "" in channels:
+            self.attributes = [filename]
+            self.to_watch = filename
+        elif os.path.isdir(self.sensor_path):
+            files = self._list_attributes(channels)
+            self.attributes = files
+            self.has_zip = "measurement.zip" in files
+            self.has_metaFile = "metadata.zip" in files
             self.attributes = [file for file in self.attributes if "measurement" not in file and "metadata" not in file]
 
-            files =os.listdir(self.sensor_path)
             if  to_watch in files:
                 self.to_watch = to_watch
             elif len(files)>0:
-                to_watch = files[0]
-                for fn in files:
-                    #print(fn, os.path.isfile(os.path.join(self.sensor_path,fn)))
-                    if os.path.isfile(os.path.join(self.sensor_path,fn)):
-                        to_watch = fn
-                    break
-                self.to_watch=to_watch
+                self.to_watch = files[0]
 
         elif os.path.isfile(self.sensor_path):
             self.attributes = [filename]
@@ -83,7 +123,7 @@ class SensorReader:
         else:
             raise FileNotFoundError(f"No datafile found, {self.sensor_path}")
 
-        if not self.attributes:
+        if not self.attributes and not self.has_zip:
             raise SensorNotInitializedError(f"Measurements not initialized, {self.sensor_path}")
 
 
@@ -98,9 +138,35 @@ class SensorReader:
         self.prev_stat = os.stat(self.sensor_path)
         self.prev_ts = time.time()
         self.observers = {}
+        self._generations = {}  # attribute -> [stat key, generation]
+        self._seen = {}         # attribute -> generation consumer has last looked at
+        self._generation_lock = threading.Lock()
+        self._rings = {}
+        self._shared_arrays = {}
+        self.pipeline = None
         self._init_attributes()
         self.observer = Observer()
 
+    def _list_attributes(self, channels=None):
+        """
+        List files of the sensor directory. Registered channels come first in the order
+        they were registered. Directory is always listed, because files written without
+        SensorWriter.write, e.g. with pack_to_zip, are not registered and registered
+        channels may have been removed since.
+
+        Parameters:
+        channels (dict, optional): Registered channels of the sensor. Defaults to None.
+
+        Returns:
+        list: Names of the files and directories, hidden files excluded.
+        """
+        files = [file for file in os.listdir(self.sensor_path) if not file.startswith(".")]
+        if channels is None:
+            return files
+        #nested channels are shown as their top level directory like in listing
+        registered = dict.fromkeys(channel.split("/", 1)[0] for channel in channels)
+        listed = set(files)
+        return [file for file in registered if file in listed] + [file for file in files if file not in registered]
 
     def _init_attributes(self):
         """
@@ -108,8 +174,22 @@ class SensorReader:
         """
         cleaned_attributes = []
         self.filenames = self.attributes
+        self._record_fields = {}
+        attributes = list(self.attributes)
+        for filename in self.filenames:
+            if filename.endswith(RECORD_SUFFIX):
+                try:
+                    fields = read(os.path.join(self.sensor_path, filename))
+                except (OSError, ValueError) as e:
+                    logging.debug(e)
+                    continue
+                #fields of packed records are attributes of their own, files of same name win
+                for field in fields:
+                    if field not in self.filenames and field not in self._record_fields:
+                        self._record_fields[field] = filename
+                        attributes.append(field)
 
-        for attribute in self.attributes:
+        for attribute in attributes:
             try:
                 filename = attribute
                 attribute = attribute.replace(" ", "_").replace(".", "_")
@@ -117,7 +197,8 @@ class SensorReader:
                     self.__setattr__(f"get_{attribute}", self._create_attribute_function(filename))
                 attribute_name = attribute.replace(" ", "_")
                 cleaned_attributes.append(attribute_name)
-                if not hasattr(self, attribute_name):
+                #hasattr(self, ...) would read the file through property installed by earlier reader
+                if attribute_name not in self.__dict__ and not hasattr(type(self), attribute_name):
                     prop = property(fget=self._create_attribute_function(filename), doc=f"{attribute} getter property")
                     setattr(self.__class__, attribute_name, prop)
             except Exception as e:
@@ -165,79 +246,91 @@ class SensorReader:
         """
         #path = '/' + path
         #data, intrinsics = read(self.sensor_path, path)
-        data = read(self.sensor_path, path)
+        data = read(self.sensor_path, path, use_mmap=self.use_mmap, lazy=self.lazy_zip, executor=self._parallel_executor)
 
         return data#, intrinsics
 
-    def take_snapshot(self, path, compresslevel=0):
+    def capture_snapshot(self):
         """
-        Take a snapshot of the sensor data.
-
-        Parameters:
-        path (str): Path to save the snapshot.
-        compress (bool, optional): Whether to compress the snapshot. Defaults to False.
+        Capture current sensor data into memory for recording. Metadata is captured too
+        on the first call after start_write.
 
         Returns:
-        bool: True if snapshot is taken successfully, False otherwise.
+        list: Captured Snapshots.
         """
-        if path[-1] != '/':
-            path += '/'
-        timestamp=str(int(os.stat(os.path.join(self.sensor_path,self.to_watch)).st_mtime_ns/1e6)) # in milliseconds
-        #timestamp = str(int(time.time_ns() / 1e6))  # in milliseconds
-        compresslevel = compresslevel
-
+        snapshots = []
         if self.first and self.has_metaFile:
-            snapShotFile = os.path.join(path, self.sensor_name + "_metadata")
-            if compresslevel == 0:
-                shutil.copy2(f'{self.sensor_path}/metadata.zip', f'{snapShotFile}.zip')
-            else:
-                with zipfile.ZipFile(f'{self.sensor_path}/metadata.zip', 'r') as myZip:
-                    files = myZip.namelist()
-                    with zipfile.ZipFile(f'{snapShotFile}.zip', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as compressed:
-                        for file in files:
-                            compressed.writestr(file, myZip.read(file))
+            with open(f'{self.sensor_path}/metadata.zip', 'rb') as fd:
+                timestamp = int(os.fstat(fd.fileno()).st_mtime_ns / 1e6)
+                snapshots.append(Snapshot(f"{self.sensor_name}_metadata", timestamp, self.sensor_name,
+                                          zip_bytes=fd.read()))
             self.first = False
 
-        snapShotFile = f'{path}{timestamp}_{self.sensor_name}'
-
         if self.has_zip:
-            if compresslevel == 0:
-                shutil.copy2(f'{self.sensor_path}/measurement.zip', f'{snapShotFile}.zip')
-            else:
-                with zipfile.ZipFile(f'{self.sensor_path}/measurement.zip', 'r') as myZip:
-                    files = myZip.namelist()
-                    with zipfile.ZipFile(f'{snapShotFile}.zip', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as compressed:
-                        for file in files:
-                            compressed.writestr(file, myZip.read(file))
-            return True
-
-
-        with zipfile.ZipFile(f'{snapShotFile}.zip', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zipArchive:
+            with open(f'{self.sensor_path}/measurement.zip', 'rb') as fd:
+                timestamp = int(os.fstat(fd.fileno()).st_mtime_ns / 1e6) # in milliseconds
+                snapshots.append(Snapshot(f"{timestamp}_{self.sensor_name}", timestamp, self.sensor_name,
+                                          zip_bytes=fd.read()))
+            return snapshots
+
+        if os.path.isfile(self.sensor_path):
+            watched = self.sensor_path
+            files = [(self.filename, self.sensor_path)]
+        else:
+            watched = os.path.join(self.sensor_path, self.to_watch)
+            files = []
             for name in self.filenames:
-                if "metadata" in name:
+                if "metadata" in name or name.startswith("."):
                     continue
                 filePath = os.path.join(self.sensor_path, name)
                 if os.path.exists(filePath + '.zip'):
                     continue
-                elif name.endswith(".zip"):
-                    zipArchive.write(filename=filePath, arcname=name)
                 elif os.path.isdir(filePath):
-                    for root, dirs, files in os.walk(filePath):
-                        for file in files:
-                            fn = Path(root, file)
-                            afn = fn.relative_to(self.sensor_path)
-                            if os.path.exists(fn):
-                                zipArchive.write(filename=fn, arcname=afn)
-                            else:
-                                zipArchive.write(filename=filePath, arcname=name)
-            return True
+                    for root, dirs, walked in os.walk(filePath):
+                        dirs[:] = [d for d in dirs if not d.startswith(".")]
+                        for file in walked:
+                            if not file.startswith("."):
+                                fn = Path(root, file)
+                                files.append((str(fn.relative_to(self.sensor_path)), fn))
+                else:
+                    files.append((name, filePath))
+        timestamp = int(os.stat(watched).st_mtime_ns / 1e6) # in milliseconds
+
+        members = []
+        for arcname, filePath in files:
+            try:
+                with open(filePath, 'rb') as fd:
+                    members.append((arcname, fd.read()))
+            except FileNotFoundError:
+                logging.debug(f"{filePath} disappeared before it was captured")
+        snapshots.append(Snapshot(f"{timestamp}_{self.sensor_name}", timestamp, self.sensor_name,
+                                  members=members))
+        return snapshots
+
+    def take_snapshot(self, path, compresslevel=0, codec=None):
+        """
+        Take a snapshot of the sensor data.
+
+        Parameters:
+        path (str): Path to save the snapshot.
+        compresslevel (int, optional): Deflate level of the snapshot. Defaults to 0.
+        codec (str, optional): Compression codec of each value, e.g. "delta+shuffle+zlib".
+                               See compression module. Defaults to None.
+
+        Returns:
+        bool: True if snapshot is taken successfully, False otherwise.
+        """
+        for snapshot in self.capture_snapshot():
+            write_snapshot(snapshot, path, compresslevel, codec)
+        return True
 
     def update_attributes(self):
         """
         Update attribute array for the SensorReader object. Can be used to detec new
         variables if they were not available at start up
         """
-        self.attributes = os.listdir(self.sensor_path)
+        channels = self.registry.channels(self.filename) if self.registry is not None else None
+        self.attributes = self._list_attributes(channels)
         self._init_attributes()
 
     def get_value(self, name):
@@ -252,7 +345,237 @@ class SensorReader:
         """
         if name =="attributes":
             return self.attributes
-        return read(os.path.join(self.sensor_path, name))
+        if name in self._record_fields:
+            return self.get_value(self._record_fields[name])[name]
+        path = os.path.join(self.sensor_path, name)
+        start = time.perf_counter_ns()
+        executor = self._parallel_executor
+        #shared arrays are written in place, so stat of the file does not tell when they change
+        if self.cache is None or name.endswith(SHARED_ARRAY_SUFFIX):
+            value = read(path, use_mmap=self.use_mmap, lazy=self.lazy_zip, executor=executor)
+        else:
+            value = self.cache.get(path, lambda: read(path, use_mmap=self.use_mmap, lazy=self.lazy_zip,
+                                                      executor=executor))
+        if metrics.enabled:
+            metrics.record_read(os.path.join(self.metrics_name, name), time.perf_counter_ns() - start)
+        return value
+
+    def cache_info(self):
+        """
+        Get statistics of the decode cache.
+
+        Returns:
+        dict: Hits, misses, evictions and size of the cache. None if cache is disabled.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.info()
+
+    def generation(self, name):
+        """
+        Get generation number of the given attribute. Generation is increased every time
+        the file of the attribute is replaced, which is detected from its inode and mtime.
+        Shared array channels are written in place, their generation is the sequence
+        number of the newest array.
+
+        Parameters:
+        name (str): Attribute name.
+
+        Returns:
+        int: Generation of the attribute, starting from 1. 0 for shared array channel
+             that has not been written.
+        """
+        if name.endswith(SHARED_ARRAY_SUFFIX):
+            return self._shared_array(name).newest_seq()
+        key = stat_key(os.stat(self.get_value_path(name)))
+        with self._generation_lock:
+            entry = self._generations.get(name)
+            if entry is None:
+                entry = self._generations[name] = [key, 1]
+            elif entry[0] != key:
+                entry[0] = key
+                entry[1] += 1
+            return entry[1]
+
+    def _shared_array(self, name):
+        """
+        Get reader of the shared array channel, opening it on first use.
+        """
+        with self._generation_lock:
+            reader = self._shared_arrays.get(name)
+            if reader is None:
+                reader = self._shared_arrays[name] = SharedArrayReader(self.get_value_path(name))
+            return reader
+
+    def has_changed(self, name):
+        """
+        Check if the attribute has changed since previous call of has_changed,
+        wait_for_update or read_if_newer for it. Costs a single stat().
+
+        Parameters:
+        name (str): Attribute name.
+
+        Returns:
+        bool: True if attribute has changed or has not been looked at before.
+        """
+        generation = self.generation(name)
+        with self._generation_lock:
+            changed = self._seen.get(name) != generation
+            self._seen[name] = generation
+        return changed
+
+    def wait_for_update(self, name, timeout=None):
+        """
+        Block until the attribute changes. Returns immediately if it has changed since it
+        was last looked at with has_changed, wait_for_update or read_if_newer.
+        Waits on inotify notification instead of polling. Shared array channels are
+        written in place without inotify events, so they are polled every wait_time.
+
+        Parameters:
+        name (str): Attribute name.
+        timeout (float, optional): Maximum time to wait in seconds. Defaults to None (forever).
+
+        Returns:
+        int: New generation of the attribute, or None if timeout expired.
+        """
+        updated = threading.Event()
+        watch = None
+        if not name.endswith(SHARED_ARRAY_SUFFIX):
+            try:
+                watch = get_dispatcher().register(self.get_value_path(name), lambda _: updated.set())
+            except OSError as e:
+                logging.debug(f"inotify not available, polling for updates: {e}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                if self.has_changed(name):
+                    return self._seen[name]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                if watch is None:
+                    time.sleep(self.wait_time if remaining is None else min(self.wait_time, remaining))
+                elif updated.wait(remaining):
+                    updated.clear()
+        finally:
+            if watch is not None:
+                watch.stop()
+
+    def read_if_newer(self, name, generation):
+        """
+        Read the attribute only if it is newer than the given generation.
+
+        Parameters:
+        name (str): Attribute name.
+        generation (int): Generation the caller already has. Use 0 to always read.
+
+        Returns:
+        tuple: Value and its generation, or None if attribute has not changed.
+        """
+        current = self.generation(name)
+        if current <= generation:
+            return None
+        with self._generation_lock:
+            self._seen[name] = current
+        return self.get_value(name), current
+
+    def read_snapshot(self, names=None, retries=100):
+        """
+        Read a consistent set of attributes committed by SensorWriter.commit.
+        All returned values belong to the same writer generation even if the writer
+        publishes new values during the read.
+
+        Parameters:
+        names (list, optional): Attributes to read. Defaults to all committed attributes.
+        retries (int, optional): Number of attempts before giving up. Defaults to 100.
+
+        Returns:
+        tuple: Dictionary of values and the generation they belong to.
+
+        Raises:
+        KeyError: If a requested attribute has not been committed.
+        SnapshotConsistencyError: If no consistent set could be read within retries.
+        """
+        marker_path = os.path.join(self.sensor_path, COMMIT_FILE)
+        for _ in range(retries):
+            marker = read(marker_path)
+            committed = marker["files"]
+            wanted = list(committed) if names is None else list(names)
+            for name in wanted:
+                if name not in committed:
+                    raise KeyError(f"{name} has not been committed in {self.sensor_path}")
+
+            files = {}
+            try:
+                for name in wanted:
+                    fd = open(os.path.join(self.sensor_path, name), 'rb')
+                    files[name] = fd
+                    st = os.fstat(fd.fileno())
+                    if [st.st_ino, st.st_mtime_ns] != list(committed[name]):
+                        #writer has published a newer version, retry with new marker
+                        break
+                else:
+                    values = {name: _read_open_file(fd, name, self.use_mmap)
+                              for name, fd in files.items()}
+                    return values, marker["generation"]
+            except FileNotFoundError:
+                pass
+            finally:
+                for fd in files.values():
+                    fd.close()
+            time.sleep(0)
+        raise SnapshotConsistencyError(f"Could not read consistent snapshot of {self.sensor_path}")
+
+    def _history_ring(self, name):
+        """
+        Open history ring of the attribute, reopening it if writer has recreated it.
+        """
+        path = history_path(self.get_value_path(name))
+        ring = self._rings.get(name)
+        if ring is not None and os.stat(path).st_ino == ring.inode:
+            return ring
+        if ring is not None:
+            ring.close()
+        ring = self._rings[name] = HistoryRing(path)
+        return ring
+
+    def read_since(self, name, seq, stack=False):
+        """
+        Read all samples of the attribute newer than seq that are still kept in its
+        history. Writer must write the attribute with history enabled.
+
+        Parameters:
+        name (str): Attribute name.
+        seq (int): Sequence number of the last sample already processed. 0 reads all.
+        stack (bool, optional): Return sequence numbers and values as stacked NumPy arrays
+                                for vectorized processing. Defaults to False.
+
+        Returns:
+        list: Tuples of (sequence number, value) in increasing order, or tuple of
+              (sequence numbers, stacked values) if stack is True.
+        """
+        samples = [(s, cbor2.loads(payload, tag_hook=decode_tags))
+                   for s, payload in self._history_ring(name).read_since(seq)]
+        if stack:
+            return (np.array([s for s, _ in samples], dtype=np.uint64),
+                    np.stack([value for _, value in samples]) if samples else np.empty(0))
+        return samples
+
+    def read_last(self, name, n, stack=False):
+        """
+        Read up to n newest samples of the attribute from its history.
+
+        Parameters:
+        name (str): Attribute name.
+        n (int): Number of samples.
+        stack (bool, optional): Return stacked NumPy arrays. Defaults to False.
+
+        Returns:
+        list: Tuples of (sequence number, value) in increasing order, or tuple of
+              (sequence numbers, stacked values) if stack is True.
+        """
+        ring = self._history_ring(name)
+        return self.read_since(name, max(ring.head - n, 0), stack=stack)
 
     def get_binary(self, name):
         """
@@ -286,37 +609,82 @@ class SensorReader:
         name (str): Attribute name.
 
         Returns:
-        str: File path of the attribute.
+        str: File path of the attribute. Path of the record file for fields of packed records.
         """
-        return os.path.join(self.sensor_path, name)
+        return os.path.join(self.sensor_path, self._record_fields.get(name, name))
 
-    def start_write(self, data_dir=None):
+    def start_write(self, data_dir=None, compresslevel=3, workers=1, queue_size=256, policy="block",
+                    use_processes=False, format="zip", segment_size=64 * 2**20, codec=None,
+                    flush_interval=None):
         """
-        Start writing sensor data to hard disk. Used when creating datasets for later use
+        Start writing sensor data to hard disk. Used when creating datasets for later use.
+        Updates are captured into memory on the event thread and written by a pool of workers.
 
         Parameters:
         data_dir (str, optional): Directory to store data. Defaults to None.
+        compresslevel (int, optional): Deflate level of the snapshots. Defaults to 3.
+        workers (int, optional): Number of writer workers. Defaults to 1.
+        queue_size (int, optional): Maximum number of snapshots waiting to be written. Defaults to 256.
+        policy (str, optional): "block", "drop_newest" or "drop_oldest" when queue is full.
+                                Blocking stalls the shared event thread. Defaults to "block".
+        use_processes (bool, optional): Write and compress in worker processes. Only supported
+                                        with "zip" format. Defaults to False.
+        format (str, optional): "zip" writes a zip file per snapshot, "segments" appends snapshots
+                                to segment files read with segments.read_segments. Defaults to "zip".
+        segment_size (int, optional): Size limit of a segment file. Defaults to 64 MiB.
+        codec (str, optional): Compression codec of each value, see compression module.
+                               Defaults to None.
+        flush_interval (float, optional): Maximum time in seconds snapshots are buffered in
+                                          memory before they are written to a segment file.
+                                          Defaults to None (written when a chunk is full).
         """
+        if data_dir is None:
+            data_dir = self.data_dir
+        os.makedirs(data_dir, exist_ok=True)
         self.first = True
+        if format == "zip":
+            sink = functools.partial(write_snapshot, path=data_dir, compresslevel=compresslevel, codec=codec)
+        elif format == "segments":
+            if use_processes:
+                raise ValueError("Segment format can not be written from worker processes")
+            sink = SegmentWriter(data_dir, self.sensor_name, segment_size=segment_size,
+                                 compression="zlib" if compresslevel else None, compresslevel=compresslevel,
+                                 codec=codec, flush_interval=flush_interval)
+        else:
+            raise ValueError(f"Unknown format {format}, expected zip or segments")
+        self.pipeline = RecordingPipeline(sink, workers=workers, queue_size=queue_size,
+                                          policy=policy, use_processes=use_processes)
         self.init_watchdog(data_dir)
 
+    def recording_stats(self):
+        """
+        Get counters of the recording started with start_write.
+
+        Returns:
+        dict: Number of queued, written, dropped and failed snapshots. None if not recording.
+        """
+        if self.pipeline is None:
+            return None
+        return self.pipeline.stats()
+
     def _writer_worker(self, data_dir=None):
         """
-        Takes snapshots of data. Used for creating datasets
+        Takes snapshots of data. Used for creating datasets. When recording pipeline is
+        running data is only captured here and written by the pipeline.
 
         Parameters:
         data_dir (str, optional): Directory to store data. Defaults to None.
         """
-        if self.wait_event.is_set():
+        if self.pipeline is None:
+            self.take_snapshot(data_dir, compresslevel=3)
             return
-        ts = time.time()
-        time_step = time.time() - self.prev_ts
-        if time_step < self.wait_time:
-            self.wait_event.set()
-            time.sleep(self.wait_time - time_step)
-            self.wait_event.clear()
-        self.prev_ts = time.time()
-        self.take_snapshot(data_dir, compresslevel=3)
+        try:
+            snapshots = self.capture_snapshot()
+        except FileNotFoundError as e:
+            logging.debug(f"Could not capture snapshot: {e}")
+            return
+        for snapshot in snapshots:
+            self.pipeline.submit(snapshot)
 
     def init_watchdog(self, data_dir=None):
         """
@@ -330,6 +698,17 @@ class SensorReader:
             data_dir = self.data_dir
         os.makedirs(data_dir, exist_ok=True)
 
+        if os.path.isfile(self.sensor_path):
+            path = self.sensor_path
+        else:
+            path = os.path.join(self.sensor_path, self.to_watch)
+
+        try:
+            self.observer = get_dispatcher().register(path, lambda _: self._writer_worker(data_dir))
+            return
+        except OSError as e:
+            logging.debug(f"inotify not available, using watchdog observer: {e}")
+
         class EventHandler(FileSystemEventHandler):
             def __init__(self, parent):
                 self.parent = parent
@@ -349,7 +728,8 @@ class SensorReader:
 
     def stop_watchdog(self):
         """
-        Stop the watchdog monitoring.
+        Stop the watchdog monitoring, including values watched with attach_watchdog.
+        Snapshots already captured for recording are written before returning.
         """
         try:
             self.observer.stop()
@@ -359,6 +739,10 @@ class SensorReader:
 
         except:
             pass
+        for value_to_watch in list(self.observers):
+            self.disable_watchdog(value_to_watch)
+        if self.pipeline is not None:
+            self.pipeline.stop()
 
     def get_packed_data_location(self):
         """
@@ -385,13 +769,51 @@ class SensorReader:
     def attach_watchdog(self, value_to_watch, callback):
         """
         Attach a watchdog to monitor changes in the specified value.
+        All watched values of the process share a single inotify instance and thread,
+        so callback should not block for long.
 
         Parameters:
         value_to_watch (str): Value to watch for changes.
         callback (function): Callback function to execute when changes are detected.
+
+        Raises:
+        ValueError: If value_to_watch is a shared array channel. It is written in place
+                    without filesystem events, use wait_for_update or SharedArrayReader.
         """
+        if value_to_watch.endswith(SHARED_ARRAY_SUFFIX):
+            raise ValueError(f"Shared array channel {value_to_watch} can not be watched, "
+                             "use wait_for_update or SharedArrayReader to poll it")
         path = self.get_value_path(value_to_watch)
         dirpath, basename = os.path.split(path)
+        use_mmap = self.use_mmap
+        metrics_name = os.path.join(self.metrics_name, value_to_watch)
+        field = value_to_watch if value_to_watch in self._record_fields else None
+
+        def on_update(path):
+            if field is not None:
+                callback(read(path)[field])
+                return
+            if not metrics.enabled:
+                callback(read(path, use_mmap=use_mmap))
+                return
+            start = time.perf_counter_ns()
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            data = read(path, use_mmap=use_mmap)
+            elapsed = time.perf_counter_ns() - start
+            if st is not None:
+                metrics.record_read(metrics_name, elapsed, st.st_size, time.time_ns() - st.st_mtime_ns)
+            else:
+                metrics.record_read(metrics_name, elapsed)
+            callback(data)
+
+        try:
+            self.observers[value_to_watch] = get_dispatcher().register(path, on_update)
+            return
+        except OSError as e:
+            logging.debug(f"inotify not available, using watchdog observer: {e}")
 
         class EventHandler(FileSystemEventHandler):
             def __init__(self):
@@ -402,8 +824,7 @@ class SensorReader:
                 if event.is_directory:
                     return
                 if os.path.basename(event.src_path) == basename:
-                    data = read(event.src_path)
-                    callback(data)
+                    on_update(event.src_path)
 
         observer = Observer()
         eh = EventHandler()
@@ -412,6 +833,26 @@ class SensorReader:
         self.observers[value_to_watch] = observer
 
 
+    def watch_registry(self, callback=None):
+        """
+        Update attributes every time writers register new channels. Can be used instead of
+        polling update_attributes. Stop with disable_watchdog(".registry").
+
+        Parameters:
+        callback (function, optional): Called with the updated attribute list. Defaults to None.
+        """
+        if self.registry is None:
+            raise ValueError("Registry is disabled")
+
+        def on_update(_):
+            if self.registry.channels(self.filename) is None:
+                return
+            self.update_attributes()
+            if callback is not None:
+                callback(self.attributes)
+
+        self.observers[".registry"] = self.registry.subscribe(on_update)
+
     def disable_watchdog(self, value_to_watch):
         """
         Disable the watchdog monitoring the specified value.
@@ -426,42 +867,243 @@ class SensorReader:
         except:
             pass
 
-def read(filename, attribute=None):
+class LazyZipMapping(Mapping):
+    """
+    Read-only mapping over a zip archive. Archive is opened and indexed once and
+    members are decoded when they are first accessed. Decoded members are cached.
+    Directories inside the archive are represented as nested LazyZipMappings.
+
+    Archive is kept open until close() is called, so the mapping keeps reading the
+    same version of the file even if the writer replaces it.
+    """
+    def __init__(self, archive, _zipfile=None):
+        """
+        Open and index the archive.
+
+        Parameters:
+        archive (str): Path to the zip file.
+        """
+        self.archive = archive
+        self._zf = _zipfile
+        self._members = {}
+        self._values = {}
+        if _zipfile is not None:
+            return
+
+        self._zf = zipfile.ZipFile(archive, 'r')
+        for file in self._zf.infolist():
+            path = file.filename.split('/')
+            node = self
+            for part in path[1:-1]:
+                #populate directory recursevely
+                if part not in node._members:
+                    node._members[part] = LazyZipMapping(archive, self._zf)
+                node = node._members[part]
+            if file.is_dir():
+                continue
+            node._members[path[-1]] = file
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        member = self._members[key]
+        if isinstance(member, LazyZipMapping):
+            return member
+        with self._zf.open(member) as fd:
+            value = cbor2.CBORDecoder(fd, tag_hook=decode_tags).decode()
+        self._values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __repr__(self):
+        return f"LazyZipMapping({self.archive!r}, keys={list(self._members)})"
+
+    def to_dict(self):
+        """
+        Decode all members.
+
+        Returns:
+        dict: Nested dictionary with the same structure read() returns for zip files.
+        """
+        return {key: value.to_dict() if isinstance(value, LazyZipMapping) else value
+                for key, value in self.items()}
+
+    def close(self):
+        """
+        Close the archive. Members that are not decoded yet can not be accessed after this.
+        """
+        self._zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def get_executor(kind="thread"):
+    """
+    Get executor shared by all readers of the process for parallel decoding.
+    Threads suit arrays and compressed data whose decoding releases the GIL,
+    processes suit payloads where Python level CBOR parsing dominates.
+
+    Parameters:
+    kind (str, optional): "thread" or "process". Defaults to "thread".
+
+    Returns:
+    concurrent.futures.Executor: Shared executor.
+    """
+    if kind not in ("thread", "process"):
+        raise ValueError(f"Unknown executor kind {kind}, expected thread or process")
+    with _executors_lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            if kind == "thread":
+                executor = ThreadPoolExecutor(thread_name_prefix="tmpfs-decode")
+            else:
+                executor = ProcessPoolExecutor()
+            _executors[kind] = executor
+        return executor
+
+def _resolve(ret):
+    """
+    Replace futures in nested dictionary with their results.
+    """
+    for key, value in ret.items():
+        if isinstance(value, Future):
+            ret[key] = value.result()
+        elif type(value) is dict:
+            _resolve(value)
+    return ret
+
+def _decode_bytes(content):
+    return loads_cbor(content)
+
+def read(filename, attribute=None, use_mmap=False, lazy=False, executor=None):
     """
     Read and decode data from the specified file.
 
     Parameters:
     filename (str): File name.
     attribute (str, optional): Attribute to read. Defaults to None.
+    use_mmap (bool, optional): Memory map files containing a single typed array and return
+                               a read-only view instead of decoded copy. Defaults to False.
+    lazy (bool, optional): Return zip files as LazyZipMapping instead of decoding all
+                           members. Defaults to False.
+    executor (Executor, optional): Decode files of a directory and members of a zip file
+                                   in parallel. Result is same as without executor. Defaults to None.
 
     Returns:
     Any: Data read from the file.
     """
     filename = os.path.join(filename, attribute) if attribute is not None else filename
     if os.path.isdir(filename):
+        if os.path.islink(filename):
+            return _read_generation(filename, use_mmap, lazy, executor)
         ret = {}
         for attribute in os.listdir(filename):
-            ret[attribute] = read(filename, attribute=attribute)
-        return ret
+            if attribute.startswith("."):
+                #hidden files are used internally by the framework
+                continue
+            if executor is None:
+                ret[attribute] = read(filename, attribute=attribute, use_mmap=use_mmap, lazy=lazy)
+            elif os.path.isdir(os.path.join(filename, attribute)):
+                #directories are listed here so that workers never wait for each other
+                ret[attribute] = read(filename, attribute=attribute, use_mmap=use_mmap, lazy=lazy,
+                                      executor=executor)
+            else:
+                ret[attribute] = executor.submit(read, os.path.join(filename, attribute),
+                                                 use_mmap=use_mmap, lazy=lazy)
+        return ret if executor is None else _resolve(ret)
 
     if filename.endswith('.zip'):
-        with zipfile.ZipFile(filename, 'r') as zf:
-            archive_content = zf.infolist()
-            ret = {}
-            for file in archive_content:
-                path = file.filename.split('/')
-                r = ret
-                for part in path[1:-1]:
-                    #populate directory recursevely
-                    r[part] = r.get(part, {})
-                    r = r[part]
-                if file.is_dir():
-                  continue
-                decoder = cbor2.CBORDecoder(zf.open(file), tag_hook=decode_tags)
-                r[path[-1]] = decoder.decode()
-
-            return ret
+        if lazy:
+            return LazyZipMapping(filename)
+        return _read_zip(filename, executor)
+
+    if filename.endswith(SHARED_ARRAY_SUFFIX):
+        return read_shared_array(filename)
+
+    if use_mmap:
+        array = mmap_array(filename)
+        if array is not None:
+            return array
 
     with open(filename, 'rb') as fd:
-        decoder = cbor2.CBORDecoder(fd, tag_hook=decode_tags)
-        return decoder.decode()
+        return load_cbor(fd)
+
+def _read_generation(link, use_mmap=False, lazy=False, executor=None, retries=100):
+    """
+    Read directory published by SensorWriter.transaction. All files are read from the
+    generation the link points to. If writer removes the generation during the read,
+    read is retried from the new generation. Directory listed just before the writer
+    removed it may appear empty, so the generation is checked again after the read.
+    """
+    for _ in range(retries):
+        target = os.path.realpath(link)
+        try:
+            value = read(target, use_mmap=use_mmap, lazy=lazy, executor=executor)
+        except FileNotFoundError:
+            continue
+        if os.path.isdir(target):
+            return value
+    raise SnapshotConsistencyError(f"Could not read consistent generation of {link}")
+
+def _read_open_file(fd, filename, use_mmap=False):
+    """
+    Decode data from already opened file.
+
+    Parameters:
+    fd (file): File opened in binary mode.
+    filename (str): Name of the file, used to detect zip files.
+    use_mmap (bool, optional): Memory map files containing a single typed array.
+
+    Returns:
+    Any: Data read from the file.
+    """
+    if filename.endswith('.zip'):
+        return _read_zip(fd)
+    if use_mmap:
+        array = mmap_array(fd)
+        if array is not None:
+            return array
+    return load_cbor(fd)
+
+def _read_zip(file, executor=None):
+    """
+    Decode all members of zip file into nested dictionary.
+
+    Parameters:
+    file (str or file): Path to zip file or file opened in binary mode.
+    executor (Executor, optional): Decode members in parallel. Members are still read
+                                   from the zip one by one. Defaults to None.
+
+    Returns:
+    dict: Decoded members.
+    """
+    with zipfile.ZipFile(file, 'r') as zf:
+        archive_content = zf.infolist()
+        ret = {}
+        for file in archive_content:
+            path = file.filename.split('/')
+            r = ret
+            for part in path[1:-1]:
+                #populate directory recursevely
+                r[part] = r.get(part, {})
+                r = r[part]
+            if file.is_dir():
+              continue
+            if executor is not None:
+                r[path[-1]] = executor.submit(_decode_bytes, zf.read(file))
+                continue
+            decoder = cbor2.CBORDecoder(zf.open(file), tag_hook=decode_tags)
+            r[path[-1]] = decoder.decode()
+
+        return ret if executor is None else _resolve(ret)
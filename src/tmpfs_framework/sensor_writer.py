@@ -6,18 +6,33 @@ Created on Tue Apr 13 11:30:43 2021
 @author: aspor
 """
 import os
+import re
+import time
+import errno
 import zipfile
 import shutil
+import threading
+from collections import deque
+from contextlib import contextmanager
 
 from typing import Any
 from threading import Event
 from pathlib import Path
 
-from .cbor_utils import write_cbor, get_temp_file
+import cbor2
+
+from .cbor_utils import write_cbor, get_temp_file, dump_cbor, _numpy_encoder, COMMIT_FILE
+from .ring_buffer import HistoryRing, history_path, slot_size_for
+from .metrics import metrics
+from .compression import compress as compress_value
+from .registry import Registry, channel_entry, encoded_entry, split_channel
+from .records import pack_record, SUFFIX as RECORD_SUFFIX
 import tmpfs_framework
 
 import logging
 
+GENERATIONS_DIR = ".gen"
+
 class SensorWriter():
     """
     A class to handle writing sensor data to files and compressing them.
@@ -28,13 +43,15 @@ class SensorWriter():
     sensor_name (str): Identifier of sensor.
     stop_event (Event): Event to control stopping of write loop.
     """
-    def __init__(self, dir_path: str, sensor_name: str, tmpfs_path=None) -> None:
+    def __init__(self, dir_path: str, sensor_name: str, tmpfs_path=None, codecs: dict = None) -> None:
         """
         Initializes SensorWriter with directory path and filename.
 
         Args:
         dir_path (str): Directory path for storing data.
         sensor_name (str): Name of the file or directory.
+        codecs (dict, optional): Compression codec of each channel, e.g. {"depth": "delta+shuffle+zlib"}.
+                                 See compression module for available codecs.
         """
         self.tmpfs_path = tmpfs_path if tmpfs_path is not None else tmpfs_framework.TMPFS_PATH
         d = os.path.join(self.tmpfs_path,dir_path)
@@ -43,7 +60,22 @@ class SensorWriter():
         Path(self.data_path).mkdir(parents=True,exist_ok=True)
 
         self.sensor_name=sensor_name
+        self.codecs = dict(codecs) if codecs is not None else {}
+        self.metrics_name = os.path.relpath(self.data_path, self.tmpfs_path)
         self.stop_event=Event()
+        self.generation = 0
+        self._pending = set()
+        self._committed = {}
+        self._channels = {}
+        self._rings = {}
+        self.registry = Registry(d)
+        self._registered = {}    # name -> (kind, dtype, shape) recorded in registry
+        self._unregistered = {}  # name -> entry waiting to be recorded
+        self._staging = None     # top level name -> staged generation during transaction
+        self._transactions = 0
+        self._staged_dirs = set()
+        self._staged_names = set()
+        self._published = {}     # top level name -> published generation directories
 
 
     def start(self) -> None:
@@ -68,7 +100,8 @@ class SensorWriter():
         self.stop_event.clear()
         pass
 
-    def write(self,name: str, data: Any, attributes: dict = None) ->None:
+    def write(self,name: str, data: Any, attributes: dict = None, history: int = None, codec = None,
+              packed: bool = False) ->None:
         """
         Writes data to a file. Supports nested dictionaries.
 
@@ -76,28 +109,347 @@ class SensorWriter():
         name (str): Name of the file or directory.
         data (any): Data to be written.
         attributes (dict, optional): Attributes to be written.
+        history (int, optional): Keep this many latest samples in a history ring that
+                                 readers can access with SensorReader.read_since.
+        codec (str, optional): Compression codec. Defaults to codec of the channel given in
+                               constructor. Applies to all values of a dictionary.
+        packed (bool, optional): Write dictionary of scalars as a single packed record file
+                                 name + ".rec" instead of a directory with a file per value.
+                                 See records module.
+        """
+        if history:
+            self._append_history(name, data, history)
+        codec = codec or self.codecs.get(os.path.normpath(name))
+        if packed and type(data) is dict:
+            self._write_tree(name + RECORD_SUFFIX, pack_record(data), codec)
+        else:
+            self._write_tree(name, data, codec)
+        if self._unregistered:
+            self._flush_registry()
+
+        if attributes is not None:
+            self.write(name+"_attr", attributes)
+
+    def write_encoded(self, name: str, content: bytes, entry: tuple = None) -> None:
+        """
+        Publishes a file whose content is already encoded, e.g. CBOR value or zip file
+        copied from a recording, without decoding and encoding it again.
+
+        Args:
+        name (str): Name of the file.
+        content (bytes): Content of the file.
+        entry (tuple, optional): Kind, dtype and shape for the registry like
+                                 registry.channel_entry returns. Defaults to describing
+                                 content as CBOR with registry.encoded_entry.
         """
+        name = os.path.normpath(name)
+        start = time.perf_counter_ns()
+        if self._staging is None:
+            path = os.path.join(self.data_path, name)
+            dirpath, basename = os.path.split(path)
+            os.makedirs(dirpath, exist_ok=True)
+            #hidden temp file next to the published one, not listed by readers
+            tmpf = os.path.join(dirpath, f".{basename}.{os.getpid()}.{threading.get_ident()}")
+            with open(tmpf, 'wb') as fd:
+                fd.write(content)
+            os.rename(tmpf, path)
+        else:
+            self._write_staged(name, content, encoded=True)
+        if metrics.enabled:
+            metrics.record_write(os.path.join(self.metrics_name, name), len(content),
+                                 time.perf_counter_ns() - start)
+        self._pending.add(name)
+        self._register(name, entry if entry is not None else encoded_entry(content))
+        if self._unregistered:
+            self._flush_registry()
 
+    def _write_tree(self, name: str, data: Any, codec = None) -> None:
+        """
+        Writes data to a file, or dictionary recursively into a directory.
+        """
         if type (data) is dict:
             for d in data:
-                self.write(name = os.path.join(name,str(d)), data = data[d])
+                self._write_tree(os.path.join(name,str(d)), data[d], codec)
         else:
-            write_cbor(filename = os.path.join(self.data_path, name), data = data)
+            start = time.perf_counter_ns()
+            if codec:
+                data = compress_value(data, codec)
+            if self._staging is None:
+                nbytes = write_cbor(filename = os.path.join(self.data_path, name), data = data)
+            else:
+                nbytes = self._write_staged(name, data)
+            if metrics.enabled:
+                metrics.record_write(os.path.join(self.metrics_name, name), nbytes,
+                                     time.perf_counter_ns() - start)
+            name = os.path.normpath(name)
+            self._pending.add(name)
+            self._register(name, channel_entry(data))
 
-        if attributes is not None:
-            self.write(name+"_attr", attributes)
+    @contextmanager
+    def transaction(self):
+        """
+        Publishes everything written with write inside the with block at once.
+        Files are staged into a new generation directory without temp files and renames,
+        and on exit each written top level name is published with a single atomic rename.
+        Directories are published as a symlink to the generation directory, so readers
+        always see the complete tree of one transaction. Previous generation is kept
+        for readers still reading it, older ones are removed.
+
+        Tree of a name contains exactly the files written in the transaction. Channels,
+        history and write_zip publish immediately. Nothing is published if the block
+        raises an exception. Readers get one notification per name, so watch the
+        top level name instead of files inside it.
+
+        Example:
+            with writer.transaction():
+                writer.write("pose", {"x": x, "y": y, "yaw": yaw})
+                writer.write("twist", {"v": v, "w": w})
+        """
+        if self._staging is not None:
+            raise RuntimeError("Transactions can not be nested")
+        self._staging = {}
+        self._staged_dirs = set()
+        self._staged_names = set()
+        self._transactions += 1
+        try:
+            yield self
+        except BaseException:
+            staging, self._staging = self._staging, None
+            for stage in staging.values():
+                _remove(stage)
+            raise
+        staging, self._staging = self._staging, None
+        for top, stage in staging.items():
+            self._swap(top, stage)
+            #channels of the previous tree that were not written again are gone
+            self._unregister([name for name in self._registered if name not in self._staged_names
+                              and (name == top or name.startswith(top + "/"))])
+        if self._unregistered:
+            self._flush_registry()
+
+    def _write_staged(self, name: str, data: Any, encoded: bool = False) -> int:
+        """
+        Writes data, or already encoded content if encoded is True, into the generation
+        directory of the running transaction. Staged files are not visible to readers,
+        so they are written in place.
+        """
+        self._staged_names.add(os.path.normpath(name))
+        top, _, rest = os.path.normpath(name).partition("/")
+        stage = self._staging.get(top)
+        if stage is None:
+            stage = self._staging[top] = os.path.join(self.data_path, GENERATIONS_DIR,
+                                                      f"{top}.{os.getpid()}.{self._transactions}")
+        path = os.path.join(stage, rest) if rest else stage
+        parent = os.path.dirname(path)
+        if parent not in self._staged_dirs:
+            os.makedirs(parent, exist_ok=True)
+            self._staged_dirs.add(parent)
+        with open(path, 'wb') as fd:
+            if encoded:
+                fd.write(data)
+            else:
+                dump_cbor(data, fd)
+            return fd.tell()
 
-    def write_zip(self, name:str, data: Any, compress: bool = False, keep: bool = False) -> None:
+    def _swap(self, top: str, stage: str) -> None:
         """
-        Writes data and compresses it into a zip file.
+        Publishes staged generation of a top level name and removes old generations.
+        """
+        target = os.path.join(self.data_path, top)
+        published = self._published.get(top)
+        if published is None:
+            published = self._published[top] = deque()
+            self._remove_stale(top, target, stage)
+        src = stage
+        if os.path.isdir(stage):
+            src = f"{stage}.lnk"
+            os.symlink(os.path.relpath(stage, self.data_path), src)
+        try:
+            os.rename(src, target)
+        except IsADirectoryError:
+            #name was written as plain directory before, move it out of the way once
+            os.rename(target, f"{stage}.old")
+            os.rename(src, target)
+            _remove(f"{stage}.old")
+        if src != stage:
+            published.append(stage)
+        while len(published) > 2:
+            #renamed first so that readers of it fail and retry instead of reading part of it
+            old = published.popleft()
+            try:
+                os.rename(old, f"{old}.dead")
+            except FileNotFoundError:
+                continue
+            _remove(f"{old}.dead")
+
+    def _remove_stale(self, top: str, target: str, stage: str) -> None:
+        """
+        Removes generations left by earlier writer processes, except the published one
+        and the one about to be published.
+        """
+        gen_dir = os.path.join(self.data_path, GENERATIONS_DIR)
+        try:
+            current = os.path.basename(os.readlink(target))
+        except OSError:
+            current = None
+        try:
+            pattern = re.compile(re.escape(top) + r"\.\d+\.\d+(\.lnk|\.old|\.dead)?")
+            stale = [f for f in os.listdir(gen_dir) if pattern.fullmatch(f)
+                     and f not in (current, os.path.basename(stage))]
+        except FileNotFoundError:
+            return
+        for f in stale:
+            _remove(os.path.join(gen_dir, f))
+
+    def _register(self, name: str, entry: tuple) -> None:
+        """
+        Queues channel for the registry if it is new or its kind has changed.
+        Channels whose dtype or shape keeps changing are recorded with None in their
+        place, so e.g. value alternating between int and float updates the registry once.
+
+        Args:
+        name (str): Normalized name of the file.
+        entry (tuple): Kind, dtype and shape from registry.channel_entry.
+        """
+        prev = self._registered.get(name)
+        if prev == entry:
+            return
+        if prev is not None and prev[0] == entry[0]:
+            entry = (entry[0],) + tuple(p if p == e else None for p, e in zip(prev[1:], entry[1:]))
+            if entry == prev:
+                return
+        self._registered[name] = entry
+        self._unregistered[name] = entry
+
+    def _unregister(self, names: list) -> None:
+        """
+        Queues removed channels for removal from the registry.
+
+        Args:
+        names (list): Normalized names of the removed files.
+        """
+        for name in names:
+            if self._registered.pop(name, None) is not None:
+                self._unregistered[name] = None
+
+    def _flush_registry(self) -> None:
+        """
+        Records queued channels in the registry of the directory. Failures are logged
+        and the channels are retried on next flush, publishing data never fails because
+        of the registry.
+        """
+        pending, self._unregistered = self._unregistered, {}
+        sensors = {}
+        for name, entry in pending.items():
+            sensor, channel = split_channel(self.sensor_name, name)
+            if entry is None:
+                sensors.setdefault(sensor, {})[channel] = None
+                continue
+            kind, dtype, shape = entry
+            sensors.setdefault(sensor, {})[channel] = {
+                "kind": kind, "dtype": dtype, "shape": list(shape) if shape is not None else None,
+                "generation": self.generation}
+        try:
+            self.registry.update(sensors, tmpfs_path=self.tmpfs_path)
+        except OSError as e:
+            logging.debug(f"Could not update registry {self.registry.path}: {e}")
+            pending.update(self._unregistered)
+            self._unregistered = pending
+
+    def _append_history(self, name: str, data: Any, nslots: int) -> int:
+        """
+        Appends data to the history ring of the named file. Ring is created on first use
+        and recreated with larger slots if data does not fit. Sequence numbering continues
+        over recreation but older samples are lost.
+
+        Args:
+        name (str): Name of the file or directory.
+        data (any): Data to be written.
+        nslots (int): Number of samples kept.
+
+        Returns:
+        int: Sequence number of the sample.
+        """
+        payload = cbor2.dumps(data, default=_numpy_encoder)
+        ring = self._rings.get(name)
+        if ring is None:
+            path = history_path(os.path.join(self.data_path, name))
+            try:
+                #continue ring left by previous writer process
+                ring = self._rings[name] = HistoryRing(path, writable=True)
+            except (OSError, ValueError):
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if ring is None or ring.nslots != nslots or len(payload) > ring.slot_size:
+            start_seq = 0
+            if ring is not None:
+                start_seq = ring.head
+                ring.close()
+                logging.debug(f"Recreating history ring of {name}")
+            path = history_path(os.path.join(self.data_path, name))
+            ring = self._rings[name] = HistoryRing.create(path, nslots, slot_size_for(len(payload)),
+                                                          start_seq)
+        return ring.append(payload)
+
+    def channel(self, name: str, use_tmpfile: bool = True, codec = None) -> "Channel":
+        """
+        Returns a handle for fast repeated writes of a single value. Handle caches
+        directory creation and resolved paths. Handles are created once per name.
+
+        Args:
+        name (str): Name of the file.
+        use_tmpfile (bool): Publish via anonymous O_TMPFILE files when supported.
+                            Named temp files avoid the extra linkat and are slightly faster,
+                            but may be left behind if the writer is killed mid-write.
+        codec (str, optional): Compression codec. Defaults to codec of the channel given in
+                               constructor.
+
+        Returns:
+        Channel: Handle whose write method publishes new values.
+        """
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = Channel(self, name, use_tmpfile, codec)
+        return channel
+
+    def commit(self, names=None) -> int:
+        """
+        Marks the latest written files as one consistent generation. Readers can use
+        SensorReader.read_snapshot to read committed files without torn reads.
+        Files are still published one by one, commit only writes a small marker file
+        recording the inode and modification time of each committed file.
+
+        Args:
+        names (list, optional): Files to commit. Defaults to files written since previous commit.
+
+        Returns:
+        int: Generation number of the commit.
+        """
+        names = self._pending if names is None else [os.path.normpath(n) for n in names]
+        for name in names:
+            st = os.stat(os.path.join(self.data_path, name))
+            self._committed[name] = [st.st_ino, st.st_mtime_ns]
+        self._pending = set()
+        self.generation += 1
+        write_cbor(filename = os.path.join(self.data_path, COMMIT_FILE),
+                   data = {"generation": self.generation, "files": self._committed})
+        return self.generation
+
+    def write_zip(self, name:str, data: Any, compress: bool = False, keep: bool = False, codec = None) -> None:
+        """
+        Writes data into a zip file. Members are encoded directly into the zip,
+        nested dictionaries become directories inside the zip.
 
         Args:
         name (str): Name of the directory.
         data (any): Data to be written.
         compress (bool): Whether to compress the zip file.
-        keep (bool): Whether to keep the original files.
+        keep (bool): Whether to also write the data as separate files.
+        codec (str, optional): Compression codec of the members. Defaults to codec of the
+                               channel given in constructor. Compresses arrays better than compress.
         """
-        self.write(name, data)
+        codec = codec or self.codecs.get(os.path.normpath(name))
+        if keep:
+            self.write(name, data, codec=codec)
         final_path=os.path.join(self.data_path, name)
 
         compression=zipfile.ZIP_DEFLATED
@@ -105,20 +457,148 @@ class SensorWriter():
             compression=zipfile.ZIP_STORED
         tmpF=get_temp_file()
         with zipfile.ZipFile(f'{tmpF}.zip' ,'w' ,compression=compression ,compresslevel=3) as zf:
-                    for root, _, files in os.walk(final_path):
-                        for file in files:
-                            fn=Path(root, file)
-                            afn=fn.relative_to(self.data_path)
-                            zf.write(filename=fn, arcname=afn)
-                        # shutil.copy2(f'{self.data_path}/{f}',f'{p}/{f}')
+            _write_members(zf, name, data, codec)
         if not keep:
+            #remove files left by earlier write with keep
             shutil.rmtree(final_path, ignore_errors=True)
+            prefix = os.path.normpath(name) + "/"
+            self._unregister([n for n in self._registered if n.startswith(prefix)])
         os.rename(f'{tmpF}.zip',f'{final_path}.zip')
+        self._pending.add(os.path.normpath(name) + ".zip")
+        self._register(os.path.normpath(name) + ".zip", ("zip", None, None))
+        if self._unregistered:
+            self._flush_registry()
+
 
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_members(zf: zipfile.ZipFile, arcname: str, data: Any, codec = None) -> None:
+    """
+    Encodes data into zip entries without intermediate files. Dictionaries are
+    written recursively like SensorWriter.write writes them into directories.
+
+    Args:
+    zf (zipfile.ZipFile): Zip file opened for writing.
+    arcname (str): Name of the entry.
+    data (any): Data to be written.
+    codec (str, optional): Compression codec of the values.
+    """
+    if type(data) is dict:
+        for d in data:
+            _write_members(zf, f"{arcname}/{d}", data[d], codec)
+    else:
+        if codec:
+            data = compress_value(data, codec)
+        with zf.open(os.path.normpath(arcname), 'w') as fp:
+            dump_cbor(data, fp)
+
+
+class Channel():
+    """
+    Publishing handle for a single file of a SensorWriter. Created with SensorWriter.channel.
+
+    New value is written to an anonymous O_TMPFILE file that is linked into the
+    channel's temp directory and renamed over the published file. If O_TMPFILE is
+    not supported a named file in the temp directory is used instead. The temp
+    directory is next to the published file, so writers of different channels do
+    not contend on the same directory entries.
+
+    Attributes:
+    path (str): Path of the published file.
+    """
+    TMP_DIR = ".tmp"
+
+    def __init__(self, writer: SensorWriter, name: str, use_tmpfile: bool = True, codec = None) -> None:
+        """
+        Resolves paths and creates the directories of the channel.
+
+        Args:
+        writer (SensorWriter): Writer owning the channel.
+        name (str): Name of the file relative to writer's data path.
+        use_tmpfile (bool): Publish via O_TMPFILE when supported.
+        codec (str, optional): Compression codec. Defaults to codec of the channel in writer.
+        """
+        self.writer = writer
+        self.name = os.path.normpath(name)
+        self.path = os.path.join(writer.data_path, name)
+        self.metrics_name = os.path.join(writer.metrics_name, self.name)
+        self.codec = codec or writer.codecs.get(self.name)
+        dirpath, basename = os.path.split(self.path)
+        self.dirpath = dirpath
+        self.tmpdir = os.path.join(dirpath, self.TMP_DIR)
+        os.makedirs(self.tmpdir, exist_ok=True)
+        self._tmp_prefix = f"{basename}.{os.getpid()}."
+        self._use_tmpfile = use_tmpfile and hasattr(os, "O_TMPFILE")
+        self._tmpdir_fd = os.open(self.tmpdir, os.O_RDONLY | os.O_DIRECTORY)
+
+    def __del__(self):
+        if getattr(self, "_tmpdir_fd", None) is not None:
+            os.close(self._tmpdir_fd)
+            self._tmpdir_fd = None
+
+    def write(self, data: Any) -> None:
+        """
+        Atomically publishes new value.
+
+        Args:
+        data (any): Data to be written.
+        """
+        start = time.perf_counter_ns()
+        if self.codec:
+            data = compress_value(data, self.codec)
+        nbytes = self._publish(data)
+        self.writer._pending.add(self.name)
+        self.writer._register(self.name, channel_entry(data))
+        if self.writer._unregistered:
+            self.writer._flush_registry()
+        if metrics.enabled:
+            metrics.record_write(self.metrics_name, nbytes, time.perf_counter_ns() - start)
+
+    def _publish(self, data: Any) -> int:
+        tmpf = f"{self._tmp_prefix}{threading.get_ident()}"
+        if self._use_tmpfile:
+            try:
+                return self._write_tmpfile(tmpf, data)
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL, errno.ENOENT, errno.EXDEV):
+                    raise
+                logging.debug(f"O_TMPFILE publish not available, using temp files: {e}")
+                self._use_tmpfile = False
+        with open(os.open(tmpf, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=self._tmpdir_fd), 'wb') as fd:
+            dump_cbor(data, fd)
+            nbytes = fd.tell()
+        os.rename(tmpf, self.path, src_dir_fd=self._tmpdir_fd)
+        return nbytes
+
+    def _write_tmpfile(self, tmpf: str, data: Any) -> int:
+        fd = os.open(self.dirpath, os.O_TMPFILE | os.O_WRONLY, 0o644)
+        try:
+            with open(fd, 'wb', closefd=False) as fp:
+                dump_cbor(data, fp)
+                nbytes = fp.tell()
+            #linkat with AT_SYMLINK_FOLLOW gives the anonymous file a name
+            try:
+                os.link(f"/proc/self/fd/{fd}", tmpf, dst_dir_fd=self._tmpdir_fd)
+            except FileExistsError:
+                #left behind by an interrupted write
+                os.unlink(tmpf, dir_fd=self._tmpdir_fd)
+                os.link(f"/proc/self/fd/{fd}", tmpf, dst_dir_fd=self._tmpdir_fd)
+        finally:
+            os.close(fd)
+        os.rename(tmpf, self.path, src_dir_fd=self._tmpdir_fd)
+        return nbytes
 
 
 def pack_to_zip(files: list[str], base_dir:str = ".", zipname:str = "measurement",
-                compress:bool = False) -> None:
+                compress:bool = False, data: dict = None) -> None:
         """
         Packs a list of files into a zip archive.
 
@@ -127,9 +607,15 @@ def pack_to_zip(files: list[str], base_dir:str = ".", zipname:str = "measurement
         base_dir (str): Base directory for relative paths.
         zipname (str): Name of the output zip file.
         compress (bool): Whether to compress the zip file.
+        data (dict, optional): Values to encode directly into the zip, keyed by their
+                               name in the zip. Saves writing them as files first.
+
+        Entries are stored under top level directory named after the zip like in
+        SensorWriter.write_zip, so read returns them as nested dictionary.
         """
         root = base_dir#os.path.dirname(zipname)
         path = zipname
+        prefix = os.path.basename(zipname)
 
         compression=zipfile.ZIP_DEFLATED
         if(not compress):
@@ -139,8 +625,10 @@ def pack_to_zip(files: list[str], base_dir:str = ".", zipname:str = "measurement
         with zipfile.ZipFile(f'{tmpF}.zip','w',compression=compression,compresslevel=3) as z:
             for file in files:
                             fn=Path(root, file)
-                            afn=file
+                            afn=f"{prefix}/{file}"
                             z.write(filename=fn,arcname=afn)
+            for name, value in (data or {}).items():
+                _write_members(z, f"{prefix}/{name}", value)
         path = os.path.join(root,path)
 
         os.rename(f'{tmpF}.zip',f'{path}.zip')
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared memory channel for fixed-shape arrays, e.g. camera frames.
+
+The channel is a single preallocated file in tmpfs holding a header and two or more
+slots for the array. Writer copies each new array into the slot after the newest one,
+so publishing does no allocation and no filesystem metadata operations. Readers get
+NumPy views straight over the mapping.
+
+Every slot has a sequence lock: writer sets the slot's sequence number to an odd value
+while it copies and to an even value when the copy is complete. Reader compares the
+sequence number before and after using the data to know it was not overwritten.
+
+File layout:
+    header: magic, version, number of slots, dtype, ndim, shape, slot size, newest sequence
+    slot sequence numbers
+    slots, aligned to page size
+"""
+import os
+import mmap
+import struct
+import logging
+
+import numpy as np
+
+from .registry import Registry, split_channel
+import tmpfs_framework
+
+_MAGIC = b"TMPFSSHM"
+_VERSION = 1
+_MAX_DIMS = 8
+_header = struct.Struct(f"<8sII16sI{_MAX_DIMS}QQ")
+_u64 = struct.Struct("<Q")
+_SEQ_OFFSET = 128
+_SLOT_SEQ_OFFSET = 192
+_ALIGN = mmap.PAGESIZE
+
+SUFFIX = ".shm"
+
+
+def _layout(nslots, nbytes):
+    data_offset = -(-(_SLOT_SEQ_OFFSET + 8 * nslots) // _ALIGN) * _ALIGN
+    slot_size = -(-nbytes // _ALIGN) * _ALIGN
+    return data_offset, slot_size
+
+
+class _SharedArray:
+    """
+    Common parts of SharedArrayWriter and SharedArrayReader.
+    """
+    def _open(self, path, writable):
+        with open(path, 'r+b' if writable else 'rb') as fd:
+            self.inode = os.fstat(fd.fileno()).st_ino
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=access)
+        magic, version, nslots, dtype, ndim, *rest = _header.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a shared array file")
+        self.nslots = nslots
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self.shape = tuple(rest[:ndim])
+        data_offset, slot_size = _layout(nslots, rest[_MAX_DIMS])
+        self._views = [np.ndarray(self.shape, self.dtype, buffer=self._mmap,
+                                  offset=data_offset + i * slot_size) for i in range(nslots)]
+
+    @property
+    def seq(self) -> int:
+        """
+        Sequence number of the newest complete array, 0 if nothing has been written.
+        """
+        return _u64.unpack_from(self._mmap, _SEQ_OFFSET)[0]
+
+    def _slot_seq(self, slot):
+        return _u64.unpack_from(self._mmap, _SLOT_SEQ_OFFSET + 8 * slot)[0]
+
+    def close(self) -> None:
+        self._views = []
+        try:
+            self._mmap.close()
+        except BufferError:
+            #views given to the user keep the mapping alive until they are released
+            pass
+
+
+class SharedArrayWriter(_SharedArray):
+    """
+    Publishes fixed-shape arrays through a preallocated shared memory file.
+
+    Attributes:
+    path (str): Path of the shared memory file.
+    shape (tuple): Shape of the array.
+    dtype (numpy.dtype): Data type of the array.
+    nslots (int): Number of slots.
+    """
+    def __init__(self, dir_path: str, sensor_name: str, name: str, shape, dtype, slots: int = 3,
+                 tmpfs_path=None) -> None:
+        """
+        Creates the shared memory file, or reuses existing one with same geometry so
+        that readers of a restarted writer keep working.
+
+        Args:
+        dir_path (str): Directory path for storing data.
+        sensor_name (str): Name of the sensor directory.
+        name (str): Name of the channel. File is named name + ".shm".
+        shape (tuple): Shape of the array.
+        dtype (numpy.dtype): Data type of the array.
+        slots (int): Number of slots. Readers using zero-copy views have slots - 1
+                     write periods of time before their view is overwritten.
+        """
+        tmpfs_path = tmpfs_path if tmpfs_path is not None else tmpfs_framework.TMPFS_PATH
+        sensor_path = os.path.join(tmpfs_path, dir_path, sensor_name)
+        os.makedirs(sensor_path, exist_ok=True)
+        self.path = os.path.join(sensor_path, name + SUFFIX)
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        if slots < 2:
+            raise ValueError("At least two slots are needed")
+        if len(shape) > _MAX_DIMS:
+            raise ValueError(f"At most {_MAX_DIMS} dimensions are supported")
+
+        self._register(tmpfs_path, dir_path, sensor_name, name + SUFFIX, shape, dtype)
+        try:
+            self._open(self.path, writable=True)
+            if (self.shape, self.dtype, self.nslots) == (shape, dtype, slots):
+                return
+            self.close()
+        except (OSError, ValueError):
+            pass
+        self._create(shape, dtype, slots)
+        self._open(self.path, writable=True)
+
+    @staticmethod
+    def _register(tmpfs_path, dir_path, sensor_name, filename, shape, dtype):
+        sensor, channel = split_channel(sensor_name, filename)
+        registry = Registry(os.path.join(tmpfs_path, dir_path))
+        try:
+            registry.update({sensor: {channel: {"kind": "shared_array", "dtype": dtype.str,
+                                                "shape": list(shape), "generation": 0}}},
+                            tmpfs_path=tmpfs_path)
+        except OSError as e:
+            logging.debug(f"Could not update registry {registry.path}: {e}")
+
+    def _create(self, shape, dtype, slots):
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        data_offset, slot_size = _layout(slots, nbytes)
+        tmpf = f"{os.path.dirname(self.path)}/.{os.path.basename(self.path)}.{os.getpid()}.tmp"
+        with open(tmpf, 'wb') as fd:
+            fd.truncate(data_offset + slots * slot_size)
+            fd.write(_header.pack(_MAGIC, _VERSION, slots, dtype.str.encode(), len(shape),
+                                  *shape, *[0] * (_MAX_DIMS - len(shape)), nbytes))
+        os.rename(tmpf, self.path)
+
+    def write(self, array) -> int:
+        """
+        Copies array into the next slot and publishes it.
+
+        Args:
+        array (numpy.ndarray): Array with the channel's shape. Converted to channel's dtype.
+
+        Returns:
+        int: Sequence number of the published array.
+        """
+        seq = self.seq + 1
+        slot = seq % self.nslots
+        offset = _SLOT_SEQ_OFFSET + 8 * slot
+        _u64.pack_into(self._mmap, offset, 2 * seq - 1)
+        np.copyto(self._views[slot], array, casting='unsafe')
+        _u64.pack_into(self._mmap, offset, 2 * seq)
+        _u64.pack_into(self._mmap, _SEQ_OFFSET, seq)
+        return seq
+
+
+class SharedArrayReader(_SharedArray):
+    """
+    Reads arrays published by SharedArrayWriter.
+
+    Example:
+        array, seq = reader.read(copy=False)
+        ...process array...
+        if not reader.is_valid(seq):
+            ...array was overwritten while it was used...
+    """
+    def __init__(self, path: str) -> None:
+        """
+        Maps the shared memory file.
+
+        Args:
+        path (str): Path of the shared memory file.
+        """
+        self.path = path
+        self._open(path, writable=False)
+
+    def _reopen_if_replaced(self):
+        try:
+            if os.stat(self.path).st_ino != self.inode:
+                self.close()
+                self._open(self.path, writable=False)
+        except FileNotFoundError:
+            pass
+
+    def newest_seq(self) -> int:
+        """
+        Sequence number of the newest complete array. Follows the file if a restarted
+        writer has replaced it.
+
+        Returns:
+        int: Sequence number, 0 if nothing has been written.
+        """
+        self._reopen_if_replaced()
+        return self.seq
+
+    def is_valid(self, seq: int) -> bool:
+        """
+        Check that the array with the given sequence number has not been overwritten.
+
+        Args:
+        seq (int): Sequence number returned by read.
+
+        Returns:
+        bool: True if data of seq is still intact.
+        """
+        return self._slot_seq(seq % self.nslots) == 2 * seq
+
+    def read(self, copy: bool = True, retries: int = 100):
+        """
+        Read the newest array.
+
+        Args:
+        copy (bool): Return a copy instead of a read-only view over shared memory.
+                     Views must be validated with is_valid after use.
+        retries (int): Attempts before giving up if writer keeps overwriting the slot.
+
+        Returns:
+        tuple: Array and its sequence number, or (None, 0) if nothing has been written.
+
+        Raises:
+        RuntimeError: If no intact array could be read within retries.
+        """
+        self._reopen_if_replaced()
+        for _ in range(retries):
+            seq = self.seq
+            if seq == 0:
+                return None, 0
+            slot = seq % self.nslots
+            if self._slot_seq(slot) != 2 * seq:
+                continue
+            view = self._views[slot]
+            if not copy:
+                return view, seq
+            array = view.copy()
+            if self.is_valid(seq):
+                return array, seq
+        raise RuntimeError(f"Could not read intact array from {self.path}")
+
+
+def read_shared_array(path: str):
+    """
+    Read a copy of the newest array of a shared memory file.
+
+    Args:
+    path (str): Path of the shared memory file.
+
+    Returns:
+    numpy.ndarray: Copy of the newest array, or None if nothing has been written.
+    """
+    reader = SharedArrayReader(path)
+    try:
+        return reader.read(copy=True)[0]
+    finally:
+        reader.close()
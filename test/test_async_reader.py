@@ -0,0 +1,114 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import cbor2
+
+from tmpfs_framework import AsyncSensorReader
+
+
+class TestAsyncSensorReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sensor_path = os.path.join(self.tmpdir.name, "testdir", "testfile")
+        os.makedirs(self.sensor_path)
+        self._publish("count", 0)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _publish(self, name, value):
+        tmp = os.path.join(self.tmpdir.name, "tmp")
+        with open(tmp, 'wb') as fd:
+            cbor2.dump(value, fd)
+        os.rename(tmp, os.path.join(self.sensor_path, name))
+
+    def test_next(self):
+        async def main():
+            async with AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name) as reader:
+                loop = asyncio.get_running_loop()
+                loop.call_later(0.01, self._publish, "count", 5)
+                return await reader.next("count", timeout=2)
+        self.assertEqual(asyncio.run(main()), 5)
+
+    def test_next_timeout(self):
+        async def main():
+            async with AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name) as reader:
+                await reader.next("count", timeout=0.01)
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(main())
+
+    def test_parallel_decode_in_executor(self):
+        tree = os.path.join(self.tmpdir.name, "tree")
+        os.makedirs(os.path.join(tree, "sub"))
+        for name in ("a", "b", "sub/c"):
+            with open(os.path.join(tree, name), 'wb') as fd:
+                cbor2.dump(name, fd)
+
+        async def main(executor):
+            async with AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name,
+                                         parallel="thread", decode_in_executor=True,
+                                         executor=executor) as reader:
+                self.assertIs(reader.executor, executor)
+                self.assertIsNotNone(reader._parallel_executor)
+                loop = asyncio.get_running_loop()
+                loop.call_later(0.01, os.rename, tree, os.path.join(self.sensor_path, "tree"))
+                return await asyncio.wait_for(reader.next("tree"), 2)
+
+        with ThreadPoolExecutor(1) as executor:
+            self.assertEqual(asyncio.run(main(executor)), {"a": "a", "b": "b", "sub": {"c": "sub/c"}})
+            with self.assertRaises(ValueError):
+                AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name,
+                                  parallel=executor, executor=executor)
+
+    def test_updates(self):
+        async def main():
+            async with AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name,
+                                         decode_in_executor=True) as reader:
+                received = []
+                loop = asyncio.get_running_loop()
+                for i in range(1, 4):
+                    loop.call_later(0.02 * i, self._publish, "count", i)
+                async for value in reader.updates("count"):
+                    received.append(value)
+                    if value == 3:
+                        break
+                return received, reader._subscriptions
+        received, subscriptions = asyncio.run(main())
+        self.assertEqual(received[-1], 3)
+        self.assertEqual(subscriptions, {})
+
+    def _replace_sensor(self, value):
+        shutil.rmtree(self.sensor_path)
+        os.makedirs(self.sensor_path)
+        self._publish("count", value)
+
+    def test_updates_replaced_directory(self):
+        async def main():
+            async with AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name) as reader:
+                loop = asyncio.get_running_loop()
+                loop.call_later(0.01, self._replace_sensor, 1)
+                loop.call_later(0.05, self._publish, "count", 2)
+                received = []
+                async for value in reader.updates("count"):
+                    received.append(value)
+                    if value == 2:
+                        return received
+        self.assertEqual(asyncio.run(asyncio.wait_for(main(), 2)), [1, 2])
+
+    def test_updates_removed_directory(self):
+        async def main():
+            async with AsyncSensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name) as reader:
+                asyncio.get_running_loop().call_later(0.01, shutil.rmtree, self.sensor_path)
+                async for _ in reader.updates("count"):
+                    pass
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(asyncio.wait_for(main(), 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,8 @@ import unittest
 import numpy as np
 import cbor2
 import os
-from unittest.mock import patch, mock_open, MagicMock
+import tempfile
+from unittest.mock import patch, mock_open
 
 from tmpfs_framework import cbor_utils
 
@@ -23,15 +24,72 @@ class TestCBORUtils(unittest.TestCase):
 
     def test_numpy_encoder_1d(self):
         arr = np.array([1, 2, 3], dtype=np.uint8)
-        encoder = MagicMock()
-        cbor_utils._numpy_encoder(encoder, arr)
-        encoder.encode_semantic.assert_called_once()
+        encoded = cbor2.dumps(arr, default=cbor_utils._numpy_encoder)
+        self.assertEqual(encoded, cbor2.dumps(cbor2.CBORTag(cbor_utils._tag_map[arr.dtype], arr.tobytes())))
+        result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+        np.testing.assert_array_equal(result, arr)
 
     def test_numpy_encoder_2d(self):
         arr = np.array([[1, 2], [3, 4]], dtype=np.uint8)
-        encoder = MagicMock()
-        cbor_utils._numpy_encoder(encoder, arr)
-        encoder.encode_semantic.assert_called_once()
+        encoded = cbor2.dumps(arr, default=cbor_utils._numpy_encoder)
+        expected = cbor2.CBORTag(40, [list(arr.shape), cbor2.CBORTag(cbor_utils._tag_map[arr.dtype], arr.tobytes())])
+        self.assertEqual(encoded, cbor2.dumps(expected))
+        result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+        np.testing.assert_array_equal(result, arr)
+
+    def test_numpy_encoder_strided(self):
+        arr = np.arange(60, dtype=np.float64).reshape(3, 4, 5)[:, ::2, 1:]
+        encoded = cbor2.dumps({"a": arr, "b": 1}, default=cbor_utils._numpy_encoder)
+        result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+        np.testing.assert_array_equal(result["a"], arr)
+        self.assertEqual(result["b"], 1)
+
+    def test_decode_big_endian(self):
+        arr = np.array([1, -2, 300], dtype='>i4')
+        tag = cbor2.CBORTag(74, arr.tobytes())
+        result = cbor_utils._decode_homogenous_arary(None, tag)
+        np.testing.assert_array_equal(result, arr)
+        self.assertTrue(result.dtype.isnative)
+
+    def test_decode_clamped(self):
+        result = cbor2.loads(cbor2.dumps(cbor2.CBORTag(68, b"\x01\xff")), tag_hook=cbor_utils.decode_tags)
+        np.testing.assert_array_equal(result, np.array([1, 255], dtype=np.uint8))
+
+    def test_byte_order_tags(self):
+        for dtype, tag in (('<u2', 69), ('>u2', 65), ('|u1', 64), ('<f8', 86), ('>f4', 81), (np.int64, 79)):
+            arr = np.arange(6, dtype=dtype)
+            encoded = cbor2.dumps(arr, default=cbor_utils._numpy_encoder)
+            self.assertEqual(encoded, cbor2.dumps(cbor2.CBORTag(tag, arr.tobytes())))
+            result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+            np.testing.assert_array_equal(result, arr)
+
+    def test_numpy_encoder_column_major(self):
+        arr = np.asfortranarray(np.arange(12, dtype=np.int16).reshape(3, 4))
+        encoded = cbor2.dumps(arr, default=cbor_utils._numpy_encoder)
+        expected = cbor2.CBORTag(1040, [[3, 4], cbor2.CBORTag(cbor_utils._tag_map[arr.dtype], arr.tobytes(order='F'))])
+        self.assertEqual(encoded, cbor2.dumps(expected))
+        result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+        np.testing.assert_array_equal(result, arr)
+        self.assertTrue(result.flags.f_contiguous)
+
+    def test_numpy_encoder_fallback(self):
+        for arr in (np.array([[True, False], [False, True]]), np.array([1 + 2j, 3 - 1j]),
+                    np.array([1.0, 2.0], dtype='>c16')):
+            encoded = cbor2.dumps(arr, default=cbor_utils._numpy_encoder)
+            result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+            np.testing.assert_array_equal(result, arr)
+            self.assertEqual(result.shape, arr.shape)
+
+    def test_numpy_encoder_longdouble(self):
+        for value in (np.array([1.5, -2.25], dtype=np.longdouble), np.longdouble(1.5),
+                      np.array([1 + 2j], dtype=np.clongdouble)):
+            encoded = cbor2.dumps(value, default=cbor_utils._numpy_encoder)
+            result = cbor2.loads(encoded, tag_hook=cbor_utils.decode_tags)
+            np.testing.assert_array_equal(result, np.atleast_1d(value))
+
+    def test_numpy_encoder_object(self):
+        with self.assertRaises(TypeError):
+            cbor2.dumps(np.array([{"a": 1}, None]), default=cbor_utils._numpy_encoder)
 
     @patch("tmpfs_framework.cbor_utils.get_temp_file", return_value="/tmp/testfile.cbor")
     @patch("builtins.open", new_callable=mock_open)
@@ -52,8 +110,84 @@ class TestCBORUtils(unittest.TestCase):
         path = cbor_utils.get_temp_file(tmpfs_path="/custom/tmpfs")
         self.assertTrue(path.startswith("/custom/tmpfs/tmp"))
 
+    def test_mmap_array(self):
+        arr = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "image")
+            with open(path, 'wb') as fd:
+                cbor2.dump(arr, fd, default=cbor_utils._numpy_encoder)
+            result = cbor_utils.mmap_array(path)
+            np.testing.assert_array_equal(result, arr)
+            self.assertFalse(result.flags.writeable)
+
+            #view must survive writer replacing the file
+            replacement = os.path.join(tmpdir, "tmp")
+            with open(replacement, 'wb') as fd:
+                cbor2.dump(arr * 2, fd, default=cbor_utils._numpy_encoder)
+            os.rename(replacement, path)
+            np.testing.assert_array_equal(result, arr)
+
+    def test_mmap_array_byte_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for arr in (np.arange(6, dtype='>f8'), np.asfortranarray(np.arange(6, dtype=np.uint32).reshape(2, 3))):
+                path = os.path.join(tmpdir, "array")
+                with open(path, 'wb') as fd:
+                    cbor2.dump(arr, fd, default=cbor_utils._numpy_encoder)
+                result = cbor_utils.mmap_array(path)
+                np.testing.assert_array_equal(result, arr)
+                self.assertEqual(result.dtype, arr.dtype)
+
+    def test_mmap_array_not_array(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "value")
+            with open(path, 'wb') as fd:
+                cbor2.dump({"key": "value"}, fd)
+            self.assertIsNone(cbor_utils.mmap_array(path))
+
+
+    def test_load_cbor_array(self):
+        arrays = [np.arange(3, dtype=np.uint8), np.arange(1000, dtype='>f8'),
+                  np.arange(24, dtype=np.int16).reshape(2, 3, 4),
+                  np.asfortranarray(np.arange(600, dtype=np.float32).reshape(20, 30)),
+                  np.zeros((0, 3)), np.arange(64, dtype=np.uint8).reshape(1, 1, 1, 1, 1, 1, 1, 1, 64)]
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                patch("cbor2.CBORDecoder", side_effect=AssertionError("cbor2 used")):
+            path = os.path.join(tmpdir, "array")
+            for arr in arrays:
+                with open(path, 'wb') as fd:
+                    cbor_utils.dump_cbor(arr, fd)
+                with open(path, 'rb') as fd:
+                    result = cbor_utils.load_cbor(fd)
+                np.testing.assert_array_equal(result, arr)
+                self.assertEqual(result.shape, arr.shape)
+                self.assertTrue(result.dtype.isnative)
+                with open(path, 'rb') as fd:
+                    np.testing.assert_array_equal(cbor_utils.loads_cbor(fd.read()), arr)
 
+    def test_load_cbor_fallback(self):
+        values = [{"a": np.arange(3), "b": 1}, 5, "text", [np.arange(2)], np.array([True, False]),
+                  np.zeros([1] * 20)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "value")
+            for value in values:
+                with open(path, 'wb') as fd:
+                    cbor_utils.dump_cbor(value, fd)
+                with open(path, 'rb') as fd:
+                    expected = cbor2.load(fd, tag_hook=cbor_utils.decode_tags)
+                    fd.seek(0)
+                    result = cbor_utils.load_cbor(fd)
+                    fd.seek(0)
+                    self.assertEqual(repr(cbor_utils.loads_cbor(fd.read())), repr(expected))
+                self.assertEqual(repr(result), repr(expected))
 
+    def test_load_cbor_truncated(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "array")
+            with open(path, 'wb') as fd:
+                cbor_utils.dump_cbor(np.arange(100), fd)
+                fd.truncate(500)
+            with open(path, 'rb') as fd:
+                self.assertRaises(cbor2.CBORDecodeError, cbor_utils.load_cbor, fd)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,91 @@
+import os
+import zipfile
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import cbor2
+import numpy as np
+
+from tmpfs_framework import SensorWriter, SensorReader
+from tmpfs_framework.cbor_utils import decode_tags, _numpy_encoder, COMPRESSED_TAG
+from tmpfs_framework.compression import Codec, compress, compress_encoded
+from tmpfs_framework.recorder import Snapshot, write_snapshot
+
+
+def round_trip(value, codec):
+    encoded = cbor2.dumps(compress(value, codec), default=_numpy_encoder)
+    return encoded, cbor2.loads(encoded, tag_hook=decode_tags)
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_parse(self):
+        codec = Codec.parse("delta+shuffle+lzma:4")
+        self.assertEqual((codec.compressor, codec.filters, codec.level), ("lzma", ("delta", "shuffle"), 4))
+        self.assertEqual(Codec.parse("zlib").filters, ())
+        with self.assertRaises(ValueError):
+            Codec.parse("zstd")
+        with self.assertRaises(ValueError):
+            Codec.parse("bitshuffle+zlib")
+
+    def test_arrays_round_trip(self):
+        rng = np.random.default_rng(0)
+        arrays = [np.cumsum(rng.integers(-3, 4, (48, 64)), axis=1).astype(np.uint16),
+                  np.arange(100, dtype=np.int64)[::-1],
+                  rng.random((5, 4, 3)).astype(np.float32),
+                  np.array([-1.5, np.inf, np.nan, 0.0]),
+                  np.array([True, False, True])]
+        for codec in ["zlib", "shuffle+bz2", "delta+zlib:1", "delta+shuffle+lzma"]:
+            for array in arrays:
+                _, decoded = round_trip(array, codec)
+                self.assertEqual(decoded.dtype, array.dtype)
+                np.testing.assert_array_equal(decoded, array)
+
+    def test_filters_improve_ratio(self):
+        depth = (1000 + np.cumsum(np.random.default_rng(0).integers(-3, 4, (120, 160)), axis=1)).astype(np.uint16)
+        plain, _ = round_trip(depth, "zlib")
+        filtered, _ = round_trip(depth, "delta+shuffle+zlib")
+        self.assertLess(len(filtered), len(plain))
+
+    def test_other_values(self):
+        value = {"a": [1, 2, 3], "b": np.arange(4)}
+        encoded, decoded = round_trip(value, "zlib")
+        self.assertEqual(cbor2.loads(encoded).tag, COMPRESSED_TAG)
+        self.assertEqual(decoded["a"], [1, 2, 3])
+        np.testing.assert_array_equal(decoded["b"], np.arange(4))
+
+    def test_compress_encoded_keeps_non_cbor(self):
+        self.assertEqual(compress_encoded(b"\xff\xd8\xff\xe0jpeg", "zlib"), b"\xff\xd8\xff\xe0jpeg")
+        encoded = compress_encoded(cbor2.dumps([1, 2]), "zlib")
+        self.assertEqual(cbor2.loads(encoded, tag_hook=decode_tags), [1, 2])
+
+    def test_writer_channel_codecs(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            depth = np.arange(1000, dtype=np.uint16).reshape(20, 50)
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir, codecs={"depth": "delta+shuffle+zlib"})
+            sw.write("depth", depth)
+            sw.write("plain", depth)
+            sw.channel("depth_channel", codec="shuffle+zlib").write(depth)
+            sw.write_zip("measurement", {"depth": depth}, codec="delta+shuffle+zlib")
+            self.assertLess(os.path.getsize(os.path.join(sw.data_path, "depth")),
+                            os.path.getsize(os.path.join(sw.data_path, "plain")) / 4)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            np.testing.assert_array_equal(sr.get_value("depth"), depth)
+            np.testing.assert_array_equal(sr.get_value("depth_channel"), depth)
+            np.testing.assert_array_equal(sr.get_value("measurement.zip")["depth"], depth)
+
+    def test_snapshot_codec(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            depth = np.zeros((100, 100), dtype=np.uint16)
+            snapshot = Snapshot("1_sensor", 1, "sensor",
+                                members=[("depth", cbor2.dumps(depth, default=_numpy_encoder))])
+            filename = write_snapshot(snapshot, tmpdir, codec="delta+shuffle+zlib")
+            with zipfile.ZipFile(filename) as zf:
+                content = zf.read("depth")
+            self.assertLess(len(content), depth.nbytes / 10)
+            np.testing.assert_array_equal(cbor2.loads(content, tag_hook=decode_tags), depth)
+
+
+if __name__ == '__main__':
+    unittest.main()
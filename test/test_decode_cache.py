@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+import numpy as np
+
+from tmpfs_framework.decode_cache import DecodeCache, value_size
+
+
+class TestDecodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "value")
+        self._replace(b"first")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _replace(self, content):
+        tmp = os.path.join(self.tmpdir.name, "tmp")
+        with open(tmp, 'wb') as fd:
+            fd.write(content)
+        os.rename(tmp, self.path)
+
+    def test_hit_when_unchanged(self):
+        cache = DecodeCache(1024)
+        loader = Mock(return_value="decoded")
+        self.assertEqual(cache.get(self.path, loader), "decoded")
+        self.assertEqual(cache.get(self.path, loader), "decoded")
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_miss_when_replaced(self):
+        cache = DecodeCache(1024)
+        loader = Mock(return_value="decoded")
+        cache.get(self.path, loader)
+        self._replace(b"second")
+        cache.get(self.path, loader)
+        self.assertEqual(loader.call_count, 2)
+        self.assertEqual(cache.misses, 2)
+
+    def test_lru_eviction(self):
+        cache = DecodeCache(10)
+        other = os.path.join(self.tmpdir.name, "other")
+        with open(other, 'wb') as fd:
+            fd.write(b"abcdef")
+        cache.get(self.path, Mock(return_value=1))
+        cache.get(other, Mock(return_value=2))
+        info = cache.info()
+        self.assertEqual(info["evictions"], 1)
+        self.assertEqual(info["entries"], 1)
+        self.assertLessEqual(info["size"], 10)
+
+    def test_too_large_not_cached(self):
+        cache = DecodeCache(1)
+        loader = Mock(return_value="decoded")
+        cache.get(self.path, loader)
+        cache.get(self.path, loader)
+        self.assertEqual(loader.call_count, 2)
+
+
+    def test_shared_values_protected(self):
+        cache = DecodeCache(1024)
+        loader = Mock(side_effect=lambda: {"x": 1, "image": np.zeros(4), "list": [np.ones(2)]})
+        first = cache.get(self.path, loader)
+        first["x"] = 2
+        first["list"].append(3)
+        second = cache.get(self.path, loader)
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(second["x"], 1)
+        self.assertEqual(len(second["list"]), 1)
+        for array in (first["image"], second["image"], second["list"][0]):
+            with self.assertRaises(ValueError):
+                array[0] = 7
+
+    def test_uncacheable_values(self):
+        cache = DecodeCache(1024)
+        loader = Mock(return_value={"lazy": object()})
+        cache.get(self.path, loader)
+        cache.get(self.path, loader)
+        self.assertEqual(loader.call_count, 2)
+        self.assertEqual(cache.info()["entries"], 0)
+
+    def test_size_of_decoded_value(self):
+        self.assertEqual(value_size(np.zeros(100)), 800)
+        self.assertEqual(value_size({"ab": b"1234", "c": [np.zeros(2, dtype=np.uint8)]}), 2 + 4 + 1 + 8 + 2)
+        #file is small, decoded array is not
+        cache = DecodeCache(1024)
+        cache.get(self.path, Mock(return_value=np.zeros(1000)))
+        self.assertEqual(cache.info()["entries"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
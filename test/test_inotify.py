@@ -0,0 +1,151 @@
+import os
+import errno
+import resource
+import struct
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from tmpfs_framework.inotify import (InotifyDispatcher, parse_events, IN_MOVED_TO,
+                                     IN_IGNORED, IN_CREATE)
+
+
+class TestInotify(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dispatcher = InotifyDispatcher()
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        self.tmpdir.cleanup()
+
+    def _publish(self, name):
+        tmp = os.path.join(self.tmpdir.name, "tmp")
+        with open(tmp, 'wb') as fd:
+            fd.write(b"data")
+        os.rename(tmp, os.path.join(self.tmpdir.name, name))
+
+    def test_parse_events(self):
+        name = b"value\0\0\0"
+        buf = struct.pack('iIII', 1, IN_MOVED_TO, 0, len(name)) + name
+        buf += struct.pack('iIII', 1, IN_IGNORED, 0, 0)
+        self.assertEqual(parse_events(buf), [(1, IN_MOVED_TO, "value"), (1, IN_IGNORED, "")])
+
+    def test_callback_on_rename(self):
+        path = os.path.join(self.tmpdir.name, "value")
+        received = []
+        event = threading.Event()
+
+        def callback(p):
+            received.append(p)
+            event.set()
+
+        self.dispatcher.register(path, callback)
+        self.dispatcher.register(os.path.join(self.tmpdir.name, "other"), callback)
+        self._publish("value")
+        self.assertTrue(event.wait(2))
+        self.assertEqual(received, [path])
+
+    def test_single_watch_per_directory(self):
+        a = self.dispatcher.register(os.path.join(self.tmpdir.name, "a"), print)
+        b = self.dispatcher.register(os.path.join(self.tmpdir.name, "b"), print)
+        self.assertEqual(len(self.dispatcher._wds), 1)
+        a.stop()
+        self.assertEqual(len(self.dispatcher._wds), 1)
+        b.stop()
+        self.assertEqual(len(self.dispatcher._wds), 0)
+
+    def test_masks_of_subscribers(self):
+        created = threading.Event()
+        a = self.dispatcher.register(os.path.join(self.tmpdir.name, "a"), print, IN_MOVED_TO)
+        b = self.dispatcher.register(os.path.join(self.tmpdir.name, "b"), lambda p: created.set(), IN_CREATE)
+        wd, = self.dispatcher._wds.values()
+        self.assertEqual(self.dispatcher._masks[wd], IN_MOVED_TO | IN_CREATE)
+        with open(os.path.join(self.tmpdir.name, "b"), 'wb'):
+            pass
+        self.assertTrue(created.wait(2))
+        b.stop()
+        self.assertEqual(self.dispatcher._masks[wd], IN_MOVED_TO)
+        a.stop()
+
+    def test_replaced_directory(self):
+        dirpath = os.path.join(self.tmpdir.name, "sensor")
+        os.makedirs(dirpath)
+        received = []
+        event = threading.Event()
+
+        def callback(p):
+            received.append(p)
+            event.set()
+
+        self.dispatcher.register(os.path.join(dirpath, "value"), callback)
+        os.makedirs(dirpath + ".new")
+        with open(os.path.join(dirpath + ".new", "value"), 'wb'):
+            pass
+        #watched directory is deleted when replaced, its watch is added again
+        os.rename(dirpath + ".new", dirpath)
+        self.assertTrue(event.wait(2))
+        event.clear()
+        tmp = os.path.join(dirpath, "tmp")
+        with open(tmp, 'wb'):
+            pass
+        os.rename(tmp, os.path.join(dirpath, "value"))
+        self.assertTrue(event.wait(2))
+        self.assertEqual(received, [os.path.join(dirpath, "value")] * 2)
+
+    def test_removed_directory(self):
+        dirpath = os.path.join(self.tmpdir.name, "sensor")
+        os.makedirs(dirpath)
+        errors = []
+        event = threading.Event()
+
+        def on_error(path, error):
+            errors.append((path, error.errno))
+            event.set()
+
+        self.dispatcher.register(os.path.join(dirpath, "value"), print, on_error=on_error)
+        os.rmdir(dirpath)
+        self.assertTrue(event.wait(2))
+        self.assertEqual(errors, [(os.path.join(dirpath, "value"), errno.ENOENT)])
+        self.assertEqual(self.dispatcher._wds, {})
+
+    def _wait_callback(self, dispatcher):
+        event = threading.Event()
+        dispatcher.register(os.path.join(self.tmpdir.name, "value"), lambda p: event.set())
+        self._publish("value")
+        return event.wait(2)
+
+    def test_descriptor_above_fd_setsize(self):
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 1100:
+            self.skipTest("open file limit too low")
+        fds = [os.open(os.devnull, os.O_RDONLY) for _ in range(1030)]
+        try:
+            dispatcher = InotifyDispatcher()
+        finally:
+            for fd in fds:
+                os.close(fd)
+        try:
+            self.assertGreater(dispatcher._inotify.fd, 1024)
+            self.assertTrue(self._wait_callback(dispatcher))
+        finally:
+            dispatcher.stop()
+
+    def test_error_does_not_stop_dispatcher(self):
+        read_events = self.dispatcher._inotify.read_events
+        failures = []
+
+        def failing():
+            if not failures:
+                failures.append(1)
+                raise OSError("read failed")
+            return read_events()
+
+        with patch.object(self.dispatcher._inotify, "read_events", side_effect=failing), \
+                self.assertLogs(level="ERROR"):
+            self.assertTrue(self._wait_callback(self.dispatcher))
+        self.assertEqual(failures, [1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from tmpfs_framework import SensorWriter, SensorReader
+from tmpfs_framework.metrics import Histogram, Metrics, MetricsPublisher, metrics
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        h = Histogram()
+        self.assertIsNone(h.percentile(50))
+        for us in [1, 3, 3, 3, 100]:
+            h.record(us * 1000)
+        d = h.to_dict()
+        self.assertEqual(d["count"], 5)
+        self.assertEqual(d["max_us"], 100)
+        self.assertEqual(d["p50_us"], 4)
+        self.assertEqual(d["p99_us"], 100)
+        self.assertEqual(d["buckets"], {2: 1, 4: 3, 128: 1})
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch("tmpfs_framework.TMPFS_PATH", self.tmpdir.name)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_record(self):
+        m = Metrics()
+        m.record_write("a", 10, 2000)
+        m.record_write("a", 20, 4000)
+        m.record_read("a", 1000, 10, staleness_ns=5000)
+        a = m.snapshot()["a"]
+        self.assertEqual((a["writes"], a["write_bytes"], a["reads"], a["read_bytes"]), (2, 30, 1, 10))
+        self.assertEqual(a["encode"]["count"], 2)
+        self.assertEqual(a["staleness"]["max_us"], 5)
+        self.assertGreater(a["write_rate_hz"], a["read_rate_hz"])
+        self.assertGreater(a["read_rate_hz"], 0)
+        #rates are computed since previous snapshot
+        m.record_read("a", 1000)
+        a = m.snapshot()["a"]
+        self.assertEqual(a["write_rate_hz"], 0)
+        self.assertGreater(a["read_rate_hz"], 0)
+
+    def test_writer_and_reader(self):
+        sw = SensorWriter("testdir", "testfile", tmpfs_path=self.tmpdir.name)
+        sw.write("number", 1)
+        sw.channel("fast").write(2)
+        sr = SensorReader("testdir", "testfile", tmpfs_path=self.tmpdir.name)
+        received = threading.Event()
+        sr.attach_watchdog("number", lambda value: received.set())
+        sw.write("number", 3)
+        self.assertTrue(received.wait(2))
+        sr.stop_watchdog()
+        self.assertEqual(sr.observers, {})
+        self.assertEqual(sr.get_value("fast"), 2)
+
+        snapshot = metrics.snapshot()
+        number = snapshot[os.path.join("testdir", "testfile", "number")]
+        self.assertEqual(number["writes"], 2)
+        self.assertEqual(number["write_bytes"], 2)
+        self.assertEqual(number["reads"], 1)
+        self.assertEqual(number["staleness"]["count"], 1)
+        fast = snapshot[os.path.join("testdir", "testfile", "fast")]
+        self.assertEqual((fast["writes"], fast["reads"]), (1, 1))
+
+    def test_concurrent_record(self):
+        m = Metrics()
+        def record(name):
+            for _ in range(1000):
+                m.record_write(name, 1, 1000)
+                m.record_read("shared", 1000)
+        threads = [threading.Thread(target=record, args=(f"c{i}",)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        snapshot = m.snapshot()
+        self.assertEqual(snapshot["shared"]["reads"], 4000)
+        self.assertEqual([snapshot[f"c{i}"]["writes"] for i in range(4)], [1000] * 4)
+
+    def test_disabled(self):
+        with patch.object(metrics, "enabled", False):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=self.tmpdir.name)
+            sw.write("number", 1)
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_publisher(self):
+        sw = SensorWriter("testdir", "testfile", tmpfs_path=self.tmpdir.name)
+        sw.write("number", 1)
+        publisher = MetricsPublisher(interval=60, name="test", tmpfs_path=self.tmpdir.name)
+        publisher.stop()
+        sr = SensorReader("_metrics", "test", tmpfs_path=self.tmpdir.name)
+        published = sr.get_value("metrics")
+        self.assertEqual(published["pid"], os.getpid())
+        self.assertEqual(published["channels"]["testdir/testfile/number"]["writes"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import time
+import zipfile
+import tempfile
+import threading
+import unittest
+
+from tmpfs_framework.recorder import Snapshot, RecordingPipeline, write_snapshot, ZIPPED_COMMENT
+
+
+class TestWriteSnapshot(unittest.TestCase):
+
+    def test_members(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot = Snapshot("1_sensor", 1, "sensor", members=[("a", b"1"), ("b/c", b"2")])
+            filename = write_snapshot(snapshot, tmpdir, compresslevel=3)
+            self.assertEqual(filename, os.path.join(tmpdir, "1_sensor.zip"))
+            with zipfile.ZipFile(filename) as zf:
+                self.assertEqual(zf.read("a"), b"1")
+                self.assertEqual(zf.read("b/c"), b"2")
+
+    def test_zip_bytes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, "source.zip")
+            with zipfile.ZipFile(source, "w") as zf:
+                zf.writestr("a", b"1")
+            with open(source, "rb") as fd:
+                snapshot = Snapshot("1_sensor", 1, "sensor", zip_bytes=fd.read())
+            #copied as is without compression, only the comment is added
+            filename = write_snapshot(snapshot, tmpdir)
+            with open(filename, "rb") as fd:
+                self.assertEqual(fd.read(), snapshot.zip_bytes[:-2] + len(ZIPPED_COMMENT).to_bytes(2, "little")
+                                 + ZIPPED_COMMENT)
+            #recompressed
+            with zipfile.ZipFile(write_snapshot(snapshot, tmpdir, compresslevel=3)) as zf:
+                self.assertEqual(zf.getinfo("a").compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zf.read("a"), b"1")
+
+
+class TestRecordingPipeline(unittest.TestCase):
+
+    def _blocked_pipeline(self, policy, queue_size=2):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.written = []
+
+        def sink(snapshot):
+            self.started.set()
+            self.release.wait()
+            self.written.append(snapshot)
+        return RecordingPipeline(sink, queue_size=queue_size, policy=policy)
+
+    def test_block(self):
+        pipeline = RecordingPipeline(lambda s: time.sleep(0.001), queue_size=1)
+        for i in range(10):
+            self.assertTrue(pipeline.submit(i))
+        pipeline.stop()
+        self.assertEqual(pipeline.stats(), {"queued": 10, "written": 10, "dropped": 0,
+                                            "failed": 0, "pending": 0})
+
+    def test_drop_newest(self):
+        pipeline = self._blocked_pipeline("drop_newest")
+        pipeline.submit(0)
+        self.started.wait()
+        self.assertEqual([pipeline.submit(i) for i in range(1, 5)], [True, True, False, False])
+        self.release.set()
+        pipeline.stop()
+        self.assertEqual(self.written, [0, 1, 2])
+        self.assertEqual(pipeline.stats()["dropped"], 2)
+
+    def test_drop_oldest(self):
+        pipeline = self._blocked_pipeline("drop_oldest")
+        pipeline.submit(0)
+        self.started.wait()
+        self.assertTrue(all(pipeline.submit(i) for i in range(1, 5)))
+        self.release.set()
+        pipeline.stop()
+        self.assertEqual(self.written, [0, 3, 4])
+        self.assertEqual(pipeline.stats()["dropped"], 2)
+
+    def test_stop_without_drain(self):
+        pipeline = self._blocked_pipeline("block")
+        pipeline.submit(0)
+        self.started.wait()
+        pipeline.submit(1)
+        self.release.set()
+        pipeline.stop(drain=False)
+        self.assertLessEqual(len(self.written), 2)
+        stats = pipeline.stats()
+        self.assertEqual(stats["written"] + stats["dropped"], 2)
+
+    def test_failed(self):
+        def sink(snapshot):
+            raise OSError("disk full")
+        pipeline = RecordingPipeline(sink)
+        with self.assertLogs(level="ERROR"):
+            pipeline.submit(0)
+            pipeline.stop()
+        self.assertEqual(pipeline.stats()["failed"], 1)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            RecordingPipeline(print, policy="drop_all")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from tmpfs_framework import SensorWriter, SensorReader
+from tmpfs_framework.records import pack_record, unpack_record
+from tmpfs_framework.sensor_reader import read
+
+
+class TestRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch("tmpfs_framework.TMPFS_PATH", self.tmpdir.name)
+        self.patcher.start()
+        self.stats = {"name": "wlan0", "receive_bytes": 1234.0, "receive_packets": 12,
+                      "up": True, "wireless": {"level": np.int16(-40), "ssid": None}}
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_pack_unpack(self):
+        record = pack_record(self.stats)
+        names, formats, payload, other = record.value
+        self.assertEqual(names, ["name", "receive_bytes", "receive_packets", "up", "wireless/level",
+                                 "wireless/ssid"])
+        self.assertEqual(formats, [None, "<f8", "<i8", "|b1", "<i2", None])
+        self.assertEqual(len(payload), 8 + 8 + 1 + 2)
+        self.assertEqual(unpack_record(record.value), self.stats)
+
+    def test_only_other_values(self):
+        data = {"ssid": "network", "big": 2**70}
+        self.assertEqual(unpack_record(pack_record(data).value), data)
+
+    def test_write_packed(self):
+        writer = SensorWriter("network_stats", "wlan0")
+        writer.write("netdev", self.stats, packed=True)
+        self.assertEqual(os.listdir(writer.data_path), ["netdev.rec"])
+        self.assertEqual(read(os.path.join(writer.data_path, "netdev.rec")), self.stats)
+
+    def test_reader_fields(self):
+        writer = SensorWriter("network_stats", "wlan0")
+        writer.write("netdev", self.stats, packed=True)
+        writer.write("uptime", 5)
+        sr = SensorReader("network_stats", "wlan0")
+        for field in ("receive_bytes", "receive_packets", "wireless", "uptime"):
+            self.assertIn(field, sr.attributes)
+        self.assertEqual(sr.receive_packets, 12)
+        self.assertEqual(sr.get_value("wireless"), {"level": -40, "ssid": None})
+        self.assertEqual(sr.get_value_path("receive_bytes"), os.path.join(writer.data_path, "netdev.rec"))
+
+        received = []
+        updated = threading.Event()
+        sr.attach_watchdog("receive_packets", lambda value: (received.append(value), updated.set()))
+        try:
+            writer.write("netdev", dict(self.stats, receive_packets=13), packed=True)
+            self.assertTrue(updated.wait(2))
+            self.assertEqual(received, [13])
+        finally:
+            sr.disable_watchdog("receive_packets")
+
+
+if __name__ == '__main__':
+    unittest.main()
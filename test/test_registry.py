@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import cbor2
+import numpy as np
+
+from tmpfs_framework import SensorWriter, SensorReader, SharedArrayWriter
+from tmpfs_framework.sensor_writer import pack_to_zip
+from tmpfs_framework.registry import Registry, split_channel
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch("tmpfs_framework.TMPFS_PATH", self.tmpdir.name)
+        self.patcher.start()
+        self.registry = Registry(os.path.join(self.tmpdir.name, "sensors"))
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_split_channel(self):
+        self.assertEqual(split_channel("cam", "image"), ("cam", "image"))
+        self.assertEqual(split_channel(".", "./wlan0/receive_bytes"), ("wlan0", "receive_bytes"))
+        self.assertEqual(split_channel(".", "uptime"), ("uptime", ""))
+
+    def test_writer_registers_channels(self):
+        writer = SensorWriter("sensors", "cam")
+        writer.write("count", 1)
+        writer.write("image", np.zeros((2, 3), dtype=np.uint16))
+        writer.write("pose", {"x": 1.0, "y": 2.0})
+        writer.write_zip("measurement", {"count": 1})
+        writer.channel("fast").write(np.zeros(4, dtype=np.float32))
+        channels = self.registry.channels("cam")
+        self.assertEqual(list(channels), ["count", "image", "pose/x", "pose/y", "measurement.zip", "fast"])
+        self.assertEqual(channels["count"]["kind"], "value")
+        self.assertEqual(channels["image"], {"kind": "array", "dtype": "<u2", "shape": [2, 3], "generation": 0})
+        self.assertEqual(channels["measurement.zip"]["kind"], "zip")
+        #unchanged channels do not update the registry
+        generation = self.registry.load()["generation"]
+        writer.write("image", np.ones((2, 3), dtype=np.uint16))
+        writer.channel("fast").write(np.ones(4, dtype=np.float32))
+        self.assertEqual(self.registry.load()["generation"], generation)
+
+    def test_variable_shape(self):
+        writer = SensorWriter("sensors", "lidar")
+        for n in (3, 4, 5, 6):
+            writer.write("points", np.zeros(n))
+        self.assertIsNone(self.registry.lookup("lidar", "points")["shape"])
+        self.assertEqual(self.registry.load()["generation"], 2)
+
+    def test_variable_dtype(self):
+        writer = SensorWriter("sensors", "imu")
+        for i in range(6):
+            writer.write("temperature", i if i % 2 else float(i))
+        self.assertEqual(self.registry.lookup("imu", "temperature"),
+                         {"kind": "value", "dtype": None, "shape": None, "generation": 0})
+        self.assertEqual(self.registry.load()["generation"], 2)
+        writer.write("temperature", np.zeros(3))
+        self.assertEqual(self.registry.lookup("imu", "temperature")["kind"], "array")
+
+    def test_commit_generation(self):
+        writer = SensorWriter("sensors", "cam")
+        writer.write("count", 1)
+        generation = self.registry.load()["generation"]
+        writer.commit()
+        writer.write("count", 2)
+        writer.commit()
+        #commits do not rewrite the registry
+        self.assertEqual(self.registry.load()["generation"], generation)
+        writer.write("depth", 1)
+        self.assertEqual(self.registry.lookup("cam", "count")["generation"], 0)
+        self.assertEqual(self.registry.lookup("cam", "depth")["generation"], 2)
+
+    def test_concurrent_writers(self):
+        def register(sensor):
+            writer = SensorWriter("sensors", sensor)
+            for i in range(20):
+                writer.write(f"value{i}", i)
+        def lookup():
+            #shared registry is read by other threads while it changes
+            registry = Registry(self.registry.directory)
+            for _ in range(200):
+                for sensor in registry.sensors():
+                    self.assertIsNotNone(registry.channels(sensor))
+        threads = [threading.Thread(target=register, args=(f"sensor{i}",)) for i in range(4)]
+        threads += [threading.Thread(target=lookup) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        sensors = self.registry.sensors()
+        self.assertEqual(sorted(sensors), [f"sensor{i}" for i in range(4)])
+        for sensor in sensors:
+            self.assertEqual(len(self.registry.channels(sensor)), 20)
+
+    def test_shared_array_registered(self):
+        SharedArrayWriter("sensors", "cam", "frame", (4, 3), np.uint8)
+        self.assertEqual(self.registry.lookup("cam", "frame.shm"),
+                         {"kind": "shared_array", "dtype": "|u1", "shape": [4, 3], "generation": 0})
+
+    def test_reader_uses_registry(self):
+        writer = SensorWriter("sensors", "cam")
+        writer.write("count", 1)
+        writer.write("pose", {"x": 1.0})
+        writer.write_zip("measurement", {"count": 1})
+        SensorWriter("sensors", "imu").write("acc", 2)
+        sr = SensorReader("sensors")
+        self.assertEqual(sr.filename, "imu")
+        sr = SensorReader("sensors", "cam")
+        self.assertTrue(sr.has_zip)
+        self.assertEqual(sorted(sr.attributes), ["attributes", "count", "measurement", "pose"])
+        self.assertEqual(sr.count, 1)
+        self.assertEqual(sr.pose, {"x": 1.0})
+
+    def test_reader_lists_unregistered_files(self):
+        writer = SensorWriter("sensors", "dummy")
+        writer.write("number", 1)
+        writer.write("number_x2", 2)
+        pack_to_zip(["number", "number_x2"], writer.data_path)
+        sr = SensorReader("sensors", "dummy")
+        self.assertTrue(sr.has_zip)
+        self.assertEqual(sr.attributes, ["number", "number_x2", "attributes", "measurement"])
+        self.assertEqual(sr.measurement, {"number": 1, "number_x2": 2})
+
+    def test_removed_channels(self):
+        writer = SensorWriter("sensors", "cam")
+        writer.write("count", 1)
+        writer.write("pose", {"x": 1.0, "y": 2.0})
+        writer.write_zip("pose", {"x": 1.0})
+        self.assertEqual(list(self.registry.channels("cam")), ["count", "pose.zip"])
+        self.assertEqual(SensorReader("sensors", "cam").attributes, ["count", "pose_zip", "attributes"])
+
+        with writer.transaction():
+            writer.write("state", {"a": 1, "b": 2})
+        with writer.transaction():
+            writer.write("state", {"a": 1})
+        self.assertEqual(list(self.registry.channels("cam")), ["count", "pose.zip", "state/a"])
+
+    def test_reader_sensor_selection(self):
+        SensorWriter("sensors", "cam").write("count", 1)
+        SensorWriter("sensors", "imu").write("acc", 2)
+        #removed sensor is left in the registry, sensor written by other means is not in it
+        shutil.rmtree(os.path.join(self.registry.directory, "imu"))
+        os.makedirs(os.path.join(self.registry.directory, "gps"))
+        with open(os.path.join(self.registry.directory, "gps", "fix"), 'wb') as fd:
+            fd.write(cbor2.dumps(1))
+        self.assertEqual(sorted(self.registry.sensors()), ["cam", "imu"])
+        self.assertEqual(SensorReader("sensors", 0).filename, "cam")
+        sr = SensorReader("sensors")
+        self.assertEqual(sr.filename, "gps")
+        self.assertEqual(sr.fix, 1)
+
+    def test_reader_without_registry(self):
+        writer = SensorWriter("sensors", "cam")
+        writer.write("count", 1)
+        os.unlink(self.registry.path)
+        sr = SensorReader("sensors")
+        self.assertEqual(sr.filename, "cam")
+        self.assertEqual(sr.attributes, ["count", "attributes"])
+
+    def test_watch_registry(self):
+        writer = SensorWriter("sensors", "cam")
+        writer.write("count", 1)
+        sr = SensorReader("sensors", "cam")
+        updated = threading.Event()
+        sr.watch_registry(lambda attributes: updated.set())
+        try:
+            writer.write("depth", 2)
+            self.assertTrue(updated.wait(2))
+            self.assertIn("depth", sr.attributes)
+        finally:
+            sr.disable_watchdog(".registry")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from tmpfs_framework import SensorWriter, SensorReader
+from tmpfs_framework.recorder import Snapshot, write_snapshot
+from tmpfs_framework.segments import SegmentWriter, read_segments
+from tmpfs_framework.sensor_writer import pack_to_zip
+from tmpfs_framework.replay import Replayer, scan_recording
+from tmpfs_framework.cbor_utils import write_cbor
+from tmpfs_framework.registry import Registry
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.recording = os.path.join(self.tmpdir.name, "recording")
+        os.makedirs(self.recording)
+        self.patcher = patch("tmpfs_framework.TMPFS_PATH", self.tmpdir.name)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def _encode(self, value):
+        filename = os.path.join(self.tmpdir.name, "value")
+        write_cbor(filename, value)
+        with open(filename, "rb") as fd:
+            return fd.read()
+
+    def _record_zips(self, n, step=10):
+        for i in range(n):
+            snapshot = Snapshot(f"{1000 + i * step}_cam", 1000 + i * step, "cam",
+                                members=[("count", self._encode(i)),
+                                         ("image", self._encode(np.full((2, 2), i, dtype=np.uint8)))])
+            write_snapshot(snapshot, self.recording)
+        write_snapshot(Snapshot("cam_metadata", 1, "cam", members=[("fps", self._encode(100))]),
+                       self.recording)
+
+    def test_scan_orders_zip_and_segments(self):
+        self._record_zips(3)
+        writer = SegmentWriter(self.recording, "imu")
+        for t in (1005, 1015, 1025):
+            writer.write(Snapshot(f"{t}_imu", t, "imu", members=[("acc", self._encode(t))]))
+        writer.close()
+        metadata, snapshots = scan_recording(self.recording)
+        self.assertEqual([s.name for s in metadata], ["cam_metadata"])
+        self.assertEqual([s.timestamp for s in snapshots], [1000, 1005, 1010, 1015, 1020, 1025])
+        _, snapshots = scan_recording(self.recording, start=1010, end=1015)
+        self.assertEqual([s.sensor_name for s in snapshots], ["cam", "imu"])
+
+    def test_replay_max_speed(self):
+        self._record_zips(5)
+        replayer = Replayer(self.recording, dir_path="replay", tmpfs_path=self.tmpdir.name, speed=None)
+        self.assertEqual(replayer.run(), 5)
+        sr = SensorReader("replay", "cam", tmpfs_path=self.tmpdir.name)
+        self.assertEqual(sr.get_value("count"), 4)
+        np.testing.assert_array_equal(sr.get_value("image"), np.full((2, 2), 4, dtype=np.uint8))
+        self.assertEqual(sr.metadata, {"fps": 100})
+        self.assertEqual(sr.read_snapshot(["count"]), ({"count": 4}, 5))
+
+    def test_replay_rate(self):
+        self._record_zips(5, step=50)
+        replayer = Replayer(self.recording, tmpfs_path=self.tmpdir.name, speed=2.0)
+        start = time.monotonic()
+        replayer.run()
+        #200 ms of recording at double speed
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_stop(self):
+        self._record_zips(5, step=1000)
+        replayer = Replayer(self.recording, tmpfs_path=self.tmpdir.name)
+        replayer.start()
+        time.sleep(0.05)
+        replayer.stop()
+        self.assertTrue(replayer.wait(1))
+        self.assertEqual(replayer.published, 1)
+
+
+    def test_replay_copies_encoded_bytes(self):
+        self._record_zips(2)
+        image = self._encode(np.full((2, 2), 1, dtype=np.uint8))
+        with open(os.path.join(self.recording, "cam_metadata.zip"), "rb") as fd:
+            metadata = fd.read()
+        Replayer(self.recording, dir_path="replay", speed=None).run()
+        sensor_path = os.path.join(self.tmpdir.name, "replay", "cam")
+        with open(os.path.join(sensor_path, "image"), "rb") as fd:
+            self.assertEqual(fd.read(), image)
+        with open(os.path.join(sensor_path, "metadata.zip"), "rb") as fd:
+            self.assertEqual(fd.read(), metadata)
+        registry = Registry(os.path.join(self.tmpdir.name, "replay"))
+        self.assertEqual(registry.lookup("cam", "image"),
+                         {"kind": "array", "dtype": "|u1", "shape": [2, 2], "generation": 0})
+        self.assertEqual(registry.lookup("cam", "count")["kind"], "value")
+        self.assertEqual(registry.lookup("cam", "metadata.zip")["kind"], "zip")
+
+    def test_replay_zip_sensors(self):
+        writer = SensorWriter("live", "zipped")
+        writer.write_zip("measurement", {"count": 1, "pose": {"x": 1.0}})
+        writer = SensorWriter("live", "packed")
+        writer.write("number", 1)
+        writer.write("number_x2", 2)
+        pack_to_zip(["number", "number_x2"], writer.data_path)
+        for sensor in ("zipped", "packed"):
+            sr = SensorReader("live", sensor)
+            self.assertTrue(sr.has_zip)
+            sr.take_snapshot(self.recording)
+
+        self.assertEqual(Replayer(self.recording, dir_path="replay", speed=None).run(), 2)
+        self.assertEqual(SensorReader("replay", "zipped").measurement, {"count": 1, "pose": {"x": 1.0}})
+        self.assertEqual(SensorReader("replay", "packed").measurement, {"number": 1, "number_x2": 2})
+
+    def test_zipped_segments(self):
+        writer = SegmentWriter(self.recording, "zipped")
+        writer.write(Snapshot("1000_zipped", 1000, "zipped", members=[("count", self._encode(1))], zipped=True))
+        writer.close()
+        snapshot, = read_segments(self.recording)
+        self.assertTrue(snapshot.zipped)
+        Replayer(self.recording, dir_path="replay", speed=None).run()
+        self.assertEqual(SensorReader("replay", "zipped").measurement, {"count": 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from tmpfs_framework.ring_buffer import HistoryRing, slot_size_for
+
+
+class TestHistoryRing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, ".value.history")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_append_and_read(self):
+        ring = HistoryRing.create(self.path, 4, 16)
+        self.assertEqual(ring.head, 0)
+        self.assertEqual(ring.read_since(0), [])
+        for i in range(1, 4):
+            self.assertEqual(ring.append(bytes([i])), i)
+        reader = HistoryRing(self.path)
+        self.assertEqual(reader.read_since(1), [(2, b"\x02"), (3, b"\x03")])
+        self.assertEqual(reader.read_last(1), [(3, b"\x03")])
+
+    def test_overwrite_oldest(self):
+        ring = HistoryRing.create(self.path, 3, 16)
+        for i in range(1, 8):
+            ring.append(bytes([i]))
+        reader = HistoryRing(self.path)
+        self.assertEqual([seq for seq, _ in reader.read_since(0)], [5, 6, 7])
+        self.assertIsNone(reader.get(2))
+
+    def test_payload_too_large(self):
+        ring = HistoryRing.create(self.path, 2, 4)
+        with self.assertRaises(ValueError):
+            ring.append(b"12345")
+
+    def test_restart_continues_sequence(self):
+        ring = HistoryRing.create(self.path, 2, 16)
+        ring.append(b"a")
+        ring = HistoryRing.create(self.path, 2, 16, start_seq=ring.head)
+        self.assertEqual(ring.append(b"b"), 2)
+
+    def test_slot_size_for(self):
+        self.assertEqual(slot_size_for(10), 4096)
+        self.assertEqual(slot_size_for(3000), 8192)
+
+
+if __name__ == "__main__":
+    unittest.main()
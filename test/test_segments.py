@@ -0,0 +1,100 @@
+import os
+import glob
+import time
+import tempfile
+import unittest
+
+from tmpfs_framework.recorder import Snapshot
+from tmpfs_framework.segments import SegmentWriter, read_segment, read_segments, list_segments, SUFFIX
+
+
+def snapshot(t):
+    return Snapshot(f"{t}_sensor", t, "sensor", members=[("value", bytes([t % 256]) * 100)])
+
+
+class TestSegments(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        for compression in [None, "zlib", "lzma", "bz2"]:
+            path = os.path.join(self.path, str(compression))
+            writer = SegmentWriter(path, "sensor", chunk_size=1000, compression=compression)
+            for t in range(1, 51):
+                writer(snapshot(t))
+            writer.close()
+            snapshots = list(read_segments(path))
+            self.assertEqual([s.timestamp for s in snapshots], list(range(1, 51)))
+            self.assertEqual(snapshots[4].name, "5_sensor")
+            self.assertEqual(snapshots[4].members, [("value", b"\x05" * 100)])
+
+    def test_rotation_and_time_range(self):
+        writer = SegmentWriter(self.path, "sensor", segment_size=2000, chunk_size=500)
+        for t in range(1, 101):
+            writer.write(snapshot(t))
+        writer.close()
+        self.assertGreater(len(glob.glob(os.path.join(self.path, f"*{SUFFIX}"))), 1)
+        self.assertEqual([s.timestamp for s in read_segments(self.path, start=40, end=45)],
+                         list(range(40, 46)))
+        self.assertEqual(len(list(read_segments(self.path))), 100)
+
+    def test_unclosed_segment(self):
+        writer = SegmentWriter(self.path, "sensor", chunk_size=500)
+        for t in range(1, 21):
+            writer.write(snapshot(t))
+        writer.flush()
+        filename, = glob.glob(os.path.join(self.path, f"*{SUFFIX}"))
+        #simulate crash in the middle of writing a chunk
+        with open(filename, "ab") as fd:
+            fd.write(b"CHNK\x00\xff\xff")
+        self.assertEqual([s.timestamp for s in read_segment(filename)], list(range(1, 21)))
+
+    def test_out_of_order_snapshots(self):
+        #snapshots of several workers arrive late, also after their chunk and segment were written
+        order = [t + d for t in range(0, 100, 4) for d in (2, 0, 3, 1)]
+        writer = SegmentWriter(self.path, "sensor", segment_size=1500, chunk_size=500)
+        for t in order:
+            writer.write(snapshot(t))
+        writer.close()
+        self.assertGreater(len(glob.glob(os.path.join(self.path, f"*{SUFFIX}"))), 1)
+        self.assertEqual([s.timestamp for s in read_segments(self.path)], list(range(100)))
+        self.assertEqual([s.timestamp for s in read_segments(self.path, start=31, end=41)],
+                         list(range(31, 42)))
+
+    def test_segment_names(self):
+        for sensor in ("x", "x.2"):
+            writer = SegmentWriter(self.path, sensor)
+            for _ in range(2):
+                writer.write(Snapshot(f"1_{sensor}", 1, sensor, members=[]))
+                writer.close()
+        self.assertEqual(sorted(list_segments(self.path)), [
+            (1, "x", os.path.join(self.path, f"1.1_x{SUFFIX}")),
+            (1, "x", os.path.join(self.path, f"1_x{SUFFIX}")),
+            (1, "x.2", os.path.join(self.path, f"1.1_x.2{SUFFIX}")),
+            (1, "x.2", os.path.join(self.path, f"1_x.2{SUFFIX}"))])
+        self.assertEqual(len(list(read_segments(self.path, sensor_name="x.2"))), 2)
+
+    def test_flush_interval(self):
+        writer = SegmentWriter(self.path, "sensor", flush_interval=0.05)
+        writer.write(snapshot(1))
+        self.assertEqual(glob.glob(os.path.join(self.path, f"*{SUFFIX}")), [])
+        deadline = time.monotonic() + 2
+        while not list(read_segments(self.path)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([s.timestamp for s in read_segments(self.path)], [1])
+        writer.write(snapshot(2))
+        writer.close()
+        self.assertEqual([s.timestamp for s in read_segments(self.path)], [1, 2])
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            SegmentWriter(self.path, "sensor", compression="zstd")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,21 @@
+import os
+import time
+import zipfile
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, mock_open, Mock
 
+import cbor2
+import numpy as np
+
 
 from tmpfs_framework.sensor_reader import SensorReader
-from tmpfs_framework.sensor_reader import read, SensorNotInitializedError
+from tmpfs_framework.sensor_reader import read, SensorNotInitializedError, LazyZipMapping
+from tmpfs_framework.sensor_reader import SnapshotConsistencyError, get_executor
+from tmpfs_framework import SensorWriter
+from tmpfs_framework.segments import read_segments
+from tmpfs_framework.cbor_utils import write_cbor
 
 
 class TestSensorReader(unittest.TestCase):
@@ -110,6 +122,208 @@ class TestSensorReader(unittest.TestCase):
         self.assertEqual(mock_decoder.return_value.decode.call_count,3)
 
 
+    @patch("os.path.isdir", return_value=False)
+    @patch("tmpfs_framework.sensor_reader.mmap_array", return_value="mapped")
+    @patch("cbor2.CBORDecoder")
+    def test_read_mmap(self, mock_decoder, mock_mmap_array, *args):
+        self.assertEqual(read("test", use_mmap=True), "mapped")
+        mock_mmap_array.assert_called_with("test")
+        mock_decoder.assert_not_called()
+
+    def test_get_value_cached(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "testdir", "testfile"))
+            with open(os.path.join(tmpdir, "testdir", "testfile", "number"), 'wb') as fd:
+                cbor2.dump(42, fd)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir, cache_size=1024)
+            sr.cache.clear()
+            hits = sr.cache_info()["hits"]
+            misses = sr.cache_info()["misses"]
+            self.assertEqual(sr.get_value("number"), 42)
+            self.assertEqual(sr.get_value("number"), 42)
+            self.assertEqual(sr.cache_info()["hits"], hits + 1)
+            self.assertEqual(sr.cache_info()["misses"], misses + 1)
+
+    def test_cached_array_read_only(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "testdir", "testfile"))
+            write_cbor(os.path.join(tmpdir, "testdir", "testfile", "img"), np.zeros(4), tmpfs_path=tmpdir)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir, cache_size=1024)
+            img = sr.get_value("img")
+            with self.assertRaises(ValueError):
+                img[:] = 7
+            np.testing.assert_array_equal(sr.get_value("img"), np.zeros(4))
+            #without cache every read returns a new array
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            sr.get_value("img")[:] = 7
+            np.testing.assert_array_equal(sr.get_value("img"), np.zeros(4))
+
+    def test_cached_nested_array_read_only(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "testdir", "testfile"))
+            write_cbor(os.path.join(tmpdir, "testdir", "testfile", "frame"),
+                       {"img": np.zeros(4), "shape": [2, 2]}, tmpfs_path=tmpdir)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir, cache_size=1024)
+            frame = sr.get_value("frame")
+            with self.assertRaises(ValueError):
+                frame["img"][:] = 7
+            frame["img"] = np.ones(4)
+            frame["shape"].append(3)
+            frame = sr.get_value("frame")
+            np.testing.assert_array_equal(frame["img"], np.zeros(4))
+            self.assertEqual(frame["shape"], [2, 2])
+            self.assertEqual(sr.cache_info()["hits"], 1)
+
+    @patch("os.path.isdir", return_value=False)
+    @patch("zipfile.ZipFile")
+    @patch("cbor2.CBORDecoder")
+    def test_read_zip_lazy(self, mock_decoder, mock_ZipFile, *args):
+        a=MockZipInfo(filename ="main/1/a")
+        b=MockZipInfo(filename ="main/2/b")
+        mock_ZipFile.return_value.infolist = Mock(return_value=[a,b])
+        ret = read("test.zip", lazy=True)
+        self.assertIsInstance(ret, LazyZipMapping)
+        self.assertEqual(list(ret.keys()), ["1","2"])
+        self.assertEqual(mock_decoder.return_value.decode.call_count,0)
+        ret["1"]["a"]
+        ret["1"]["a"]
+        self.assertEqual(mock_decoder.return_value.decode.call_count,1)
+
+    def test_read_zip_lazy_matches_eager(self):
+        file_path = os.path.realpath(os.path.dirname(__file__))
+        zip_test_path = os.path.join(file_path,"test_data/zip_test_2.zip")
+        with read(zip_test_path, lazy=True) as lazy:
+            self.assertEqual(repr(lazy.to_dict()), repr(read(zip_test_path)))
+
+    def _publish(self, tmpdir, value):
+        tmp = os.path.join(tmpdir, "tmp")
+        with open(tmp, 'wb') as fd:
+            cbor2.dump(value, fd)
+        os.rename(tmp, os.path.join(tmpdir, "testdir", "testfile", "number"))
+
+    def test_generation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "testdir", "testfile"))
+            self._publish(tmpdir, 1)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            self.assertTrue(sr.has_changed("number"))
+            self.assertFalse(sr.has_changed("number"))
+            generation = sr.generation("number")
+            self.assertIsNone(sr.read_if_newer("number", generation))
+
+            self._publish(tmpdir, 2)
+            self.assertEqual(sr.read_if_newer("number", generation), (2, generation + 1))
+            self.assertFalse(sr.has_changed("number"))
+
+    def test_wait_for_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "testdir", "testfile"))
+            self._publish(tmpdir, 1)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            sr.has_changed("number")
+            self.assertIsNone(sr.wait_for_update("number", timeout=0.01))
+            timer = threading.Timer(0.01, self._publish, (tmpdir, 2))
+            timer.start()
+            self.assertEqual(sr.wait_for_update("number", timeout=2), 2)
+            timer.join()
+
+    def test_read_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            sw.write("number", 1)
+            sw.write("number_x2", 2)
+            sw.commit()
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            self.assertNotIn("_commit", sr.attributes)
+            self.assertEqual(sr.read_snapshot(), ({"number": 1, "number_x2": 2}, 1))
+
+            #uncommitted write is not mixed with committed generation
+            sw.write("number", 5)
+            with self.assertRaises(SnapshotConsistencyError):
+                sr.read_snapshot(retries=2)
+            self.assertEqual(sr.read_snapshot(["number_x2"]), ({"number_x2": 2}, 1))
+            sw.write("number_x2", 10)
+            sw.commit()
+            self.assertEqual(sr.read_snapshot(), ({"number": 5, "number_x2": 10}, 2))
+            with self.assertRaises(KeyError):
+                sr.read_snapshot(["missing"])
+
+    def test_read_since(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            for i in range(10):
+                sw.write("number", i, history=4)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            self.assertEqual(sr.attributes, ["number", "attributes"])
+            self.assertEqual(sr.read_since("number", 7), [(8, 7), (9, 8), (10, 9)])
+            self.assertEqual(sr.read_last("number", 2), [(9, 8), (10, 9)])
+            seqs, values = sr.read_since("number", 0, stack=True)
+            self.assertEqual(list(seqs), [7, 8, 9, 10])
+            self.assertEqual(list(values), [6, 7, 8, 9])
+
+            #writer restart keeps sequence numbers
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            sw.write("number", 10, history=4)
+            self.assertEqual(sr.read_since("number", 10), [(11, 10)])
+
+    def test_start_write(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            data_dir = os.path.join(tmpdir, "recorded")
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            sw.write("number", 0)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            sr.to_watch = "number"
+            sr.start_write(data_dir, workers=2)
+            for i in range(1, 6):
+                sw.write("number", i)
+                time.sleep(0.01)
+            time.sleep(0.1)
+            sr.stop_watchdog()
+            stats = sr.recording_stats()
+            self.assertGreater(stats["written"], 0)
+            self.assertEqual(stats["written"], len(os.listdir(data_dir)))
+            with zipfile.ZipFile(os.path.join(data_dir, sorted(os.listdir(data_dir))[-1])) as zf:
+                self.assertIn("number", zf.namelist())
+
+    def test_start_write_segments(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            data_dir = os.path.join(tmpdir, "recorded")
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            sw.write("number", 0)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            sr.to_watch = "number"
+            sr.start_write(data_dir, format="segments")
+            for i in range(1, 6):
+                sw.write("number", i)
+                time.sleep(0.01)
+            time.sleep(0.1)
+            sr.stop_watchdog()
+            snapshots = list(read_segments(data_dir))
+            self.assertEqual(len(snapshots), sr.recording_stats()["written"])
+            self.assertEqual(len(os.listdir(data_dir)), 1)
+            self.assertEqual(cbor2.loads(dict(snapshots[-1].members)["number"]), 5)
+
+    def test_parallel_read(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            data = {"a": np.arange(10), "b": {"c": 1, "d": {"e": np.ones((2, 3))}}, "f": "text"}
+            sw.write("tree", data)
+            sw.write_zip("measurement", data)
+            sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir)
+            expected = sr.get_data()
+            for parallel in ["thread", "process", get_executor("thread")]:
+                sr = SensorReader("testdir", "testfile", tmpfs_path=tmpdir, parallel=parallel)
+                result = sr.get_data()
+                self.assertEqual(list(result), list(expected))
+                for name in ("tree", "measurement.zip"):
+                    self.assertEqual(result[name].keys(), data.keys())
+                    np.testing.assert_array_equal(result[name]["a"], data["a"])
+                    np.testing.assert_array_equal(result[name]["b"]["d"]["e"], data["b"]["d"]["e"])
+                    self.assertEqual(result[name]["b"]["c"], 1)
+                    self.assertEqual(result[name]["f"], "text")
+            with self.assertRaises(ValueError):
+                get_executor("gpu")
+
     def test_nonexistent_base_dir(self):
         with self.assertRaises( FileNotFoundError):
             SensorReader("testdir", "testfile")
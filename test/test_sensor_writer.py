@@ -1,6 +1,13 @@
+import os
+import tempfile
+import zipfile
+import threading
 import unittest
 
-from unittest.mock import patch, Mock
+import cbor2
+import numpy as np
+
+from unittest.mock import patch, Mock, MagicMock
 
 import tmpfs_framework
 
@@ -8,6 +15,7 @@ tmpfs_framework.TMPFS_PATH = "/tmp/"
 
 from tmpfs_framework import SensorWriter
 from tmpfs_framework.sensor_writer import pack_to_zip
+from tmpfs_framework.sensor_reader import read
 
 class TestSensorWriter(unittest.TestCase):
 
@@ -44,6 +52,21 @@ class TestSensorWriter(unittest.TestCase):
         sw.write("data", 123, attributes={"meta": "info"})
         self.assertEqual(mock_write_cbor.call_count, 2)
 
+    @patch('pathlib.Path.mkdir')
+    @patch('os.makedirs')
+    @patch("os.stat")
+    @patch("tmpfs_framework.sensor_writer.write_cbor")
+    def test_commit(self, mock_write_cbor, mock_stat, *args):
+        mock_stat.return_value = Mock(st_ino=1, st_mtime_ns=2)
+        sw = SensorWriter("testdir", "testfile")
+        sw.write("a", 1)
+        sw.write("b", {"c": 2})
+        self.assertEqual(sw.commit(), 1)
+        mock_write_cbor.assert_called_with(filename="/tmp/testdir/testfile/.commit",
+            data={"generation": 1, "files": {"a": [1, 2], "b/c": [1, 2]}})
+        self.assertEqual(sw.commit(), 2)
+        self.assertEqual(mock_write_cbor.call_args.kwargs["data"]["generation"], 2)
+
     @patch("tmpfs_framework.sensor_writer.get_temp_file", return_value="test")
     @patch('tmpfs_framework.sensor_writer.os')
     @patch('tmpfs_framework.sensor_writer.Path')
@@ -53,12 +76,14 @@ class TestSensorWriter(unittest.TestCase):
     def test_write_zip_creates_zip(self, mock_write_cbor,mock_ZipFile, mock_path,  mock_os, *args):
         mock_os.path.join = Mock(return_value="ret")
         mock_os.walk = Mock(return_value=(("root","_",("x","y")),))
-        mock_ZipFile.return_value.__enter__.return_value =  Mock()
+        mock_ZipFile.return_value.__enter__.return_value =  MagicMock()
 
         sw = SensorWriter("testdir", "testfile2")
         sw.write_zip("data", {"x": 1, "a":3}, compress=True, keep=True)
         self.assertEqual(mock_write_cbor.call_count, 2)
-        self.assertEqual(mock_ZipFile.return_value.__enter__.return_value.write.call_count, 2)
+        #members are encoded directly into the zip instead of copying the written files
+        mock_os.walk.assert_not_called()
+        self.assertEqual(mock_ZipFile.return_value.__enter__.return_value.open.call_count, 2)
 
         mock_os.rename.assert_called_with("test.zip", "ret.zip")
         mock_ZipFile.assert_called_with('test.zip' ,'w' ,compression=8 ,compresslevel=3   )
@@ -74,6 +99,111 @@ class TestSensorWriter(unittest.TestCase):
         pack_to_zip([], base_dir=tmpfs_framework.TMPFS_PATH, zipname="archive", compress=True)
         mock_ZipFile.assert_called_with('test.zip' ,'w' ,compression=8 ,compresslevel=3   )
 
+    def test_write_zip(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            sw.write_zip("data", {"x": 1, "sub": {"y": [1, 2]}})
+            self.assertEqual(os.listdir(sw.data_path), ["data.zip"])
+            with zipfile.ZipFile(os.path.join(sw.data_path, "data.zip")) as zf:
+                self.assertEqual(sorted(zf.namelist()), ["data/sub/y", "data/x"])
+                self.assertEqual(cbor2.loads(zf.read("data/sub/y")), [1, 2])
+            sw.write("files", {"d": 3, "e": {"f": 4}})
+            pack_to_zip(["files/d", "files/e/f"], base_dir=sw.data_path, data={"a": 1, "b": {"c": 2}})
+            path = os.path.join(sw.data_path, "measurement.zip")
+            with zipfile.ZipFile(path) as zf:
+                self.assertEqual(sorted(zf.namelist()), ["measurement/a", "measurement/b/c",
+                                                         "measurement/files/d", "measurement/files/e/f"])
+            self.assertEqual(read(path), {"a": 1, "b": {"c": 2}, "files": {"d": 3, "e": {"f": 4}}})
+
+    def test_write_encoded(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            content = cbor2.dumps(cbor2.CBORTag(72, np.arange(3, dtype=np.int8).tobytes()))
+            sw.write_encoded("sub/value", content)
+            sw.write_encoded("data.zip", b"zip", ("zip", None, None))
+            with open(os.path.join(sw.data_path, "sub", "value"), 'rb') as fd:
+                self.assertEqual(fd.read(), content)
+            self.assertEqual(sorted(os.listdir(sw.data_path)), ["data.zip", "sub"])
+            self.assertEqual(os.listdir(os.path.join(sw.data_path, "sub")), ["value"])
+            self.assertEqual(sw.registry.lookup("testfile", "sub/value"),
+                             {"kind": "array", "dtype": "|i1", "shape": [3], "generation": 0})
+            self.assertEqual(sw.registry.lookup("testfile", "data.zip")["kind"], "zip")
+            with sw.transaction():
+                sw.write_encoded("sub/value", cbor2.dumps(5))
+            self.assertEqual(read(os.path.join(sw.data_path, "sub")), {"value": 5})
+
+    def test_channel_write(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            for use_tmpfile in (True, False):
+                channel = sw.channel(f"sub/value_{use_tmpfile}", use_tmpfile=use_tmpfile)
+                self.assertIs(sw.channel(f"sub/value_{use_tmpfile}"), channel)
+                for i in range(3):
+                    channel.write({"i": i})
+                with open(channel.path, 'rb') as fd:
+                    self.assertEqual(cbor2.load(fd), {"i": 2})
+                self.assertEqual(os.listdir(channel.tmpdir), [])
+            self.assertEqual(sw._pending, {"sub/value_True", "sub/value_False"})
+
+    def test_transaction(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            #plain directory written before is replaced on first transaction
+            sw.write("pose", {"x": 0, "stale": 0})
+            for i in range(1, 5):
+                with sw.transaction():
+                    sw.write("pose", {"x": i, "sub": {"y": i}})
+                    sw.write("count", i)
+            path = os.path.join(sw.data_path, "pose")
+            self.assertTrue(os.path.islink(path))
+            self.assertEqual(read(path), {"x": 4, "sub": {"y": 4}})
+            self.assertEqual(read(os.path.join(sw.data_path, "count")), 4)
+            #current and previous generation are kept
+            self.assertEqual(len(os.listdir(os.path.join(sw.data_path, ".gen"))), 2)
+
+            with self.assertRaises(ValueError):
+                with sw.transaction():
+                    sw.write("pose", {"x": 5})
+                    raise ValueError()
+            self.assertEqual(read(path)["x"], 4)
+            self.assertEqual(len(os.listdir(os.path.join(sw.data_path, ".gen"))), 2)
+
+            #new writer process removes generations it does not know about
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            with sw.transaction():
+                sw.write("pose", {"x": 6})
+            self.assertEqual(len(os.listdir(os.path.join(sw.data_path, ".gen"))), 2)
+            self.assertEqual(read(path), {"x": 6})
+
+    def test_transaction_consistent_reads(self):
+        with tempfile.TemporaryDirectory() as tmpdir, patch("tmpfs_framework.TMPFS_PATH", tmpdir):
+            sw = SensorWriter("testdir", "testfile", tmpfs_path=tmpdir)
+            path = os.path.join(sw.data_path, "state")
+            with sw.transaction():
+                sw.write("state", {"a": 0, "b": 0})
+            stop = threading.Event()
+            torn = []
+
+            def reader():
+                try:
+                    while not stop.is_set():
+                        value = read(path)
+                        if value["a"] != value["b"]:
+                            torn.append(value)
+                except Exception as e:
+                    torn.append(e)
+
+            thread = threading.Thread(target=reader)
+            thread.start()
+            try:
+                for i in range(200):
+                    with sw.transaction():
+                        sw.write("state", {"a": i, "b": i})
+            finally:
+                stop.set()
+                thread.join()
+            self.assertEqual(torn, [])
+
 
 if __name__ == "__main__":
     unittest.main()
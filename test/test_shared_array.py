@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from tmpfs_framework import SharedArrayWriter, SharedArrayReader
+from tmpfs_framework.sensor_reader import read, SensorReader
+
+
+class TestSharedArray(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.writer = SharedArrayWriter("webcam", "0", "image", (4, 3, 3), np.uint8,
+                                        tmpfs_path=self.tmpdir.name)
+        self.reader = SharedArrayReader(self.writer.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_empty(self):
+        self.assertEqual(self.reader.read(), (None, 0))
+
+    def test_write_read(self):
+        frame = np.arange(36, dtype=np.uint8).reshape(4, 3, 3)
+        self.assertEqual(self.writer.write(frame), 1)
+        array, seq = self.reader.read()
+        np.testing.assert_array_equal(array, frame)
+        self.assertEqual(seq, 1)
+        np.testing.assert_array_equal(read(self.writer.path), frame)
+
+    def test_zero_copy_view_validation(self):
+        self.writer.write(np.zeros((4, 3, 3)))
+        view, seq = self.reader.read(copy=False)
+        self.assertFalse(view.flags.writeable)
+        self.writer.write(np.ones((4, 3, 3)))
+        self.assertTrue(self.reader.is_valid(seq))
+        np.testing.assert_array_equal(view, 0)
+        for _ in range(2):
+            self.writer.write(np.full((4, 3, 3), 2))
+        self.assertFalse(self.reader.is_valid(seq))
+
+    def test_restarted_writer_reuses_file(self):
+        self.writer.write(np.ones((4, 3, 3)))
+        writer = SharedArrayWriter("webcam", "0", "image", (4, 3, 3), np.uint8,
+                                   tmpfs_path=self.tmpdir.name)
+        self.assertEqual(writer.write(np.full((4, 3, 3), 5)), 2)
+        np.testing.assert_array_equal(self.reader.read()[0], 5)
+
+    def test_writer_with_new_shape_replaces_file(self):
+        writer = SharedArrayWriter("webcam", "0", "image", (2, 2), np.float32,
+                                   tmpfs_path=self.tmpdir.name)
+        writer.write(np.eye(2))
+        array, _ = self.reader.read()
+        self.assertEqual(array.dtype, np.float32)
+        np.testing.assert_array_equal(array, np.eye(2))
+        self.assertEqual(os.listdir(os.path.dirname(writer.path)), ["image.shm"])
+
+    def test_sensor_reader_channel(self):
+        sr = SensorReader("webcam", "0", tmpfs_path=self.tmpdir.name, cache_size=2**20)
+        self.assertEqual(sr.generation("image.shm"), 0)
+        self.writer.write(np.ones((4, 3, 3)))
+        self.assertTrue(sr.has_changed("image.shm"))
+        np.testing.assert_array_equal(sr.get_value("image.shm"), 1)
+        self.writer.write(np.full((4, 3, 3), 2))
+        self.assertEqual(sr.wait_for_update("image.shm", timeout=1), 2)
+        self.assertFalse(sr.has_changed("image.shm"))
+        np.testing.assert_array_equal(sr.get_value("image.shm"), 2)
+        self.assertIsNone(sr.wait_for_update("image.shm", timeout=0.05))
+        with self.assertRaises(ValueError):
+            sr.attach_watchdog("image.shm", print)
+
+
+if __name__ == "__main__":
+    unittest.main()